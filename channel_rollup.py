@@ -0,0 +1,32 @@
+# yt-backup command line utility to backup youtube channels easily
+# Copyright (C) 2020  w0d4
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+from sqlalchemy import Column, Integer, BigInteger, ForeignKey, DateTime
+
+from base import Base
+
+
+class ChannelRollup(Base):
+    __tablename__ = 'channel_rollups'
+    channel_id = Column(Integer, ForeignKey('channels.id'), primary_key=True, autoincrement=False)
+    video_count = Column(Integer, nullable=False)
+    downloaded_count = Column(Integer, nullable=False)
+    downloaded_size = Column(BigInteger, nullable=False)
+    queue_count = Column(Integer, nullable=False)
+    copyright_count = Column(Integer, nullable=False)
+    offline_count = Column(Integer, nullable=False)
+    lost_count = Column(Integer, nullable=False)
+    unlisted_count = Column(Integer, nullable=False)
+    updated = Column(DateTime, nullable=False)
@@ -0,0 +1,26 @@
+# yt-backup command line utility to backup youtube channels easily
+# Copyright (C) 2020  w0d4
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+from sqlalchemy import Column, Integer, BigInteger, Date, DateTime
+
+from base import Base
+
+
+class DailyRollup(Base):
+    __tablename__ = 'daily_rollups'
+    rollup_date = Column(Date, primary_key=True)
+    videos_downloaded = Column(Integer, nullable=False)
+    downloaded_size = Column(BigInteger, nullable=False)
+    updated = Column(DateTime, nullable=False)
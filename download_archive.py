@@ -0,0 +1,102 @@
+# yt-backup command line utility to backup youtube channels easily
+# Copyright (C) 2020  w0d4
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import os
+
+
+# In memory index of the youtube-dl download archive file. The file is read once per run.
+# Removed entries are written to a journal next to the archive until the archive file is compacted.
+class DownloadArchive:
+    def __init__(self, path, extractor="youtube"):
+        self.path = path
+        self.journal_path = path + ".removed"
+        self.extractor = extractor
+        self.entries = {}
+        self.tombstones = set()
+        self.load()
+
+    def entry(self, video_id):
+        return self.extractor + " " + str(video_id)
+
+    def load(self):
+        self.entries = dict.fromkeys(self.read_lines(self.path))
+        self.tombstones = set(self.read_lines(self.journal_path))
+        # Removals of an aborted run are still in the journal. youtube-dl only reads the archive file, so apply them now.
+        if len(self.tombstones) > 0:
+            self.compact()
+
+    @staticmethod
+    def read_lines(path):
+        if not os.path.exists(path):
+            return []
+        with open(path, "r") as f:
+            return [line.strip() for line in f if line.strip() != ""]
+
+    def __contains__(self, video_id):
+        return self.entry(video_id) in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add(self, video_id, write=True):
+        entry = self.entry(video_id)
+        if entry in self.tombstones:
+            # Otherwise the journal would remove the entry again, if this run is aborted before compact()
+            self.tombstones.discard(entry)
+            self.write_journal()
+        if entry in self.entries:
+            return
+        self.entries[entry] = None
+        if write:
+            with open(self.path, "a") as f:
+                f.write(entry + "\n")
+
+    def remove(self, video_id):
+        # youtube-dl may have appended the entry during this run without the index knowing it,
+        # so the removal is always journaled. compact() filters the entry from the re-read archive file.
+        entry = self.entry(video_id)
+        self.entries.pop(entry, None)
+        self.tombstones.add(entry)
+        with open(self.journal_path, "a") as f:
+            f.write(entry + "\n")
+
+    def compact(self):
+        # Only call this while no youtube-dl process is running, since they append to the archive file themselves.
+        if len(self.tombstones) == 0:
+            return
+        self.entries = dict.fromkeys(line for line in self.read_lines(self.path) if line not in self.tombstones)
+        self.write()
+        self.tombstones = set()
+        if os.path.exists(self.journal_path):
+            os.remove(self.journal_path)
+
+    def write_journal(self):
+        if len(self.tombstones) == 0:
+            if os.path.exists(self.journal_path):
+                os.remove(self.journal_path)
+            return
+        temporary_path = self.journal_path + ".tmp"
+        with open(temporary_path, "w") as f:
+            for entry in self.tombstones:
+                f.write(entry + "\n")
+        os.replace(temporary_path, self.journal_path)
+
+    def write(self):
+        # Regenerate the flat archive file youtube-dl reads from the index
+        temporary_path = self.path + ".tmp"
+        with open(temporary_path, "w") as f:
+            for entry in self.entries:
+                f.write(entry + "\n")
+        os.replace(temporary_path, self.path)
@@ -0,0 +1,83 @@
+# yt-backup command line utility to backup youtube channels easily
+# Copyright (C) 2020  w0d4
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import json
+import logging
+import threading
+from datetime import datetime, timedelta
+
+import requests
+
+logger = logging.getLogger('yt-backup')
+
+
+# Resolves the public IP and country youtube-dl downloads from, by asking an ipinfo.io compatible endpoint through the proxy.
+# Answers are cached per proxy for ttl_seconds and the last answer is kept in the runtime state, so a new run does not have to ask again.
+# The cache entry of a proxy has to be invalidated when the proxy is restarted, since it will have a new IP afterwards.
+class EgressIdentityResolver:
+    def __init__(self, endpoint="https://ipinfo.io", timeout_seconds=5.0, ttl_seconds=3600, state_store=None):
+        self.endpoint = endpoint
+        self.timeout_seconds = timeout_seconds
+        self.ttl = timedelta(seconds=ttl_seconds)
+        self.state_store = state_store
+        self.lock = threading.Lock()
+        self.identities = {}
+
+    def load(self):
+        if self.state_store is None:
+            return
+        state = self.state_store.get("egress_identity")
+        if state is None:
+            return
+        try:
+            identity = json.loads(state.value)
+            self.identities[identity["proxy"]] = (identity, state.date)
+        except (ValueError, KeyError, TypeError):
+            logger.debug("Ignoring unreadable egress identity in runtime state.")
+
+    def get(self, proxy=""):
+        # Returns a dict with ip and country, or None if the endpoint could not be asked
+        with self.lock:
+            cached = self.identities.get(proxy)
+        if cached is not None and datetime.utcnow() - cached[1] < self.ttl:
+            return cached[0]
+        identity = self.lookup(proxy)
+        if identity is None:
+            return None
+        with self.lock:
+            self.identities[proxy] = (identity, datetime.utcnow().replace(microsecond=0))
+        if self.state_store is not None:
+            self.state_store.set("egress_identity", json.dumps(identity))
+        return identity
+
+    def lookup(self, proxy):
+        proxies = {"http": proxy, "https": proxy} if proxy != "" else None
+        try:
+            r = requests.get(self.endpoint, proxies=proxies, timeout=self.timeout_seconds)
+            r.raise_for_status()
+            answer = r.json()
+            identity = {"proxy": proxy, "ip": answer["ip"], "country": answer.get("country", "")}
+        except (requests.exceptions.RequestException, ValueError, KeyError, TypeError) as e:
+            logger.error("Cannot get current IP and country from " + self.endpoint + ": " + str(e))
+            return None
+        logger.debug("Current IP is " + identity["ip"] + " in country " + identity["country"])
+        return identity
+
+    def invalidate(self, proxy=""):
+        with self.lock:
+            self.identities.pop(proxy, None)
+        if self.state_store is not None:
+            self.state_store.delete("egress_identity")
@@ -0,0 +1,137 @@
+# yt-backup command line utility to backup youtube channels easily
+# Copyright (C) 2020  w0d4
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import sys
+import urllib.error
+
+try:
+    import yt_dlp
+except ImportError:
+    yt_dlp = None
+
+# Outcomes which can be told from the error class alone. Everything else is left to the outcome rules on the error message.
+http_status_outcomes = {403: "video_forbidden", 429: "429", 503: "503"}
+
+
+def get_http_error_classes():
+    http_error_classes = (urllib.error.HTTPError,)
+    try:
+        from yt_dlp.networking.exceptions import HTTPError
+        http_error_classes = http_error_classes + (HTTPError,)
+    except ImportError:
+        pass
+    return http_error_classes
+
+
+def get_error_chain(error):
+    # yt-dlp wraps the original error, e.g. DownloadError -> ExtractorError -> HTTPError
+    chain = []
+    while error is not None and error not in chain and len(chain) < 10:
+        chain.append(error)
+        exc_info = getattr(error, "exc_info", None)
+        if isinstance(exc_info, tuple) and len(exc_info) > 1 and isinstance(exc_info[1], BaseException) and exc_info[1] is not error:
+            error = exc_info[1]
+        elif isinstance(getattr(error, "cause", None), BaseException):
+            error = error.cause
+        else:
+            error = error.__cause__ or error.__context__
+    return chain
+
+
+def get_error_outcome(error):
+    # Returns the download outcome of an error raised inside yt-dlp, or None if the error class does not tell it
+    http_error_classes = get_http_error_classes()
+    for chained_error in get_error_chain(error):
+        if isinstance(chained_error, yt_dlp.utils.GeoRestrictedError):
+            return "copyright"
+        if isinstance(chained_error, http_error_classes):
+            status = getattr(chained_error, "status", None) or getattr(chained_error, "code", None)
+            if status in http_status_outcomes:
+                return http_status_outcomes[status]
+    return None
+
+
+# Passed to yt-dlp as logger. Collects its messages the way the youtube-dl process would have printed them,
+# so the outcome rules can still be used for errors which can not be told from their class.
+# yt-dlp reports errors from within the except block, so the error itself is taken from there.
+class OutputCollector:
+    def __init__(self):
+        self.stdout_lines = []
+        self.stderr_lines = []
+        self.errors = []
+
+    def debug(self, message):
+        self.stdout_lines.append(message)
+
+    def info(self, message):
+        self.stdout_lines.append(message)
+
+    def warning(self, message):
+        self.stderr_lines.append("WARNING: " + message)
+
+    def error(self, message, error=None):
+        # yt-dlp adds the ERROR: prefix itself
+        self.stderr_lines.append(message)
+        self.errors.append((message, error or sys.exc_info()[1]))
+
+
+# Runs yt-dlp inside this process instead of starting a new interpreter for every video.
+# Takes the same options as the youtube-dl binary, so both backends download exactly the same way.
+class EmbeddedDownloader:
+    def __init__(self):
+        if yt_dlp is None:
+            raise ImportError("The embedded downloader needs the yt-dlp python package. Install it with pip install yt-dlp")
+
+    @staticmethod
+    def get_video_file(info):
+        if info is None:
+            return None
+        requested_downloads = info.get("requested_downloads") or []
+        if len(requested_downloads) > 0 and requested_downloads[-1].get("filepath"):
+            return requested_downloads[-1]["filepath"]
+        return info.get("filepath")
+
+    def download(self, arguments, progress_hook=None):
+        # Returns the video file and info dict, and for a failed download the outcome and class of the first error.
+        # The collected output is returned as well, for the outcome rules.
+        parsed_options = yt_dlp.parse_options(arguments)
+        collector = OutputCollector()
+        ydl_options = dict(parsed_options.ydl_opts)
+        ydl_options["logger"] = collector
+        # Progress is reported through the hook, the text progress lines are not needed
+        ydl_options["noprogress"] = True
+        ydl_options["progress_hooks"] = list(ydl_options.get("progress_hooks") or []) + ([progress_hook] if progress_hook is not None else [])
+        info = None
+        with yt_dlp.YoutubeDL(ydl_options) as ydl:
+            for url in parsed_options.urls:
+                try:
+                    info = ydl.extract_info(url, download=True)
+                except yt_dlp.utils.DownloadError as e:
+                    # Only raised without --ignore-errors, the message was logged through the collector already
+                    if str(e) not in collector.stderr_lines:
+                        collector.error(str(e), e)
+        result = {"video_file": self.get_video_file(info), "info": info, "failed": len(collector.errors) > 0, "outcome": None, "error_class": None,
+                  "stdout": "\n".join(collector.stdout_lines), "stderr": "\n".join(collector.stderr_lines)}
+        for message, error in collector.errors:
+            if error is None:
+                continue
+            outcome = get_error_outcome(error)
+            if result["error_class"] is None or outcome is not None:
+                result["error_class"] = type(get_error_chain(error)[-1]).__name__
+            if outcome is not None:
+                result["outcome"] = outcome
+                break
+        return result
@@ -0,0 +1,156 @@
+# yt-backup command line utility to backup youtube channels easily
+# Copyright (C) 2020  w0d4
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+# Minimal Prometheus text format metrics, so no client library is needed.
+# Metrics are kept in memory and either served over HTTP or written to a file for the node_exporter textfile collector.
+class Metric:
+    metric_type = "untyped"
+
+    def __init__(self, name, documentation, label_names=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def label_values(self, labels):
+        return tuple(str(labels.get(label_name, "")) for label_name in self.label_names)
+
+    def format_labels(self, label_values, extra_labels=()):
+        labels = list(zip(self.label_names, label_values)) + list(extra_labels)
+        if len(labels) == 0:
+            return ""
+        return "{" + ",".join(name + "=\"" + value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n") + "\"" for name, value in labels) + "}"
+
+    def samples(self):
+        with self.lock:
+            return [(self.name + self.format_labels(label_values), value) for label_values, value in sorted(self.values.items())]
+
+    def render(self):
+        lines = ["# HELP " + self.name + " " + self.documentation, "# TYPE " + self.name + " " + self.metric_type]
+        lines += [sample_name + " " + repr(float(value)) for sample_name, value in self.samples()]
+        return "\n".join(lines) + "\n"
+
+
+class Counter(Metric):
+    metric_type = "counter"
+
+    def inc(self, amount=1, **labels):
+        label_values = self.label_values(labels)
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+
+class Gauge(Metric):
+    metric_type = "gauge"
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[self.label_values(labels)] = value
+
+
+class Histogram(Metric):
+    metric_type = "histogram"
+
+    def __init__(self, name, documentation, label_names=(), buckets=(0.1, 0.5, 1, 5, 10, 30, 60, 300, 900, 3600)):
+        super().__init__(name, documentation, label_names)
+        self.buckets = sorted(buckets)
+
+    def observe(self, value, **labels):
+        label_values = self.label_values(labels)
+        with self.lock:
+            bucket_counts, observed_sum, count = self.values.get(label_values, ([0] * len(self.buckets), 0, 0))
+            bucket_counts = [bucket_count + (1 if value <= bucket else 0) for bucket, bucket_count in zip(self.buckets, bucket_counts)]
+            self.values[label_values] = (bucket_counts, observed_sum + value, count + 1)
+
+    def samples(self):
+        samples = []
+        with self.lock:
+            for label_values, (bucket_counts, observed_sum, count) in sorted(self.values.items()):
+                for bucket, bucket_count in zip(self.buckets, bucket_counts):
+                    samples.append((self.name + "_bucket" + self.format_labels(label_values, [("le", repr(float(bucket)))]), bucket_count))
+                samples.append((self.name + "_bucket" + self.format_labels(label_values, [("le", "+Inf")]), count))
+                samples.append((self.name + "_sum" + self.format_labels(label_values), observed_sum))
+                samples.append((self.name + "_count" + self.format_labels(label_values), count))
+        return samples
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        return "".join(metric.render() for metric in self.metrics)
+
+    def write_textfile(self, path):
+        # Written to a temporary file first, so the textfile collector never reads half a file
+        temporary_path = path + ".tmp"
+        with open(temporary_path, "w") as f:
+            f.write(self.render())
+        os.replace(temporary_path, path)
+
+    def start_http_server(self, address, port):
+        registry = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = registry.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                return
+
+        server = ThreadingHTTPServer((address, port), MetricsHandler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+    def start_textfile_writer(self, path, interval_seconds):
+        def write_periodically(stop_event):
+            while not stop_event.wait(interval_seconds):
+                self.write_textfile(path)
+
+        stop_event = threading.Event()
+        threading.Thread(target=write_periodically, args=(stop_event,), daemon=True).start()
+        return stop_event
+
+
+registry = MetricsRegistry()
+downloads = registry.register(Counter("yt_backup_downloads_total", "Finished youtube-dl runs by outcome", ["outcome"]))
+download_duration = registry.register(Histogram("yt_backup_download_duration_seconds", "Duration of youtube-dl runs"))
+downloaded_bytes = registry.register(Counter("yt_backup_downloaded_bytes_total", "Size of all downloaded videos"))
+download_speed = registry.register(Gauge("yt_backup_download_speed_bytes_per_second", "Current download speed reported by youtube-dl", ["worker"]))
+download_eta = registry.register(Gauge("yt_backup_download_eta_seconds", "Remaining time of the current download reported by youtube-dl", ["worker"]))
+download_progress = registry.register(Gauge("yt_backup_download_progress_ratio", "Progress of the current download reported by youtube-dl", ["worker"]))
+youtube_dl_aborts = registry.register(Counter("yt_backup_youtube_dl_aborts_total", "youtube-dl runs stopped early because of a fatal message", ["pattern"]))
+download_queue_depth = registry.register(Gauge("yt_backup_download_queue_depth", "Videos left in the download queue of the current run"))
+uploads = registry.register(Counter("yt_backup_uploads_total", "Finished rclone uploads by result", ["result"]))
+upload_duration = registry.register(Histogram("yt_backup_upload_duration_seconds", "Duration of rclone uploads"))
+api_requests = registry.register(Counter("yt_backup_api_requests_total", "Youtube API requests by result", ["result"]))
+api_request_duration = registry.register(Histogram("yt_backup_api_request_duration_seconds", "Latency of youtube API requests", buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)))
+api_quota_used = registry.register(Counter("yt_backup_api_quota_used_total", "Youtube API quota used by this process"))
@@ -0,0 +1,126 @@
+# yt-backup command line utility to backup youtube channels easily
+# Copyright (C) 2020  w0d4
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import logging
+from datetime import datetime
+
+from sqlalchemy import inspect, select, text
+
+from channel import Channel
+from channel_rollup import ChannelRollup
+from daily_rollup import DailyRollup
+from operation import Operation
+from playlist import Playlist
+from runtime_state import RuntimeState
+from statistic import Statistic
+from video import Video
+
+logger = logging.getLogger('yt-backup')
+
+
+# Every migration checks the current schema before changing it, so it can run again after an aborted run or on a database created by create_all().
+def add_column(engine, model, column_name):
+    table_name = model.__tablename__
+    if column_name in [column["name"] for column in inspect(engine).get_columns(table_name)]:
+        logger.debug("Column " + table_name + "." + column_name + " is already existing.")
+        return
+    column_type = model.__table__.c[column_name].type.compile(dialect=engine.dialect)
+    with engine.begin() as con:
+        con.execute(text("ALTER TABLE " + table_name + " ADD " + column_name + " " + column_type + " NULL"))
+    logger.info("Added column " + table_name + "." + column_name)
+
+
+def add_indexes(engine, model, *index_names):
+    existing_index_names = [index["name"] for index in inspect(engine).get_indexes(model.__tablename__)]
+    for index in model.__table__.indexes:
+        if index.name not in index_names:
+            continue
+        if index.name in existing_index_names:
+            logger.debug("Index " + index.name + " is already existing.")
+            continue
+        logger.info("Creating index " + index.name + " on " + model.__tablename__ + ". This can take a while on big tables.")
+        index.create(bind=engine)
+
+
+def add_hot_path_indexes(engine):
+    add_indexes(engine, Video, "ix_videos_download_queue", "ix_videos_playlist_state", "ix_videos_downloaded")
+    add_indexes(engine, Statistic, "ix_statistics_type_date")
+    add_indexes(engine, Operation, "ix_operations_type_date")
+    add_indexes(engine, Playlist, "ix_playlists_channel_id")
+
+
+def add_last_synced(engine):
+    # Playlists with an etag were synced by get_video_infos before. Without a date all of them would be due at once with the full paging cost.
+    add_column(engine, Playlist, "last_synced")
+    playlists = Playlist.__table__
+    with engine.begin() as con:
+        con.execute(playlists.update().where(playlists.c.last_synced == None).where(playlists.c.etag != None).values(last_synced=datetime.utcnow().replace(microsecond=0)))
+
+
+def move_runtime_state(engine):
+    # status, currently_downloading, quota and 429 state were single rows in statistics before
+    RuntimeState.__table__.create(bind=engine, checkfirst=True)
+    statistics = Statistic.__table__
+    runtime_state = RuntimeState.__table__
+    state_types = ["status", "currently_downloading", "http_429_state", "quota_exceeded_state"]
+    with engine.begin() as con:
+        existing_state_types = [state_type for (state_type,) in con.execute(select([runtime_state.c.state_type]))]
+        rows = con.execute(select([statistics.c.statistic_type, statistics.c.statistic_value, statistics.c.statistic_date]).where(statistics.c.statistic_type.in_(state_types))).fetchall()
+        for state_type, state_value, state_date in rows:
+            if state_type in existing_state_types:
+                continue
+            con.execute(runtime_state.insert().values(state_type=state_type, state_value=state_value, state_date=state_date))
+            existing_state_types.append(state_type)
+        con.execute(statistics.delete().where(statistics.c.statistic_type.in_(state_types)))
+    logger.info("Moved runtime state from statistics to runtime_state table.")
+
+
+# Data model version and the migration which brings the database to it
+migrations = [
+    (1, lambda engine: (add_column(engine, Playlist, "download_from_date"), add_column(engine, Video, "upload_date"))),
+    (2, lambda engine: add_column(engine, Channel, "offline")),
+    (3, lambda engine: add_column(engine, Playlist, "etag")),
+    (4, lambda engine: add_column(engine, Channel, "channel_country")),
+    (5, add_last_synced),
+    (6, lambda engine: add_column(engine, Video, "discovered")),
+    (7, add_hot_path_indexes),
+    (8, move_runtime_state),
+    (9, lambda engine: (ChannelRollup.__table__.create(bind=engine, checkfirst=True), DailyRollup.__table__.create(bind=engine, checkfirst=True))),
+    (10, lambda engine: (add_column(engine, Video, "video_format"), add_column(engine, Video, "video_codec"), add_column(engine, Video, "audio_codec"))),
+]
+
+
+def migrate(engine, session):
+    # Returns the versions which were applied, so the caller can fill new columns afterwards
+    data_model_version_stat = session.query(Statistic).filter(Statistic.statistic_type == "data_model_version").scalar()
+    if data_model_version_stat is None:
+        data_model_version_stat = Statistic()
+        data_model_version_stat.statistic_type = "data_model_version"
+        current_data_model_version = 0
+    else:
+        current_data_model_version = int(data_model_version_stat.statistic_value)
+    logger.debug("Current data model: v" + str(current_data_model_version))
+    applied_versions = []
+    for version, migration in migrations:
+        if version <= current_data_model_version:
+            continue
+        logger.info("Updating data model to v" + str(version))
+        migration(engine)
+        data_model_version_stat.statistic_value = str(version)
+        data_model_version_stat.statistic_date = datetime.utcnow().replace(microsecond=0)
+        session.add(data_model_version_stat)
+        session.commit()
+        applied_versions.append(version)
+    return applied_versions
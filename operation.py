@@ -13,13 +13,14 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
-from sqlalchemy import Column, String, Integer, Text, DateTime
+from sqlalchemy import Column, String, Integer, Text, DateTime, Index
 
 from base import Base
 
 
 class Operation(Base):
     __tablename__ = 'operations'
+    __table_args__ = (Index('ix_operations_type_date', 'operation_type', 'operation_date'),)
     id = Column(Integer, primary_key=True)
     operation_date = Column(DateTime, nullable=False)
     duration = Column(Integer, nullable=False)
@@ -0,0 +1,101 @@
+# yt-backup command line utility to backup youtube channels easily
+# Copyright (C) 2020  w0d4
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import re
+
+# Outcome of a youtube-dl run which did not download a new video
+outcomes = ("copyright", "video_forbidden", "429", "503", "hate_speech", "removed_by_uploader", "offline", "exists_already")
+
+# Rules are checked in this order and the first matching rule decides the outcome.
+# "downloaded" stops the checks and takes the video file from the youtube-dl output, like a run without any matching rule.
+# Rules with on_success are checked for successful runs too, all other rules only when youtube-dl failed.
+# Rules with abort stop youtube-dl as soon as the message shows up in an ERROR: line, since its retries will not change the outcome anymore.
+# Warnings never abort. youtube-dl finishes the video after e.g. "WARNING: Unable to download video subtitles ...: HTTP Error 429".
+default_rules = [
+    {"outcome": "copyright", "pattern": "who has blocked it on copyright", "message": "This video is blocked due to copyright reasons.", "abort": True},
+    {"outcome": "copyright", "pattern": "who has blocked it in your country on copyright grounds", "message": "This video is blocked in your country due to copyright reasons.", "abort": True},
+    {"outcome": "video_forbidden", "pattern": "unable to download video data: HTTP Error 403: Forbidden", "message": "This video could not be downloaded"},
+    {"outcome": "video_forbidden", "pattern": "HTTP Error 403: Forbidden", "message": "Something could not be downloaded for video {video_id}"},
+    {"outcome": "video_forbidden", "stream": "stdout", "pattern": "Got server HTTP error: Downloaded", "message": "Something could not be downloaded for video {video_id}"},
+    {"outcome": "429", "pattern": "HTTP Error 429", "message": "Got HTTP 429 error. Stopping here for today.", "abort": True},
+    {"outcome": "503", "pattern": "HTTP Error 503", "message": "Got HTTP 503 error. Will sleep for a while and continue with next video. This video will be downloaded again next run."},
+    {"outcome": "hate_speech", "pattern": "This video has been removed for violating YouTube's policy on hate speech", "message": "This video is blocked in your current country. Try again from different country.", "abort": True},
+    {"outcome": "hate_speech", "pattern": "This video has been removed for violating YouTube's Community Guidelines", "message": "This video is blocked in your current country. Try again from different country.", "abort": True},
+    {"outcome": "removed_by_uploader", "pattern": "This video has been removed by the uploader", "message": "This video has been removed by uploader", "abort": True},
+    {"outcome": "offline", "pattern": "This video is not available", "message": "This video is not available anymore", "abort": True},
+    {"outcome": "offline", "pattern": "Video unavailable", "message": "This video is not available anymore", "abort": True},
+    {"outcome": "offline", "pattern": "This video has been removed", "message": "This video has been removed", "abort": True},
+    {"outcome": "downloaded", "pattern": "WARNING: video doesn't have subtitles"},
+    {"outcome": "offline", "pattern": "Unable to extract video data", "message": "This video has been removed"},
+    {"outcome": "video_forbidden", "pattern": "Playback on other websites has been disabled by the video owner", "message": "Playback on other websites has been disabled by the video owner", "abort": True},
+    {"outcome": "exists_already", "stream": "stdout", "pattern": "has already been recorded in archive", "message": "The video is already in youtube-dl archive file. We assume video is already downloaded. If not, remove from archive file.", "on_success": True},
+    {"outcome": "exists_already", "stream": "stdout", "pattern": "has already been recorded in the archive", "message": "The video is already in youtube-dl archive file. We assume video is already downloaded. If not, remove from archive file.", "on_success": True},
+]
+
+
+class OutcomeRule:
+    def __init__(self, settings):
+        self.outcome = settings["outcome"]
+        if self.outcome not in outcomes and self.outcome != "downloaded":
+            raise ValueError("Unknown download outcome " + str(self.outcome) + " in rule for " + repr(settings.get("pattern")) + ". Possible values: " + ", ".join(outcomes + ("downloaded",)))
+        self.stream = settings.get("stream", "stderr")
+        if self.stream not in ("stdout", "stderr"):
+            raise ValueError("Unknown youtube-dl output stream " + str(self.stream) + ". Possible values: stdout, stderr")
+        self.pattern = settings["pattern"]
+        # Plain text by default, so messages with brackets or dots can be copied from the youtube-dl output as they are
+        self.regex = re.compile(self.pattern) if settings.get("regex", False) else None
+        self.message = settings.get("message")
+        self.abort = bool(settings.get("abort", False))
+        self.on_success = bool(settings.get("on_success", False))
+
+    def matches(self, text):
+        if self.regex is not None:
+            return self.regex.search(text) is not None
+        return self.pattern in text
+
+
+# Rules of one kind in table order. Substring checks are much faster than one big alternation with the re module,
+# so plain text rules are checked with "in" and only regex rules use a compiled pattern.
+class RuleSet:
+    def __init__(self, rules):
+        self.rules = rules
+
+    def match(self, stream_texts):
+        for rule in self.rules:
+            text = stream_texts.get(rule.stream)
+            if text and rule.matches(text):
+                return rule
+        return None
+
+
+class OutcomeClassifier:
+    def __init__(self, custom_rules=()):
+        # Custom rules from the config are checked before the built in ones, so they can override them
+        self.rules = [OutcomeRule(settings) for settings in list(custom_rules) + default_rules]
+        self.failure_rules = RuleSet(self.rules)
+        self.success_rules = RuleSet([rule for rule in self.rules if rule.on_success])
+        self.abort_rules = RuleSet([rule for rule in self.rules if rule.abort])
+
+    def classify(self, stdout, stderr, failed):
+        # Returns the matching rule or None, if the video file has to be taken from the youtube-dl output
+        rule_set = self.failure_rules if failed else self.success_rules
+        return rule_set.match({"stdout": stdout, "stderr": stderr})
+
+    def abort_rule(self, stream, line):
+        # Returns the rule which makes further waiting for this youtube-dl run useless
+        if not line.startswith("ERROR:"):
+            return None
+        return self.abort_rules.match({stream: line})
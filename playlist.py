@@ -13,13 +13,14 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
-from sqlalchemy import Column, String, Integer, ForeignKey, DateTime
+from sqlalchemy import Column, String, Integer, ForeignKey, DateTime, Index
 
 from base import Base
 
 
 class Playlist(Base):
     __tablename__ = 'playlists'
+    __table_args__ = (Index('ix_playlists_channel_id', 'channel_id'),)
     id = Column(Integer, primary_key=True)
     playlist_id = Column(String(255), nullable=False, unique=True)
     playlist_name = Column(String(255), nullable=False)
@@ -28,3 +29,4 @@ class Playlist(Base):
     channel_id = Column(Integer, ForeignKey('channels.id'), nullable=False)
     download_from_date = Column(DateTime)
     etag = Column(String(255))
+    last_synced = Column(DateTime)
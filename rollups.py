@@ -0,0 +1,111 @@
+# yt-backup command line utility to backup youtube channels easily
+# Copyright (C) 2020  w0d4
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+from datetime import datetime, timedelta
+
+from sqlalchemy import BigInteger, and_, case, cast, func
+
+from channel import Channel
+from channel_rollup import ChannelRollup
+from daily_rollup import DailyRollup
+from playlist import Playlist
+from video import Video
+
+rollup_id_chunk_size = 1000
+
+
+# Keeps the per channel and per day counts of the dashboards up to date.
+# Changes only mark the affected channels and days. refresh() recounts just those with indexed queries, so the rollups cannot drift.
+class RollupTracker:
+    def __init__(self, session, video_status):
+        self.session = session
+        self.video_status = video_status
+        self.dirty_channel_ids = set()
+        self.dirty_dates = set()
+
+    def mark_channels(self, local_channel_ids):
+        self.dirty_channel_ids.update(local_channel_ids)
+
+    def mark_playlists(self, local_playlist_ids):
+        local_playlist_ids = list(local_playlist_ids)
+        for i in range(0, len(local_playlist_ids), rollup_id_chunk_size):
+            self.dirty_channel_ids.update(local_channel_id for (local_channel_id,) in self.session.query(Playlist.channel_id).filter(Playlist.id.in_(local_playlist_ids[i:i + rollup_id_chunk_size])).distinct())
+
+    def mark_videos(self, video_ids):
+        video_ids = list(video_ids)
+        for i in range(0, len(video_ids), rollup_id_chunk_size):
+            channel_ids = self.session.query(Playlist.channel_id).join(Video, Video.playlist == Playlist.id).filter(Video.video_id.in_(video_ids[i:i + rollup_id_chunk_size])).distinct()
+            self.dirty_channel_ids.update(local_channel_id for (local_channel_id,) in channel_ids)
+
+    def mark_dates(self, dates):
+        self.dirty_dates.update(dates)
+
+    def channel_counts(self):
+        offline_states = [self.video_status["offline"], self.video_status["hate_speech"]]
+        downloaded = Video.downloaded != None
+        return [
+            func.count(Video.id),
+            func.count(Video.downloaded),
+            func.sum(case([(downloaded, cast(Video.size, BigInteger))], else_=0)),
+            func.sum(case([(and_(Video.downloaded == None, Video.download_required == 1, Video.copyright == None, Video.online == self.video_status["online"]), 1)], else_=0)),
+            func.sum(case([(and_(Video.downloaded == None, Video.download_required == 1, Video.copyright != None), 1)], else_=0)),
+            func.sum(case([(Video.online.in_(offline_states), 1)], else_=0)),
+            func.sum(case([(and_(Video.downloaded == None, Video.online.in_(offline_states)), 1)], else_=0)),
+            func.sum(case([(Video.online == self.video_status["unlisted"], 1)], else_=0)),
+        ]
+
+    def refresh_channels(self, local_channel_ids):
+        updated = datetime.utcnow().replace(microsecond=0)
+        count_names = ["video_count", "downloaded_count", "downloaded_size", "queue_count", "copyright_count", "offline_count", "lost_count", "unlisted_count"]
+        for i in range(0, len(local_channel_ids), rollup_id_chunk_size):
+            chunk = local_channel_ids[i:i + rollup_id_chunk_size]
+            rows = {local_channel_id: dict(zip(count_names, [int(count or 0) for count in counts]), channel_id=local_channel_id, updated=updated) for local_channel_id, *counts in
+                    self.session.query(Playlist.channel_id, *self.channel_counts()).join(Video, Video.playlist == Playlist.id).filter(Playlist.channel_id.in_(chunk)).group_by(Playlist.channel_id)}
+            for local_channel_id in chunk:
+                rows.setdefault(local_channel_id, dict(dict.fromkeys(count_names, 0), channel_id=local_channel_id, updated=updated))
+            self.session.query(ChannelRollup).filter(ChannelRollup.channel_id.in_(chunk)).delete(synchronize_session=False)
+            self.session.bulk_insert_mappings(ChannelRollup, list(rows.values()))
+
+    def refresh_dates(self, dates):
+        updated = datetime.utcnow().replace(microsecond=0)
+        rows = []
+        for date in dates:
+            videos_downloaded, downloaded_size = self.session.query(func.count(Video.id), func.sum(cast(Video.size, BigInteger))).filter(Video.downloaded >= date).filter(Video.downloaded < date + timedelta(days=1)).one()
+            rows.append({"rollup_date": date, "videos_downloaded": videos_downloaded, "downloaded_size": int(downloaded_size or 0), "updated": updated})
+        self.session.query(DailyRollup).filter(DailyRollup.rollup_date.in_(dates)).delete(synchronize_session=False)
+        self.session.bulk_insert_mappings(DailyRollup, [row for row in rows if row["videos_downloaded"] > 0])
+
+    def refresh(self):
+        if len(self.dirty_channel_ids) + len(self.dirty_dates) == 0:
+            return
+        self.refresh_channels(sorted(self.dirty_channel_ids))
+        self.refresh_dates(sorted(self.dirty_dates))
+        self.session.commit()
+        self.dirty_channel_ids = set()
+        self.dirty_dates = set()
+
+    def rebuild(self):
+        # Repair mode: recounts everything with one pass per rollup table
+        self.refresh_channels([local_channel_id for (local_channel_id,) in self.session.query(Channel.id)])
+        self.session.query(ChannelRollup).filter(~ChannelRollup.channel_id.in_(self.session.query(Channel.id))).delete(synchronize_session=False)
+        updated = datetime.utcnow().replace(microsecond=0)
+        download_date = func.date(Video.downloaded)
+        rows = [{"rollup_date": datetime.strptime(str(rollup_date)[0:10], '%Y-%m-%d').date(), "videos_downloaded": videos_downloaded, "downloaded_size": int(downloaded_size or 0), "updated": updated} for rollup_date, videos_downloaded, downloaded_size in
+                self.session.query(download_date, func.count(Video.id), func.sum(cast(Video.size, BigInteger))).filter(Video.downloaded != None).group_by(download_date)]
+        self.session.query(DailyRollup).delete(synchronize_session=False)
+        self.session.bulk_insert_mappings(DailyRollup, rows)
+        self.session.commit()
+        self.dirty_channel_ids = set()
+        self.dirty_dates = set()
@@ -0,0 +1,121 @@
+# yt-backup command line utility to backup youtube channels easily
+# Copyright (C) 2020  w0d4
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+from collections import OrderedDict, deque
+from datetime import datetime, timedelta
+
+
+# Decides in which order the videos of the download queue are downloaded.
+# Every scheduler gets the queued videos with add() and hands them out again with next_video(), which must respect the parallel download limit per channel.
+class FifoScheduler:
+    def __init__(self, settings, now=None):
+        self.settings = settings
+        self.now = now or datetime.utcnow()
+        self.queued_videos_by_channel = OrderedDict()
+        self.fast_lane_video_ids = set()
+        self.videos_queued = 0
+
+    def __len__(self):
+        return self.videos_queued
+
+    def add(self, internal_video_id, local_channel_id, channel_priority=1.0, upload_date=None, discovered=None):
+        self.queued_videos_by_channel.setdefault(local_channel_id, deque()).append(internal_video_id)
+        self.videos_queued += 1
+
+    def in_fast_lane(self, internal_video_id):
+        return internal_video_id in self.fast_lane_video_ids
+
+    def next_video(self, running_downloads_per_channel, max_workers_per_channel):
+        # Take the next video of the first channel which has not reached its parallel download limit yet
+        for local_channel_id, queued_videos in self.queued_videos_by_channel.items():
+            if running_downloads_per_channel.get(local_channel_id, 0) >= max_workers_per_channel:
+                continue
+            internal_video_id = queued_videos.popleft()
+            if len(queued_videos) == 0:
+                del self.queued_videos_by_channel[local_channel_id]
+            self.videos_queued -= 1
+            return internal_video_id
+        return None
+
+
+# Orders the videos of every channel by recency of the upload date and the priority of their channel.
+# Channels take turns, since every video started for a channel lowers the score of its next video by fairness_weight.
+# Videos which were uploaded and discovered within the last fast_lane_hours are downloaded before everything else.
+class WeightedScheduler(FifoScheduler):
+    def __init__(self, settings, now=None):
+        super().__init__(settings, now)
+        self.recency_weight = float(settings.get("recency_weight", 1.0))
+        self.recency_half_life_days = max(float(settings.get("recency_half_life_days", 30)), 0.001)
+        self.channel_priority_weight = float(settings.get("channel_priority_weight", 1.0))
+        self.fairness_weight = float(settings.get("fairness_weight", 1.0))
+        self.fast_lane_since = self.now - timedelta(hours=float(settings.get("fast_lane_hours", 24)))
+        self.videos_started_per_channel = {}
+        self.sorted = True
+
+    def score(self, channel_priority, upload_date):
+        if upload_date is None:
+            recency = 0.0
+        else:
+            age_in_days = max((self.now - upload_date).total_seconds() / 86400, 0)
+            recency = 0.5 ** (age_in_days / self.recency_half_life_days)
+        return self.recency_weight * recency + self.channel_priority_weight * channel_priority
+
+    def add(self, internal_video_id, local_channel_id, channel_priority=1.0, upload_date=None, discovered=None):
+        # A backfill of a newly added channel is discovered right now as well, so the upload date has to be new too
+        fast_lane = discovered is not None and upload_date is not None and discovered >= self.fast_lane_since and upload_date >= self.fast_lane_since
+        if fast_lane:
+            self.fast_lane_video_ids.add(internal_video_id)
+        self.queued_videos_by_channel.setdefault(local_channel_id, []).append((fast_lane, self.score(channel_priority, upload_date), internal_video_id))
+        self.videos_queued += 1
+        self.sorted = False
+
+    def sort(self):
+        for local_channel_id, queued_videos in self.queued_videos_by_channel.items():
+            # Sorted ascending, so the best video of a channel can be popped from the end
+            queued_videos.sort()
+        self.sorted = True
+
+    def next_video(self, running_downloads_per_channel, max_workers_per_channel):
+        if not self.sorted:
+            self.sort()
+        best_channel_id = None
+        best_key = None
+        for local_channel_id, queued_videos in self.queued_videos_by_channel.items():
+            if running_downloads_per_channel.get(local_channel_id, 0) >= max_workers_per_channel:
+                continue
+            fast_lane, score, internal_video_id = queued_videos[-1]
+            key = (fast_lane, score - self.fairness_weight * self.videos_started_per_channel.get(local_channel_id, 0))
+            if best_key is None or key > best_key:
+                best_channel_id = local_channel_id
+                best_key = key
+        if best_channel_id is None:
+            return None
+        queued_videos = self.queued_videos_by_channel[best_channel_id]
+        internal_video_id = queued_videos.pop()[2]
+        if len(queued_videos) == 0:
+            del self.queued_videos_by_channel[best_channel_id]
+        self.videos_started_per_channel[best_channel_id] = self.videos_started_per_channel.get(best_channel_id, 0) + 1
+        self.videos_queued -= 1
+        return internal_video_id
+
+
+schedulers = {"fifo": FifoScheduler, "weighted": WeightedScheduler}
+
+
+def get_scheduler(settings, now=None):
+    strategy = settings.get("strategy", "weighted")
+    if strategy not in schedulers:
+        raise ValueError("Unknown download scheduler " + str(strategy) + ". Possible values: " + ", ".join(schedulers))
+    return schedulers[strategy](settings, now)
@@ -0,0 +1,116 @@
+# yt-backup command line utility to backup youtube channels easily
+# Copyright (C) 2020  w0d4
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime
+
+from sqlalchemy import select
+
+from runtime_state import RuntimeState
+
+State = namedtuple("State", ["value", "date"])
+
+
+# In process cache of the runtime_state table. Reads never touch the database.
+# States which another yt-backup process may change while this one runs, like the 429 and quota state, have to be refreshed before decisions are based on them.
+# Writes go to the database right away, or for frequently changing values like the status at most once per debounce interval.
+# The database is written with its own connections, so the debounce timer thread never uses the session of the main thread.
+class StateStore:
+    def __init__(self, engine, debounce_seconds=1.0):
+        self.engine = engine
+        self.debounce_seconds = debounce_seconds
+        self.table = RuntimeState.__table__
+        # Reentrant, since the Ctrl+C handler flushes in the main thread, which may hold the lock at that moment
+        self.lock = threading.RLock()
+        self.states = {}
+        self.pending_states = {}
+        self.flush_timer = None
+        self.loaded_at = None
+        self.refreshed_at = {}
+
+    def load(self):
+        with self.engine.connect() as con:
+            rows = con.execute(select([self.table.c.state_type, self.table.c.state_value, self.table.c.state_date])).fetchall()
+        with self.lock:
+            self.states = {state_type: State(state_value, state_date) for state_type, state_value, state_date in rows}
+            self.loaded_at = time.monotonic()
+            self.refreshed_at = {}
+
+    def refresh(self, state_types, max_age_seconds=0):
+        # Reads the given states from the database again, if they were read more than max_age_seconds ago
+        now = time.monotonic()
+        with self.lock:
+            state_types = [state_type for state_type in state_types if self.loaded_at is None or now - self.refreshed_at.get(state_type, self.loaded_at) >= max_age_seconds]
+        if len(state_types) == 0:
+            return
+        with self.engine.connect() as con:
+            rows = con.execute(select([self.table.c.state_type, self.table.c.state_value, self.table.c.state_date]).where(self.table.c.state_type.in_(state_types))).fetchall()
+        states = {state_type: State(state_value, state_date) for state_type, state_value, state_date in rows}
+        with self.lock:
+            for state_type in state_types:
+                self.refreshed_at[state_type] = now
+                # A value of this process which is not written yet is newer than the database
+                if state_type in self.pending_states:
+                    continue
+                if state_type in states:
+                    self.states[state_type] = states[state_type]
+                else:
+                    self.states.pop(state_type, None)
+
+    def get(self, state_type):
+        with self.lock:
+            return self.states.get(state_type)
+
+    def set(self, state_type, value, debounce=False):
+        state = State(value, datetime.utcnow().replace(microsecond=0))
+        with self.lock:
+            if debounce and state_type in self.states and self.states[state_type].value == value:
+                return
+            self.states[state_type] = state
+            if debounce:
+                self.pending_states[state_type] = state
+                if self.flush_timer is None:
+                    self.flush_timer = threading.Timer(self.debounce_seconds, self.flush)
+                    self.flush_timer.daemon = True
+                    self.flush_timer.start()
+                return
+            self.pending_states.pop(state_type, None)
+        self.write({state_type: state})
+
+    def delete(self, state_type):
+        with self.lock:
+            self.states.pop(state_type, None)
+            self.pending_states.pop(state_type, None)
+        with self.engine.begin() as con:
+            con.execute(self.table.delete().where(self.table.c.state_type == state_type))
+
+    def flush(self):
+        with self.lock:
+            pending_states = self.pending_states
+            self.pending_states = {}
+            if self.flush_timer is not None:
+                self.flush_timer.cancel()
+                self.flush_timer = None
+        if len(pending_states) > 0:
+            self.write(pending_states)
+
+    def write(self, states):
+        with self.engine.begin() as con:
+            for state_type, state in states.items():
+                values = {"state_value": state.value, "state_date": state.date}
+                if con.execute(self.table.update().where(self.table.c.state_type == state_type).values(**values)).rowcount == 0:
+                    con.execute(self.table.insert().values(state_type=state_type, **values))
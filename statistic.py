@@ -13,13 +13,14 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
-from sqlalchemy import Column, String, Integer, DateTime
+from sqlalchemy import Column, String, Integer, DateTime, Index
 
 from base import Base
 
 
 class Statistic(Base):
     __tablename__ = 'statistics'
+    __table_args__ = (Index('ix_statistics_type_date', 'statistic_type', 'statistic_date'),)
     id = Column(Integer, primary_key=True)
     statistic_date = Column(DateTime, nullable=False)
     statistic_type = Column(String(255), nullable=False)
@@ -0,0 +1,78 @@
+# yt-backup command line utility to backup youtube channels easily
+# Copyright (C) 2020  w0d4
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import logging
+import threading
+from datetime import datetime
+
+from sqlalchemy.exc import SQLAlchemyError
+
+from operation import Operation
+from statistic import Statistic
+
+logger = logging.getLogger('yt-backup')
+
+
+# Collects operation and statistic rows in memory and inserts them in batches.
+# A batch is written when batch_size rows are waiting or flush_seconds after the first waiting row, whatever comes first.
+class TelemetryWriter:
+    def __init__(self, engine, batch_size=100, flush_seconds=10.0):
+        self.engine = engine
+        self.batch_size = max(1, batch_size)
+        self.flush_seconds = flush_seconds
+        # Reentrant, since the Ctrl+C handler flushes in the main thread, which may hold the lock at that moment
+        self.lock = threading.RLock()
+        self.pending_rows = {Operation.__table__: [], Statistic.__table__: []}
+        self.pending_row_count = 0
+        self.flush_timer = None
+
+    def log_operation(self, duration, operation_type, operation_description):
+        self.add(Operation.__table__, {"duration": duration, "operation_type": operation_type, "operation_description": operation_description, "operation_date": datetime.utcnow().replace(microsecond=0)})
+
+    def log_statistic(self, statistic_type, statistic_value):
+        self.add(Statistic.__table__, {"statistic_type": statistic_type, "statistic_value": statistic_value, "statistic_date": datetime.utcnow().replace(microsecond=0)})
+
+    def add(self, table, row):
+        with self.lock:
+            self.pending_rows[table].append(row)
+            self.pending_row_count += 1
+            flush_now = self.pending_row_count >= self.batch_size
+            if not flush_now and self.flush_timer is None:
+                self.flush_timer = threading.Timer(self.flush_seconds, self.flush)
+                self.flush_timer.daemon = True
+                self.flush_timer.start()
+        if flush_now:
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            pending_rows = self.pending_rows
+            self.pending_rows = {table: [] for table in pending_rows}
+            self.pending_row_count = 0
+            if self.flush_timer is not None:
+                self.flush_timer.cancel()
+                self.flush_timer = None
+        try:
+            with self.engine.begin() as con:
+                for table, rows in pending_rows.items():
+                    if len(rows) > 0:
+                        con.execute(table.insert(), rows)
+        except SQLAlchemyError as e:
+            # Keep the rows for the next flush instead of losing them
+            logger.error("Could not write operations and statistics to database: " + str(e))
+            with self.lock:
+                for table, rows in pending_rows.items():
+                    self.pending_rows[table] = rows + self.pending_rows[table]
+                    self.pending_row_count += len(rows)
@@ -0,0 +1,131 @@
+# yt-backup command line utility to backup youtube channels easily
+# Copyright (C) 2020  w0d4
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+# Measures the overhead per youtube API call while paging through a playlist, like get_video_infos does,
+# with one API client per thread compared with loading token.pickle and building a client for every call like before.
+# The youtube API and its discovery document are served by a local HTTP server, so only the overhead on this side is measured.
+# Fetching the discovery document from googleapis.com for every call adds network time on top of that before.
+# Run it with: python tests/benchmark_api_client.py [pages] [discovery_kb]
+
+import json
+import logging
+import os
+import pickle
+import sys
+import threading
+import time
+from functools import partial
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import googleapiclient.discovery
+from google.oauth2.credentials import Credentials
+
+import conftest
+
+
+def get_discovery_document(root_url, discovery_kb):
+    # Only playlistItems.list is described. Unused schemas bring the document to the given size, since it is parsed for every client.
+    document = {
+        "kind": "discovery#restDescription", "discoveryVersion": "v1", "id": "youtube:v3", "name": "youtube", "version": "v3", "protocol": "rest",
+        "rootUrl": root_url, "servicePath": "youtube/v3/", "baseUrl": root_url + "youtube/v3/", "batchPath": "batch/youtube/v3",
+        "parameters": {"alt": {"type": "string", "location": "query", "default": "json"}, "key": {"type": "string", "location": "query"}},
+        "resources": {"playlistItems": {"methods": {"list": {
+            "id": "youtube.playlistItems.list", "path": "playlistItems", "httpMethod": "GET", "parameterOrder": ["part"],
+            "parameters": {"part": {"type": "string", "required": True, "location": "query"}, "playlistId": {"type": "string", "location": "query"},
+                           "maxResults": {"type": "integer", "location": "query"}, "pageToken": {"type": "string", "location": "query"}},
+            "response": {"$ref": "PlaylistItemListResponse"}}}}},
+        "schemas": {"PlaylistItemListResponse": {"id": "PlaylistItemListResponse", "type": "object"}},
+    }
+    i = 0
+    while len(json.dumps(document)) < discovery_kb * 1024:
+        document["schemas"]["Unused" + str(i)] = {"id": "Unused" + str(i), "type": "object", "description": "x" * 200, "properties": {"field" + str(j): {"type": "string", "description": "y" * 50} for j in range(10)}}
+        i += 1
+    return json.dumps(document).encode("utf-8")
+
+
+class FakeYoutubeApi(BaseHTTPRequestHandler):
+    discovery_document = b""
+    pages = 0
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path.startswith("/discovery/"):
+            body = self.discovery_document
+        else:
+            page = int(parse_qs(url.query).get("pageToken", ["0"])[0])
+            items = [{"contentDetails": {"videoId": "v" + str(page * 50 + i)}, "snippet": {"title": "title", "description": "", "publishedAt": "2020-01-01T00:00:00Z"}} for i in range(50)]
+            answer = {"items": items, "pageInfo": {"totalResults": self.pages * 50}}
+            if page + 1 < self.pages:
+                answer["nextPageToken"] = str(page + 1)
+            body = json.dumps(answer).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def get_client_like_before(yt_backup, discovery_url):
+    with open("token.pickle", "rb") as token:
+        creds = pickle.load(token)
+    return googleapiclient.discovery.build(yt_backup.api_service_name, yt_backup.api_version, credentials=creds, discoveryServiceUrl=discovery_url)
+
+
+def page_through_playlist(yt_backup, build_request):
+    next_page_token = None
+    pages = 0
+    while True:
+        result = yt_backup.execute_api_request(build_request(next_page_token))
+        pages += 1
+        next_page_token = result.get("nextPageToken")
+        if next_page_token is None:
+            return pages
+
+
+def main():
+    pages = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    discovery_kb = int(sys.argv[2]) if len(sys.argv) > 2 else 400
+    yt_backup = conftest.load_yt_backup()
+    logging.getLogger('yt-backup').setLevel(logging.WARNING)
+    server = HTTPServer(("127.0.0.1", 0), FakeYoutubeApi)
+    root_url = "http://127.0.0.1:" + str(server.server_port) + "/"
+    discovery_url = root_url + "discovery/{api}/{apiVersion}/rest"
+    FakeYoutubeApi.discovery_document = get_discovery_document(root_url, discovery_kb)
+    FakeYoutubeApi.pages = pages
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    # get_youtube_api_client() builds its client like before, only the discovery document comes from the local server
+    googleapiclient.discovery.build = partial(googleapiclient.discovery.build, discoveryServiceUrl=discovery_url)
+    os.chdir(conftest.test_dir)
+    with open("token.pickle", "wb") as token:
+        pickle.dump(Credentials(token="token"), token)
+    print("%d pages of 50 videos, discovery document of %d KB" % (pages, discovery_kb))
+    for name, build_request in [
+        ("client per thread", lambda next_page_token: yt_backup.build_playlist_items_request("UU0", next_page_token, yt_backup.get_youtube_api_client())),
+        ("client per call like before", lambda next_page_token: yt_backup.build_playlist_items_request("UU0", next_page_token, get_client_like_before(yt_backup, discovery_url))),
+    ]:
+        start_time = time.perf_counter()
+        fetched_pages = page_through_playlist(yt_backup, build_request)
+        seconds = time.perf_counter() - start_time
+        print("%-30s %8.2fs %8.1f ms per call" % (name, seconds, seconds / fetched_pages * 1000))
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
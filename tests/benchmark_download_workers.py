@@ -0,0 +1,118 @@
+# yt-backup command line utility to backup youtube channels easily
+# Copyright (C) 2020  w0d4
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+# Measures how many videos per minute download_videos() gets into the archive with 1, 2, 4 and 8 workers.
+# youtube-dl and rclone are replaced by scripts which only wait, like a download and an upload which are limited by the network.
+# Run it with: python tests/benchmark_download_workers.py [videos] [download_seconds] [upload_seconds]
+
+import logging
+import os
+import stat
+import sys
+from datetime import datetime, timedelta
+
+import conftest
+from base import Session
+from channel import Channel
+from playlist import Playlist
+from video import Video
+
+channel_count = 4
+
+fake_youtube_dl = """#!{python}
+import json, os, sys, time
+arguments = sys.argv[1:]
+output = arguments[arguments.index("--output") + 1]
+video_id = arguments[-1].rsplit("/", 1)[1]
+time.sleep({download_seconds})
+video_file = output.replace("%(id)s", video_id).replace("%(ext)s", "mkv")
+for field in ["uploader", "upload_date", "title", "resolution"]:
+    video_file = video_file.replace("%(" + field + ")s", field)
+os.makedirs(os.path.dirname(video_file), exist_ok=True)
+with open(video_file, "wb") as f:
+    f.write(b"0" * 100000)
+with open(video_file[:-4] + ".info.json", "w") as f:
+    json.dump({{"id": video_id, "duration": 60, "width": 1920, "height": 1080, "filesize": 100000, "format_id": "137+251", "vcodec": "avc1", "acodec": "opus"}}, f)
+with open(arguments[arguments.index("--download-archive") + 1], "a") as f:
+    f.write("youtube " + video_id + "\\n")
+print("[download] Destination: " + video_file)
+"""
+
+fake_rclone = """#!{python}
+import shutil, sys, time
+time.sleep({upload_seconds})
+if "move" in sys.argv:
+    shutil.rmtree(sys.argv[sys.argv.index("move") + 1], ignore_errors=True)
+"""
+
+
+def write_script(name, content):
+    path = os.path.join(conftest.test_dir, name)
+    with open(path, "w") as f:
+        f.write(content)
+    os.chmod(path, os.stat(path).st_mode | stat.S_IEXEC)
+    return path
+
+
+def add_videos(video_count):
+    session = Session()
+    session.query(Video).delete()
+    session.query(Playlist).delete()
+    session.query(Channel).delete()
+    for i in range(channel_count):
+        channel = Channel(channel_id="UC" + str(i), channel_name="channel " + str(i), channel_country="DE")
+        session.add(channel)
+        session.flush()
+        playlist = Playlist(playlist_id="UU" + str(i), playlist_name="uploads", monitored=1, channel_id=channel.id)
+        session.add(playlist)
+        session.flush()
+        for j in range(i, video_count, channel_count):
+            session.add(Video(playlist=playlist.id, video_id="v" + str(j), title="title", description="", online=1, download_required=1, upload_date=datetime(2020, 1, 1) + timedelta(days=j)))
+    session.commit()
+    session.close()
+    open(conftest.test_config["youtube-dl"]["download-archive"], "w").close()
+
+
+def main():
+    video_count = int(sys.argv[1]) if len(sys.argv) > 1 else 32
+    download_seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 1.0
+    upload_seconds = float(sys.argv[3]) if len(sys.argv) > 3 else 0.5
+    yt_backup = conftest.load_yt_backup()
+    logging.getLogger('yt-backup').setLevel(logging.WARNING)
+    yt_backup.config["youtube-dl"]["binary_path"] = write_script("youtube-dl", fake_youtube_dl.format(python=sys.executable, download_seconds=download_seconds))
+    yt_backup.config["youtube-dl"]["additional-options"] = ""
+    yt_backup.config["youtube-dl"]["min_sleep_interval"] = 0
+    yt_backup.config["youtube-dl"]["max_sleep_interval"] = 0
+    yt_backup.config["youtube-dl"]["max_workers_per_channel"] = 8
+    yt_backup.config["rclone"]["binary_path"] = write_script("rclone", fake_rclone.format(python=sys.executable, upload_seconds=upload_seconds))
+    yt_backup.config["rclone"]["config_path"] = ""
+    yt_backup.config["rclone"]["upload_workers"] = 2
+    yt_backup.egress_identity.get = lambda proxy="": {"proxy": proxy, "ip": "127.0.0.1", "country": "DE"}
+    print("%d videos, %.1fs per download, %.1fs per upload with 2 upload threads" % (video_count, download_seconds, upload_seconds))
+    for workers in [1, 2, 4, 8]:
+        add_videos(video_count)
+        yt_backup.workers = workers
+        start_time = yt_backup.get_current_timestamp()
+        yt_backup.download_videos()
+        seconds = yt_backup.get_current_timestamp() - start_time
+        downloaded = yt_backup.session.query(Video).filter(Video.downloaded != None).count()
+        print("%2d workers %8.1fs %8.1f videos/min (%d downloaded)" % (workers, seconds, downloaded / seconds * 60, downloaded))
+        yt_backup.session.close()
+    yt_backup.telemetry.flush()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+# yt-backup command line utility to backup youtube channels easily
+# Copyright (C) 2020  w0d4
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+# Measures the overhead per video of the subprocess and the embedded youtube-dl backend.
+# Every video is in the download archive already, so yt-dlp stops before it goes to the network and only the overhead of a run is left.
+# Both backends run the same yt-dlp. The subprocess backend starts it with python -m yt_dlp, unless another binary_path is given.
+# Run it with: python tests/benchmark_downloader_backends.py [videos] [binary_path]
+
+import logging
+import os
+import sys
+import time
+
+import conftest
+from embedded_downloader import EmbeddedDownloader
+
+
+def benchmark(name, yt_backup, video_ids, download_dir):
+    start_time = time.perf_counter()
+    for video_id in video_ids:
+        outcome = yt_backup.run_youtube_dl(video_id, "channel", download_dir)
+        if outcome != "exists_already":
+            print("%s returned %s for video %s instead of exists_already" % (name, outcome, video_id))
+            return
+    seconds = time.perf_counter() - start_time
+    print("%-12s %8.2fs %8.3fs per video" % (name, seconds, seconds / len(video_ids)))
+
+
+def main():
+    video_count = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    binary_path = sys.argv[2] if len(sys.argv) > 2 else sys.executable + " -m yt_dlp"
+    yt_backup = conftest.load_yt_backup()
+    logging.getLogger('yt-backup').setLevel(logging.WARNING)
+    yt_backup.config["youtube-dl"]["binary_path"] = binary_path
+    video_ids = ["bench" + str(i).zfill(6) for i in range(video_count)]
+    with open(yt_backup.config["youtube-dl"]["download-archive"], "w") as f:
+        f.writelines("youtube " + video_id + "\n" for video_id in video_ids)
+    download_dir = os.path.join(yt_backup.config["base"]["download_dir"], "worker-0")
+    os.makedirs(download_dir, exist_ok=True)
+    print("%d videos which are in the download archive already" % video_count)
+    yt_backup.embedded_downloader = None
+    benchmark("subprocess", yt_backup, video_ids, download_dir)
+    try:
+        yt_backup.embedded_downloader = EmbeddedDownloader()
+    except ImportError as e:
+        print("Skipping the embedded backend: " + str(e))
+        return
+    benchmark("embedded", yt_backup, video_ids, download_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+# yt-backup command line utility to backup youtube channels easily
+# Copyright (C) 2020  w0d4
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+# Prints the query plans and run times of the hot path queries before and after the indexes of data model v7.
+# The database is filled with the given number of videos. Without a connection it is a SQLite database in a temporary directory.
+# Run it with: python tests/benchmark_migrations.py [videos] [connection_info]
+# Use an empty MySQL database for connection_info, since all tables are dropped and created again.
+
+import os
+import sys
+import timeit
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, create_engine, func, select
+
+import conftest
+from base import Base
+from channel import Channel
+from migrations import add_hot_path_indexes
+from operation import Operation
+from playlist import Playlist
+from statistic import Statistic
+from video import Video
+
+playlist_count = 1000
+insert_chunk_size = 10000
+
+
+def fill_database(engine, video_count):
+    now = datetime.utcnow().replace(microsecond=0)
+    with engine.begin() as con:
+        con.execute(Channel.__table__.insert(), [{"id": i, "channel_id": "UC" + str(i), "channel_name": "channel " + str(i)} for i in range(1, playlist_count + 1)])
+        con.execute(Playlist.__table__.insert(), [{"id": i, "playlist_id": "UU" + str(i), "playlist_name": "uploads", "channel_id": i, "monitored": 1} for i in range(1, playlist_count + 1)])
+        for start in range(0, video_count, insert_chunk_size):
+            rows = []
+            for i in range(start, min(start + insert_chunk_size, video_count)):
+                # 2% of the videos wait for their download, a few are offline
+                downloaded = None if i % 50 == 0 else now - timedelta(minutes=i)
+                rows.append({"id": i + 1, "playlist": i % playlist_count + 1, "video_id": "v" + str(i), "title": "title", "description": "", "online": 0 if i % 97 == 0 else 1, "download_required": 1, "downloaded": downloaded, "upload_date": now - timedelta(hours=i)})
+            con.execute(Video.__table__.insert(), rows)
+        con.execute(Statistic.__table__.insert(), [{"statistic_type": "used_quota", "statistic_value": "5", "statistic_date": now - timedelta(minutes=i)} for i in range(video_count // 10)])
+        con.execute(Operation.__table__.insert(), [{"operation_type": "download_videos", "operation_description": "", "duration": 1, "operation_date": now - timedelta(minutes=i)} for i in range(video_count // 10)])
+
+
+def get_hot_path_queries():
+    video = Video.__table__
+    since = datetime.utcnow() - timedelta(days=1)
+    return [
+        ("download queue", select([video.c.id, video.c.playlist, video.c.upload_date, video.c.discovered]).where(and_(video.c.downloaded == None, video.c.online == 1, video.c.download_required == 1)).order_by(video.c.id)),
+        ("offline check of one playlist", select([video.c.id, video.c.video_id]).where(and_(video.c.playlist == playlist_count // 2, video.c.online == 1, video.c.downloaded != None))),
+        ("downloads of the last day", select([func.count(video.c.id)]).where(video.c.downloaded >= since)),
+        ("used quota of the last day", select([Statistic.__table__.c.statistic_value]).where(and_(Statistic.__table__.c.statistic_type == "used_quota", Statistic.__table__.c.statistic_date > since))),
+        ("videos of one channel", select([func.count(video.c.id)]).select_from(video.join(Playlist.__table__, video.c.playlist == Playlist.__table__.c.id)).where(Playlist.__table__.c.channel_id == playlist_count // 2)),
+    ]
+
+
+def explain(engine, query):
+    compiled = query.compile(dialect=engine.dialect)
+    if compiled.positional:
+        params = [compiled.params[name] for name in compiled.positiontup]
+    else:
+        params = compiled.params
+    prefix = "EXPLAIN QUERY PLAN " if engine.dialect.name == "sqlite" else "EXPLAIN "
+    con = engine.raw_connection()
+    try:
+        cursor = con.cursor()
+        cursor.execute(prefix + str(compiled), params)
+        return cursor.fetchall()
+    finally:
+        con.close()
+
+
+def run_queries(engine, title):
+    print(title)
+    for name, query in get_hot_path_queries():
+        with engine.connect() as con:
+            seconds = min(timeit.repeat(lambda: con.execute(query).fetchall(), number=1, repeat=5))
+        print("  %-35s %10.1f ms" % (name, seconds * 1000))
+        for row in explain(engine, query):
+            print("      " + " | ".join(str(value) for value in row))
+
+
+def main():
+    video_count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    if len(sys.argv) > 2:
+        connection_info = sys.argv[2]
+    else:
+        connection_info = "sqlite:///" + os.path.join(conftest.test_dir, "benchmark_migrations.db")
+    engine = create_engine(connection_info)
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    # Start from the schema before data model v7
+    for model in [Video, Statistic, Operation, Playlist]:
+        for index in model.__table__.indexes:
+            index.drop(bind=engine)
+    print("Inserting " + str(video_count) + " videos")
+    fill_database(engine, video_count)
+    run_queries(engine, "Before data model v7")
+    add_hot_path_indexes(engine)
+    run_queries(engine, "After data model v7")
+    Base.metadata.drop_all(engine)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+# yt-backup command line utility to backup youtube channels easily
+# Copyright (C) 2020  w0d4
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+# Measures how many youtube-dl runs per second the outcome classifier handles, compared with the chain of checks it replaced.
+# Run it with: python tests/benchmark_outcome_classifier.py [repetitions]
+
+import sys
+import timeit
+
+from conftest import load_corpus
+from outcome_classifier import OutcomeClassifier
+from test_outcome_classifier import classify_like_before_rule_table
+
+
+def benchmark(name, function, runs, repetitions):
+    seconds = min(timeit.repeat(function, number=repetitions, repeat=5))
+    print("%-40s %10.1f us/run %12.0f runs/s" % (name, seconds / (runs * repetitions) * 1e6, runs * repetitions / seconds))
+
+
+def main():
+    repetitions = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    corpus = load_corpus()
+    classifier = OutcomeClassifier()
+    # A long output of a run which had to retry a lot before failing
+    long_stderr = "\n".join(["WARNING: [youtube] Unable to download webpage: <urlopen error timed out>. Retrying (1/10)..."] * 200) + "\nERROR: Video unavailable"
+    long_case = {"stdout": "", "stderr": long_stderr, "returncode": 1}
+    for title, cases in (("corpus (" + str(len(corpus)) + " runs)", corpus), ("long stderr (200 lines)", [long_case])):
+        print(title)
+        benchmark("  rule table", lambda: [classifier.classify(case["stdout"], case["stderr"], case["returncode"] != 0) for case in cases], len(cases), repetitions)
+        benchmark("  previous chain of checks", lambda: [classify_like_before_rule_table(case["stdout"], case["stderr"], case["returncode"]) for case in cases], len(cases), repetitions)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+# yt-backup command line utility to backup youtube channels easily
+# Copyright (C) 2020  w0d4
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+# Counts the database round trips and measures the time of syncing one playlist answer of the youtube API into the database,
+# compared with the lookups of every single video get_video_infos did before.
+# Run it with: python tests/benchmark_playlist_sync.py [videos] [new_videos]
+
+import logging
+import sys
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import event
+
+import conftest
+from base import engine
+from channel import Channel
+from playlist import Playlist
+from video import Video
+
+
+class StatementCounter:
+    def __init__(self):
+        self.statements = 0
+
+    def __call__(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements += 1
+
+
+def add_playlist(session, video_count, new_video_count):
+    # Returns the playlist and the API answer for it. Every 100th known video is offline, every 50th has no upload date.
+    session.query(Video).delete()
+    session.query(Playlist).delete()
+    session.query(Channel).delete()
+    channel = Channel(channel_id="UC0", channel_name="channel")
+    session.add(channel)
+    session.flush()
+    playlist = Playlist(playlist_id="UU0", playlist_name="uploads", monitored=1, channel_id=channel.id)
+    session.add(playlist)
+    session.flush()
+    known_videos = []
+    api_videos = {}
+    for i in range(video_count):
+        upload_date = datetime(2010, 1, 1) + timedelta(hours=i)
+        video_id = "v" + str(i)
+        api_videos[video_id] = {"contentDetails": {"videoId": video_id}, "snippet": {"title": "title " + str(i), "description": "", "publishedAt": upload_date.strftime('%Y-%m-%dT%H:%M:%SZ')}}
+        if i < video_count - new_video_count:
+            known_videos.append({"playlist": playlist.id, "video_id": video_id, "title": "title " + str(i), "description": "", "online": 2 if i % 100 == 0 else 1, "download_required": 1, "upload_date": None if i % 50 == 0 else upload_date})
+    session.bulk_insert_mappings(Video, known_videos)
+    session.commit()
+    return playlist, api_videos
+
+
+def sync_like_before(yt_backup, playlist, api_videos):
+    # The lookups of get_video_infos before the bulk sync, two queries for every video of the answer
+    session = yt_backup.session
+    videos = []
+    for video_raw in api_videos.values():
+        video = Video()
+        video.video_id = video_raw["contentDetails"]["videoId"]
+        video.title = video_raw["snippet"]["title"]
+        video.description = video_raw["snippet"]["description"]
+        video.upload_date = datetime.strptime(str(video_raw["snippet"]["publishedAt"])[0:19], '%Y-%m-%dT%H:%M:%S')
+        video.playlist = playlist.id
+        video.online = yt_backup.video_status["online"]
+        video.download_required = 1
+        if session.query(Video).filter(Video.video_id == video.video_id).scalar() is None:
+            videos.append(video)
+        else:
+            video = session.query(Video).filter(Video.video_id == video.video_id).scalar()
+            if video.online == yt_backup.video_status["offline"]:
+                video.online = yt_backup.video_status["online"]
+                videos.append(video)
+            if video.upload_date is None:
+                video.upload_date = datetime.strptime(str(video_raw["snippet"]["publishedAt"])[0:19], '%Y-%m-%dT%H:%M:%S')
+                videos.append(video)
+    session.add_all(videos)
+    session.commit()
+
+
+def benchmark(name, yt_backup, sync, video_count, new_video_count):
+    playlist, api_videos = add_playlist(yt_backup.session, video_count, new_video_count)
+    counter = StatementCounter()
+    event.listen(engine, "before_cursor_execute", counter)
+    start_time = time.perf_counter()
+    sync(playlist, api_videos)
+    seconds = time.perf_counter() - start_time
+    event.remove(engine, "before_cursor_execute", counter)
+    print("%-30s %8d statements %8.2fs" % (name, counter.statements, seconds))
+
+
+def main():
+    video_count = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    new_video_count = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    yt_backup = conftest.load_yt_backup()
+    logging.getLogger('yt-backup').setLevel(logging.WARNING)
+    print("Playlist with %d videos, %d of them new" % (video_count, new_video_count))
+    benchmark("sync_playlist_videos", yt_backup, yt_backup.sync_playlist_videos, video_count, new_video_count)
+    benchmark("lookups of every video before", yt_backup, lambda playlist, api_videos: sync_like_before(yt_backup, playlist, api_videos), video_count, new_video_count)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+# yt-backup command line utility to backup youtube channels easily
+# Copyright (C) 2020  w0d4
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import atexit
+import importlib.util
+import json
+import os
+import shutil
+import signal
+import sys
+import tempfile
+
+import pytest
+
+# The modules of yt-backup live in the repository root and are imported without a package
+repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, repo_dir)
+
+corpus_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "corpus", "youtube-dl")
+
+# base.py reads config.json from the working directory, so the tests get their own one with a SQLite database in a temporary directory
+test_dir = tempfile.mkdtemp(prefix="yt-backup-tests-")
+atexit.register(shutil.rmtree, test_dir, ignore_errors=True)
+
+
+def write_test_config():
+    with open(os.path.join(repo_dir, "config.json.example"), "r") as f:
+        config = json.load(f)
+    config["database"]["connection_info"] = "sqlite:///" + os.path.join(test_dir, "yt-backup.db")
+    config["base"]["download_dir"] = os.path.join(test_dir, "download")
+    config["base"]["download_lockfile"] = os.path.join(test_dir, "download.lock")
+    config["youtube-dl"]["download-archive"] = os.path.join(test_dir, "archive.list")
+    config["youtube-dl"]["proxy"] = ""
+    with open(os.path.join(test_dir, "config.json"), "w") as f:
+        json.dump(config, f, indent=2)
+    return config
+
+
+def import_with_test_config(module_name):
+    cwd = os.getcwd()
+    os.chdir(test_dir)
+    try:
+        return __import__(module_name)
+    finally:
+        os.chdir(cwd)
+
+
+test_config = write_test_config()
+base = import_with_test_config("base")
+# All models have to be known to the metadata, before the tables are created
+for model_module in ["channel", "channel_rollup", "daily_rollup", "operation", "playlist", "runtime_state", "statistic", "video"]:
+    import_with_test_config(model_module)
+
+
+def load_yt_backup():
+    # yt-backup.py is a script, so it is run once like from the command line, with a mode which does nothing.
+    # Its functions are used from the returned module afterwards.
+    if "yt_backup" in sys.modules:
+        return sys.modules["yt_backup"]
+    spec = importlib.util.spec_from_file_location("yt_backup", os.path.join(repo_dir, "yt-backup.py"))
+    module = importlib.util.module_from_spec(spec)
+    argv = sys.argv
+    sigint_handler = signal.getsignal(signal.SIGINT)
+    cwd = os.getcwd()
+    sys.argv = ["yt-backup.py", "tests"]
+    os.chdir(test_dir)
+    try:
+        spec.loader.exec_module(module)
+    finally:
+        sys.argv = argv
+        signal.signal(signal.SIGINT, sigint_handler)
+        os.chdir(cwd)
+    sys.modules["yt_backup"] = module
+    return module
+
+
+@pytest.fixture
+def database():
+    # Every test gets empty tables and a session of its own
+    base.Base.metadata.create_all(base.engine)
+    session = base.Session()
+    yield session
+    session.close()
+    base.Base.metadata.drop_all(base.engine)
+
+
+@pytest.fixture
+def yt_backup(database):
+    # The script keeps its own session and caches, which must not outlive the tables of a test
+    module = load_yt_backup()
+    module.runtime_state.load()
+    yield module
+    module.telemetry.flush()
+    module.runtime_state.flush()
+    module.session.close()
+
+
+def read_corpus_file(name, stream):
+    path = os.path.join(corpus_dir, name + "." + stream)
+    if not os.path.exists(path):
+        return ""
+    with open(path, "r") as f:
+        return f.read()
+
+
+def load_corpus():
+    # Every case is a recorded youtube-dl run with its stdout and stderr next to cases.json
+    with open(os.path.join(corpus_dir, "cases.json"), "r") as f:
+        cases = json.load(f)
+    for case in cases:
+        case["stdout"] = read_corpus_file(case["name"], "stdout")
+        case["stderr"] = read_corpus_file(case["name"], "stderr")
+    return cases
@@ -0,0 +1,122 @@
+# yt-backup command line utility to backup youtube channels easily
+# Copyright (C) 2020  w0d4
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import os
+
+import pytest
+
+from download_archive import DownloadArchive
+
+
+@pytest.fixture
+def archive_path(tmp_path):
+    path = str(tmp_path / "archive.list")
+    with open(path, "w") as f:
+        f.write("youtube a\n\nyoutube b\nyoutube c\n")
+    return path
+
+
+def read_file(path):
+    with open(path, "r") as f:
+        return f.read()
+
+
+def test_load_indexes_all_entries(archive_path):
+    archive = DownloadArchive(archive_path)
+    assert len(archive) == 3
+    assert "a" in archive
+    assert "c" in archive
+    assert "d" not in archive
+
+
+def test_missing_archive_file_is_empty(tmp_path):
+    archive = DownloadArchive(str(tmp_path / "archive.list"))
+    assert len(archive) == 0
+    archive.add("a")
+    assert read_file(str(tmp_path / "archive.list")) == "youtube a\n"
+
+
+def test_add_appends_new_entries_only(archive_path):
+    archive = DownloadArchive(archive_path)
+    archive.add("d")
+    archive.add("a")
+    archive.add("d")
+    assert read_file(archive_path) == "youtube a\n\nyoutube b\nyoutube c\nyoutube d\n"
+    assert "d" in archive
+
+
+def test_add_without_write_only_updates_the_index(archive_path):
+    # youtube-dl has written the entry itself already
+    archive = DownloadArchive(archive_path)
+    archive.add("d", write=False)
+    assert "d" in archive
+    assert "youtube d" not in read_file(archive_path)
+
+
+def test_remove_is_journaled_until_compact(archive_path):
+    archive = DownloadArchive(archive_path)
+    archive.remove("b")
+    assert "b" not in archive
+    # The archive file is not rewritten for every removal
+    assert "youtube b" in read_file(archive_path)
+    assert read_file(archive_path + ".removed") == "youtube b\n"
+    archive.compact()
+    assert read_file(archive_path) == "youtube a\nyoutube c\n"
+    assert not os.path.exists(archive_path + ".removed")
+
+
+def test_remove_of_entry_written_by_youtube_dl_during_run(archive_path):
+    archive = DownloadArchive(archive_path)
+    with open(archive_path, "a") as f:
+        f.write("youtube d\n")
+    archive.remove("d")
+    assert read_file(archive_path + ".removed") == "youtube d\n"
+    archive.compact()
+    assert read_file(archive_path) == "youtube a\nyoutube b\nyoutube c\n"
+
+
+def test_journal_of_aborted_run_is_applied_on_load(archive_path):
+    DownloadArchive(archive_path).remove("a")
+    archive = DownloadArchive(archive_path)
+    assert "a" not in archive
+    assert read_file(archive_path) == "youtube b\nyoutube c\n"
+    assert not os.path.exists(archive_path + ".removed")
+
+
+def test_add_after_remove_survives_aborted_run(archive_path):
+    archive = DownloadArchive(archive_path)
+    archive.remove("a")
+    archive.add("a")
+    archive = DownloadArchive(archive_path)
+    assert "a" in archive
+
+
+def test_compact_without_removals_keeps_the_file(archive_path):
+    archive = DownloadArchive(archive_path)
+    modified = os.path.getmtime(archive_path)
+    archive.compact()
+    assert os.path.getmtime(archive_path) == modified
+    assert read_file(archive_path) == "youtube a\n\nyoutube b\nyoutube c\n"
+
+
+def test_other_extractor(tmp_path):
+    path = str(tmp_path / "archive.list")
+    with open(path, "w") as f:
+        f.write("youtube a\nvimeo a\n")
+    archive = DownloadArchive(path, "vimeo")
+    archive.remove("a")
+    archive.compact()
+    assert read_file(path) == "youtube a\n"
@@ -0,0 +1,70 @@
+# yt-backup command line utility to backup youtube channels easily
+# Copyright (C) 2020  w0d4
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import json
+from datetime import datetime
+
+import pytest
+
+from channel import Channel
+from playlist import Playlist
+from video import Video
+
+
+@pytest.fixture
+def playlists(yt_backup, database):
+    channel = Channel(channel_id="UC1", channel_name="name\twith tab")
+    database.add(channel)
+    database.add(Channel(channel_id="UC2", channel_name="no playlists"))
+    database.flush()
+    synced = Playlist(playlist_id="UU1", playlist_name="uploads\nof channel", monitored=1, channel_id=channel.id, etag="etag", download_from_date=datetime(2020, 1, 1))
+    never_synced = Playlist(playlist_id="PL1", playlist_name="favorites", monitored=0, channel_id=channel.id)
+    database.add_all([synced, never_synced])
+    database.flush()
+    database.add(Video(playlist=synced.id, video_id="a", title="", description="", online=1, download_required=1, downloaded=datetime(2020, 2, 1)))
+    database.add(Video(playlist=synced.id, video_id="b", title="", description="", online=1, download_required=1))
+    database.add(Video(playlist=synced.id, video_id="c", title="", description="", online=0, download_required=1))
+    database.commit()
+    return yt_backup
+
+
+def test_tsv_output(playlists, capsys, monkeypatch):
+    monkeypatch.setattr(playlists, "output_format", "tsv")
+    playlists.list_playlists()
+    lines = capsys.readouterr().out.split("\n")
+    assert lines[0].split("\t") == ["channel_internal_id", "channel_name", "channel_id", "id", "playlist_name", "playlist_id", "download_from", "monitored", "etag", "videos", "downloaded", "download_queue"]
+    assert lines[1].split("\t") == ["1", "name\\twith tab", "UC1", "1", "uploads\\nof channel", "UU1", "2020-01-01 00:00:00", "1", "etag", "3", "1", "1"]
+    # Missing values are empty fields instead of None
+    assert lines[2].split("\t") == ["1", "name\\twith tab", "UC1", "2", "favorites", "PL1", "", "0", "", "0", "0", "0"]
+    assert lines[3:] == [""]
+
+
+def test_json_output(playlists, capsys, monkeypatch):
+    monkeypatch.setattr(playlists, "output_format", "json")
+    playlists.list_playlists()
+    channels = json.loads(capsys.readouterr().out)
+    assert [channel["channel_id"] for channel in channels] == ["UC1", "UC2"]
+    assert channels[1]["playlists"] == []
+    assert channels[0]["playlists"][0] == {"id": 1, "playlist_name": "uploads\nof channel", "playlist_id": "UU1", "download_from": "2020-01-01 00:00:00", "monitored": 1, "etag": "etag",
+                                           "videos": 3, "downloaded": 1, "download_queue": 1}
+    assert channels[0]["playlists"][1]["etag"] is None
+
+
+def test_only_one_channel(playlists, capsys, monkeypatch):
+    monkeypatch.setattr(playlists, "output_format", "json")
+    monkeypatch.setattr(playlists, "channel_id", "UC2")
+    playlists.list_playlists()
+    assert [channel["channel_id"] for channel in json.loads(capsys.readouterr().out)] == ["UC2"]
@@ -0,0 +1,126 @@
+# yt-backup command line utility to backup youtube channels easily
+# Copyright (C) 2020  w0d4
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import os
+import time
+from urllib.request import urlopen
+
+from metrics import Counter, Gauge, Histogram, MetricsRegistry
+
+
+def test_counter():
+    counter = Counter("downloads_total", "Finished downloads", ["outcome"])
+    counter.inc(outcome="downloaded")
+    counter.inc(2, outcome="downloaded")
+    counter.inc(outcome="failed")
+    assert counter.render() == ("# HELP downloads_total Finished downloads\n"
+                                "# TYPE downloads_total counter\n"
+                                "downloads_total{outcome=\"downloaded\"} 3.0\n"
+                                "downloads_total{outcome=\"failed\"} 1.0\n")
+
+
+def test_counter_without_labels():
+    counter = Counter("quota_used_total", "Used quota")
+    assert counter.render() == "# HELP quota_used_total Used quota\n# TYPE quota_used_total counter\n"
+    counter.inc(100)
+    assert counter.samples() == [("quota_used_total", 100)]
+
+
+def test_label_values_are_escaped():
+    counter = Counter("aborts_total", "Aborts", ["pattern"])
+    counter.inc(pattern="say \"hi\"\\\n")
+    assert counter.samples() == [("aborts_total{pattern=\"say \\\"hi\\\"\\\\\\n\"}", 1)]
+
+
+def test_gauge_keeps_the_last_value():
+    gauge = Gauge("download_speed", "Speed", ["worker"])
+    gauge.set(100, worker="worker-0")
+    gauge.set(50, worker="worker-0")
+    gauge.set(10, worker="worker-1")
+    assert gauge.samples() == [("download_speed{worker=\"worker-0\"}", 50), ("download_speed{worker=\"worker-1\"}", 10)]
+    assert "# TYPE download_speed gauge\n" in gauge.render()
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = Histogram("duration_seconds", "Duration", buckets=(10, 1, 5))
+    for value in [0.5, 3, 7, 100]:
+        histogram.observe(value)
+    assert histogram.samples() == [
+        ("duration_seconds_bucket{le=\"1.0\"}", 1),
+        ("duration_seconds_bucket{le=\"5.0\"}", 2),
+        ("duration_seconds_bucket{le=\"10.0\"}", 3),
+        ("duration_seconds_bucket{le=\"+Inf\"}", 4),
+        ("duration_seconds_sum", 110.5),
+        ("duration_seconds_count", 4),
+    ]
+    assert "# TYPE duration_seconds histogram\n" in histogram.render()
+
+
+def test_histogram_with_labels():
+    histogram = Histogram("request_seconds", "Latency", ["result"], buckets=(1,))
+    histogram.observe(2, result="ok")
+    assert histogram.samples() == [
+        ("request_seconds_bucket{result=\"ok\",le=\"1.0\"}", 0),
+        ("request_seconds_bucket{result=\"ok\",le=\"+Inf\"}", 1),
+        ("request_seconds_sum{result=\"ok\"}", 2),
+        ("request_seconds_count{result=\"ok\"}", 1),
+    ]
+
+
+def get_registry():
+    registry = MetricsRegistry()
+    counter = registry.register(Counter("a_total", "A"))
+    registry.register(Gauge("b", "B"))
+    counter.inc()
+    return registry
+
+
+def test_registry_renders_all_metrics():
+    assert get_registry().render() == "# HELP a_total A\n# TYPE a_total counter\na_total 1.0\n# HELP b B\n# TYPE b gauge\n"
+
+
+def test_write_textfile(tmp_path):
+    path = str(tmp_path / "yt-backup.prom")
+    registry = get_registry()
+    registry.write_textfile(path)
+    with open(path, "r") as f:
+        assert f.read() == registry.render()
+    assert os.listdir(str(tmp_path)) == ["yt-backup.prom"]
+
+
+def test_textfile_is_written_periodically(tmp_path):
+    path = str(tmp_path / "yt-backup.prom")
+    stop_event = get_registry().start_textfile_writer(path, 0.05)
+    try:
+        for i in range(100):
+            if os.path.exists(path):
+                break
+            time.sleep(0.05)
+        assert os.path.exists(path)
+    finally:
+        stop_event.set()
+
+
+def test_http_server():
+    registry = get_registry()
+    server = registry.start_http_server("127.0.0.1", 0)
+    try:
+        with urlopen("http://127.0.0.1:" + str(server.server_port) + "/metrics") as response:
+            assert response.headers["Content-Type"].startswith("text/plain; version=0.0.4")
+            assert response.read().decode("utf-8") == registry.render()
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,82 @@
+# yt-backup command line utility to backup youtube channels easily
+# Copyright (C) 2020  w0d4
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+from datetime import datetime
+
+from sqlalchemy import inspect, text
+
+from base import engine
+from migrations import migrate, migrations
+from playlist import Playlist
+from runtime_state import RuntimeState
+from statistic import Statistic
+from video import Video
+
+
+def get_data_model_version(session):
+    return session.query(Statistic).filter(Statistic.statistic_type == "data_model_version").one()
+
+
+def test_migrate_new_database_to_latest_version(database):
+    applied_versions = migrate(engine, database)
+    assert applied_versions == [version for version, migration in migrations]
+    data_model_version = get_data_model_version(database)
+    assert data_model_version.statistic_value == str(migrations[-1][0])
+    assert isinstance(data_model_version.statistic_date, datetime)
+
+
+def test_migrate_twice_applies_nothing(database):
+    migrate(engine, database)
+    assert migrate(engine, database) == []
+
+
+def test_migrate_continues_from_stored_version(database):
+    # A database of data model v4 without the columns and indexes which came later
+    with engine.begin() as con:
+        con.execute(text("DROP INDEX ix_videos_download_queue"))
+        con.execute(text("DROP INDEX ix_playlists_channel_id"))
+    RuntimeState.__table__.drop(bind=engine)
+    database.add(Statistic(statistic_type="data_model_version", statistic_value="4", statistic_date=datetime.utcnow()))
+    database.commit()
+    assert migrate(engine, database) == [version for version, migration in migrations if version > 4]
+    assert "ix_videos_download_queue" in [index["name"] for index in inspect(engine).get_indexes(Video.__tablename__)]
+    assert "ix_playlists_channel_id" in [index["name"] for index in inspect(engine).get_indexes(Playlist.__tablename__)]
+    assert RuntimeState.__tablename__ in inspect(engine).get_table_names()
+
+
+def test_move_runtime_state_out_of_statistics(database):
+    database.add(Statistic(statistic_type="data_model_version", statistic_value="7", statistic_date=datetime.utcnow()))
+    database.add(Statistic(statistic_type="status", statistic_value="downloading", statistic_date=datetime(2020, 1, 1)))
+    database.add(Statistic(statistic_type="used_quota", statistic_value="42", statistic_date=datetime(2020, 1, 1)))
+    database.commit()
+    migrate(engine, database)
+    state = database.query(RuntimeState).filter(RuntimeState.state_type == "status").one()
+    assert state.state_value == "downloading"
+    assert state.state_date == datetime(2020, 1, 1)
+    assert [statistic_type for (statistic_type,) in database.query(Statistic.statistic_type).order_by(Statistic.statistic_type)] == ["data_model_version", "used_quota"]
+
+
+def test_last_synced_of_playlists_with_etag_is_filled(database):
+    with engine.begin() as con:
+        con.execute(text("ALTER TABLE playlists DROP COLUMN last_synced"))
+    database.add(Statistic(statistic_type="data_model_version", statistic_value="4", statistic_date=datetime.utcnow()))
+    database.commit()
+    with engine.begin() as con:
+        con.execute(text("INSERT INTO playlists (id, playlist_id, playlist_name, monitored, channel_id, etag) VALUES (1, 'UU1', 'uploads', 1, 1, 'etag'), (2, 'UU2', 'uploads', 1, 1, NULL)"))
+    migrate(engine, database)
+    playlists = {playlist.playlist_id: playlist for playlist in database.query(Playlist)}
+    assert isinstance(playlists["UU1"].last_synced, datetime)
+    assert playlists["UU2"].last_synced is None
@@ -0,0 +1,158 @@
+# yt-backup command line utility to backup youtube channels easily
+# Copyright (C) 2020  w0d4
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import pytest
+
+from conftest import load_corpus
+from outcome_classifier import OutcomeClassifier, default_rules
+
+corpus = load_corpus()
+
+
+def classify(classifier, case):
+    rule = classifier.classify(case["stdout"], case["stderr"], case["returncode"] != 0)
+    # "downloaded" and no matching rule both take the video file from the youtube-dl output
+    return "downloaded" if rule is None else rule.outcome
+
+
+def classify_like_before_rule_table(stdout, stderr, returncode):
+    # The chain of checks download_video() used before the rule table, kept as reference
+    if returncode != 0:
+        if "who has blocked it on copyright" in stderr:
+            return "copyright"
+        if "who has blocked it in your country on copyright grounds" in stderr:
+            return "copyright"
+        if "unable to download video data: HTTP Error 403: Forbidden" in stderr:
+            return "video_forbidden"
+        if "HTTP Error 403: Forbidden" in stderr or "Got server HTTP error: Downloaded" in stdout:
+            return "video_forbidden"
+        if "HTTP Error 429" in stderr:
+            return "429"
+        if "HTTP Error 503" in stderr:
+            return "503"
+        if "This video has been removed for violating YouTube's policy on hate speech" in stderr:
+            return "hate_speech"
+        if "This video has been removed for violating YouTube's Community Guidelines" in stderr:
+            return "hate_speech"
+        if "This video has been removed by the uploader" in stderr:
+            return "removed_by_uploader"
+        if "This video is not available" in stderr:
+            return "offline"
+        if "Video unavailable" in stderr:
+            return "offline"
+        if "This video has been removed" in stderr:
+            return "offline"
+        if "WARNING: video doesn't have subtitles" in stderr:
+            return "downloaded"
+        if "Unable to extract video data" in stderr:
+            return "offline"
+        if "Playback on other websites has been disabled by the video owner" in stderr:
+            return "video_forbidden"
+    if "has already been recorded in archive" in stdout:
+        return "exists_already"
+    return "downloaded"
+
+
+@pytest.mark.parametrize("case", corpus, ids=[case["name"] for case in corpus])
+def test_corpus_outcome(case):
+    assert classify(OutcomeClassifier(), case) == case["outcome"]
+
+
+@pytest.mark.parametrize("case", corpus, ids=[case["name"] for case in corpus])
+def test_corpus_matches_previous_checks(case):
+    expected = case.get("baseline_outcome", case["outcome"])
+    assert classify_like_before_rule_table(case["stdout"], case["stderr"], case["returncode"]) == expected
+
+
+def test_every_default_rule_is_covered_by_the_corpus():
+    classifier = OutcomeClassifier()
+    matched_patterns = set()
+    for case in corpus:
+        rule = classifier.classify(case["stdout"], case["stderr"], case["returncode"] != 0)
+        if rule is not None:
+            matched_patterns.add(rule.pattern)
+    assert matched_patterns == {rule["pattern"] for rule in default_rules}
+
+
+def test_failure_rules_are_not_checked_for_successful_runs():
+    classifier = OutcomeClassifier()
+    assert classifier.classify("", "ERROR: Video unavailable", False) is None
+    assert classifier.classify("", "WARNING: Unable to download video thumbnail: HTTP Error 403: Forbidden", False) is None
+
+
+def test_on_success_rules_are_checked_for_successful_and_failed_runs():
+    classifier = OutcomeClassifier()
+    stdout = "[download] dQw4w9WgXcQ has already been recorded in archive"
+    assert classifier.classify(stdout, "", False).outcome == "exists_already"
+    assert classifier.classify(stdout, "ERROR: something unknown", True).outcome == "exists_already"
+    # Failure rules come first in the table
+    assert classifier.classify(stdout, "ERROR: Video unavailable", True).outcome == "offline"
+
+
+def test_custom_rules_are_checked_before_default_rules():
+    classifier = OutcomeClassifier([{"outcome": "503", "pattern": "HTTP Error 429"}])
+    assert classifier.classify("", "ERROR: HTTP Error 429: Too Many Requests", True).outcome == "503"
+
+
+def test_custom_rules_keep_their_order():
+    classifier = OutcomeClassifier([{"outcome": "offline", "pattern": "Private video"}, {"outcome": "video_forbidden", "pattern": "Sign in"}])
+    assert classifier.classify("", "ERROR: Private video\nSign in if you've been granted access to this video", True).outcome == "offline"
+
+
+def test_custom_regex_rule():
+    classifier = OutcomeClassifier([{"outcome": "offline", "pattern": r"members?-only", "regex": True}])
+    assert classifier.classify("", "ERROR: Join this channel to get access to members-only content", True).outcome == "offline"
+    assert classifier.classify("", "ERROR: members?-only", True) is None
+
+
+def test_custom_stdout_rule():
+    classifier = OutcomeClassifier([{"outcome": "exists_already", "stream": "stdout", "pattern": "has already been downloaded", "on_success": True}])
+    assert classifier.classify("[download] x.mkv has already been downloaded and merged", "", False).outcome == "exists_already"
+
+
+def test_unknown_outcome_is_rejected():
+    with pytest.raises(ValueError):
+        OutcomeClassifier([{"outcome": "gone", "pattern": "Video unavailable"}])
+
+
+def test_unknown_stream_is_rejected():
+    with pytest.raises(ValueError):
+        OutcomeClassifier([{"outcome": "offline", "stream": "stdin", "pattern": "Video unavailable"}])
+
+
+@pytest.mark.parametrize("case", corpus, ids=[case["name"] for case in corpus])
+def test_corpus_abort(case):
+    # Successful runs must never be stopped. A stopped run is classified by the output up to the line which stopped it.
+    classifier = OutcomeClassifier()
+    for line in case["stderr"].splitlines():
+        rule = classifier.abort_rule("stderr", line)
+        if rule is not None:
+            assert case["returncode"] != 0
+            stderr_until_abort = case["stderr"][:case["stderr"].index(line) + len(line)]
+            assert classifier.classify(case["stdout"], stderr_until_abort, True).outcome == rule.outcome
+            break
+
+
+def test_abort_on_error_lines():
+    classifier = OutcomeClassifier()
+    assert classifier.abort_rule("stderr", "ERROR: Unable to download webpage: HTTP Error 429: Too Many Requests (caused by HTTPError())").outcome == "429"
+    assert classifier.abort_rule("stderr", "ERROR: Video unavailable").outcome == "offline"
+
+
+def test_no_abort_on_warnings():
+    classifier = OutcomeClassifier()
+    assert classifier.abort_rule("stderr", "WARNING: Unable to download video subtitles for 'en': HTTP Error 429: Too Many Requests") is None
+    assert classifier.abort_rule("stderr", "HTTP Error 429") is None
@@ -0,0 +1,105 @@
+# yt-backup command line utility to backup youtube channels easily
+# Copyright (C) 2020  w0d4
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+from datetime import datetime, timedelta
+
+import pytest
+
+from channel import Channel
+from playlist import Playlist
+from statistic import Statistic
+from video import Video
+
+
+@pytest.fixture
+def planner(yt_backup, monkeypatch):
+    # 10000 quota a day in 24 runs, so a run may use about 416
+    monkeypatch.setitem(yt_backup.config["base"], "daily_quota_budget", 10000)
+    monkeypatch.setitem(yt_backup.config["base"], "runs_per_day", 24)
+    monkeypatch.setitem(yt_backup.config["base"], "min_sync_interval_hours", 1)
+    monkeypatch.setitem(yt_backup.config["base"], "max_sync_interval_hours", 24)
+    return yt_backup
+
+
+def add_playlist(session, name, videos=0, uploads_last_30_days=0, last_synced=None, etag=None):
+    channel = Channel(channel_id="UC" + name, channel_name=name)
+    session.add(channel)
+    session.flush()
+    playlist = Playlist(playlist_id="UU" + name, playlist_name="uploads", monitored=1, channel_id=channel.id, last_synced=last_synced, etag=etag)
+    session.add(playlist)
+    session.flush()
+    now = datetime.utcnow()
+    session.bulk_insert_mappings(Video, [{"playlist": playlist.id, "video_id": name + "-" + str(i), "title": "", "description": "", "online": 1, "download_required": 1,
+                                          "upload_date": now - timedelta(days=1) if i < uploads_last_30_days else now - timedelta(days=100)} for i in range(videos)])
+    session.commit()
+    return playlist
+
+
+def plan(yt_backup):
+    return [playlist.playlist_id for playlist in yt_backup.plan_playlist_sync(yt_backup.session.query(Playlist).order_by(Playlist.id).all())]
+
+
+def test_recently_synced_playlists_are_not_due(planner, database):
+    now = datetime.utcnow()
+    add_playlist(database, "dormant", videos=10, last_synced=now - timedelta(hours=2), etag="a")
+    add_playlist(database, "dormant_overdue", videos=10, last_synced=now - timedelta(hours=30), etag="a")
+    # 60 uploads in 30 days are due every 12 hours
+    add_playlist(database, "busy", videos=100, uploads_last_30_days=60, last_synced=now - timedelta(hours=13), etag="a")
+    add_playlist(database, "busy_synced", videos=100, uploads_last_30_days=60, last_synced=now - timedelta(hours=11), etag="a")
+    assert plan(planner) == ["UUdormant_overdue", "UUbusy"]
+
+
+def test_most_overdue_playlists_come_first(planner, database):
+    now = datetime.utcnow()
+    # Each of them costs about 50 quota, so only 8 fit into a run
+    for i in range(10):
+        add_playlist(database, "p" + str(i), videos=500, uploads_last_30_days=30, last_synced=now - timedelta(hours=24 + i), etag="a")
+    assert plan(planner) == ["UUp" + str(i) for i in range(9, 1, -1)]
+
+
+def test_most_overdue_playlist_is_planned_over_budget(planner, database):
+    # Paging 5000 videos costs 500 quota, more than the share of one run
+    add_playlist(database, "big", videos=5000)
+    add_playlist(database, "small", videos=10, last_synced=datetime.utcnow() - timedelta(hours=48), etag="a")
+    assert plan(planner) == ["UUbig"]
+
+
+def test_nothing_is_planned_without_quota_left(planner, database):
+    database.add(Statistic(statistic_type="used_quota", statistic_value="10000", statistic_date=datetime.utcnow() - timedelta(hours=1)))
+    database.commit()
+    add_playlist(database, "big", videos=5000)
+    assert plan(planner) == []
+
+
+def test_never_synced_playlists_with_etag_only_cost_an_etag_check(planner, database):
+    # Playlists synced before last_synced existed. Paging all of them would cost 200 * 20 quota.
+    for i in range(200):
+        add_playlist(database, "p" + str(i), videos=200, uploads_last_30_days=10, etag="a")
+    assert len(plan(planner)) == 200
+
+
+def test_never_synced_playlists_without_etag_are_paged(planner, database):
+    # New channels cost 5 quota per page, so about 80 of these fit into a run
+    for i in range(100):
+        add_playlist(database, "p" + str(i), videos=50)
+    assert 70 < len(plan(planner)) < 100
+
+
+def test_disabled_budget_plans_everything(planner, database, monkeypatch):
+    monkeypatch.setitem(planner.config["base"], "daily_quota_budget", 0)
+    add_playlist(database, "synced", videos=10, last_synced=datetime.utcnow(), etag="a")
+    add_playlist(database, "big", videos=5000)
+    assert plan(planner) == ["UUsynced", "UUbig"]
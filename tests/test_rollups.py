@@ -0,0 +1,135 @@
+# yt-backup command line utility to backup youtube channels easily
+# Copyright (C) 2020  w0d4
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+from datetime import date, datetime
+
+import pytest
+
+from channel import Channel
+from channel_rollup import ChannelRollup
+from daily_rollup import DailyRollup
+from playlist import Playlist
+from rollups import RollupTracker
+from video import Video
+
+video_status = {"offline": 0, "online": 1, "http_403": 2, "hate_speech": 3, "unlisted": 4}
+count_names = ["video_count", "downloaded_count", "downloaded_size", "queue_count", "copyright_count", "offline_count", "lost_count", "unlisted_count"]
+
+
+@pytest.fixture
+def channels(database):
+    # Two channels with one playlist each. Channel one has a video in every state, channel two has no videos.
+    for name in ["one", "two"]:
+        channel = Channel(channel_id="UC" + name, channel_name=name)
+        database.add(channel)
+        database.flush()
+        database.add(Playlist(playlist_id="UU" + name, playlist_name="uploads", monitored=1, channel_id=channel.id))
+    database.flush()
+    playlist = database.query(Playlist).filter(Playlist.playlist_id == "UUone").one()
+    videos = [
+        {"video_id": "downloaded", "online": video_status["online"], "downloaded": datetime(2020, 3, 1, 10), "size": "1000"},
+        {"video_id": "downloaded_later", "online": video_status["online"], "downloaded": datetime(2020, 3, 2, 23, 59), "size": "500"},
+        {"video_id": "queued", "online": video_status["online"]},
+        {"video_id": "copyright", "online": video_status["online"], "copyright": "blocked"},
+        {"video_id": "offline_but_downloaded", "online": video_status["offline"], "downloaded": datetime(2020, 3, 1, 12), "size": "10"},
+        {"video_id": "lost", "online": video_status["hate_speech"]},
+        {"video_id": "unlisted", "online": video_status["unlisted"]},
+    ]
+    database.bulk_insert_mappings(Video, [dict(video, playlist=playlist.id, title="", description="", download_required=1) for video in videos])
+    database.commit()
+    return {channel.channel_name: channel.id for channel in database.query(Channel)}
+
+
+def get_channel_rollups(session):
+    session.expire_all()
+    return {rollup.channel_id: {count_name: getattr(rollup, count_name) for count_name in count_names} for rollup in session.query(ChannelRollup)}
+
+
+def get_daily_rollups(session):
+    session.expire_all()
+    return {rollup.rollup_date: (rollup.videos_downloaded, rollup.downloaded_size) for rollup in session.query(DailyRollup)}
+
+
+expected_channel_one = {"video_count": 7, "downloaded_count": 3, "downloaded_size": 1510, "queue_count": 1, "copyright_count": 1, "offline_count": 2, "lost_count": 1, "unlisted_count": 1}
+expected_channel_two = dict.fromkeys(count_names, 0)
+
+
+def test_refresh_counts_marked_channels(channels, database):
+    rollups = RollupTracker(database, video_status)
+    rollups.mark_channels([channels["one"], channels["two"]])
+    rollups.refresh()
+    assert get_channel_rollups(database) == {channels["one"]: expected_channel_one, channels["two"]: expected_channel_two}
+    assert rollups.dirty_channel_ids == set()
+
+
+def test_refresh_without_marks_does_nothing(channels, database):
+    RollupTracker(database, video_status).refresh()
+    assert get_channel_rollups(database) == {}
+    assert get_daily_rollups(database) == {}
+
+
+def test_mark_playlists_and_videos(channels, database):
+    rollups = RollupTracker(database, video_status)
+    rollups.mark_playlists([database.query(Playlist.id).filter(Playlist.playlist_id == "UUtwo").scalar()])
+    assert rollups.dirty_channel_ids == {channels["two"]}
+    rollups = RollupTracker(database, video_status)
+    rollups.mark_videos(["queued", "unknown"])
+    assert rollups.dirty_channel_ids == {channels["one"]}
+
+
+def test_refresh_only_recounts_marked_channels(channels, database):
+    rollups = RollupTracker(database, video_status)
+    rollups.mark_channels([channels["one"], channels["two"]])
+    rollups.refresh()
+    video = database.query(Video).filter(Video.video_id == "queued").one()
+    video.downloaded = datetime(2020, 3, 3)
+    video.size = "90"
+    database.commit()
+    rollups.mark_channels([channels["two"]])
+    rollups.refresh()
+    assert get_channel_rollups(database)[channels["one"]] == expected_channel_one
+    rollups.mark_videos(["queued"])
+    rollups.refresh()
+    assert get_channel_rollups(database)[channels["one"]] == dict(expected_channel_one, downloaded_count=4, downloaded_size=1600, queue_count=0)
+
+
+def test_refresh_dates(channels, database):
+    rollups = RollupTracker(database, video_status)
+    rollups.mark_dates([date(2020, 3, 1), date(2020, 3, 2), date(2020, 3, 5)])
+    rollups.refresh()
+    assert get_daily_rollups(database) == {date(2020, 3, 1): (2, 1010), date(2020, 3, 2): (1, 500)}
+    assert rollups.dirty_dates == set()
+    database.query(Video).filter(Video.video_id == "downloaded_later").update({"downloaded": None}, synchronize_session=False)
+    database.commit()
+    rollups.mark_dates([date(2020, 3, 2)])
+    rollups.refresh()
+    assert get_daily_rollups(database) == {date(2020, 3, 1): (2, 1010)}
+
+
+def test_rebuild_matches_refresh(channels, database):
+    rollups = RollupTracker(database, video_status)
+    rollups.mark_channels([channels["one"], channels["two"]])
+    rollups.mark_dates([date(2020, 3, 1), date(2020, 3, 2)])
+    rollups.refresh()
+    refreshed = (get_channel_rollups(database), get_daily_rollups(database))
+    # Drifted and stale rows are replaced
+    database.query(ChannelRollup).update({"video_count": 99}, synchronize_session=False)
+    database.add(DailyRollup(rollup_date=date(2019, 1, 1), videos_downloaded=5, downloaded_size=5, updated=datetime.utcnow()))
+    database.commit()
+    rollups.mark_channels([channels["one"]])
+    rollups.rebuild()
+    assert (get_channel_rollups(database), get_daily_rollups(database)) == refreshed
+    assert rollups.dirty_channel_ids == set()
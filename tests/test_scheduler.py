@@ -0,0 +1,125 @@
+# yt-backup command line utility to backup youtube channels easily
+# Copyright (C) 2020  w0d4
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+from datetime import datetime, timedelta
+
+import pytest
+
+from scheduler import FifoScheduler, WeightedScheduler, get_scheduler
+
+now = datetime(2020, 6, 1, 12, 0, 0)
+
+
+def take_all(scheduler, running_downloads_per_channel=None, max_workers_per_channel=1):
+    running_downloads_per_channel = running_downloads_per_channel or {}
+    internal_video_ids = []
+    while True:
+        internal_video_id = scheduler.next_video(running_downloads_per_channel, max_workers_per_channel)
+        if internal_video_id is None:
+            return internal_video_ids
+        internal_video_ids.append(internal_video_id)
+
+
+def test_fifo_keeps_the_queue_order_per_channel():
+    scheduler = FifoScheduler({}, now)
+    for internal_video_id, local_channel_id in [(1, 10), (2, 20), (3, 10), (4, 20)]:
+        scheduler.add(internal_video_id, local_channel_id)
+    assert len(scheduler) == 4
+    assert take_all(scheduler) == [1, 3, 2, 4]
+    assert len(scheduler) == 0
+
+
+def test_fifo_skips_channels_at_their_limit():
+    scheduler = FifoScheduler({}, now)
+    for internal_video_id, local_channel_id in [(1, 10), (2, 10), (3, 20)]:
+        scheduler.add(internal_video_id, local_channel_id)
+    assert scheduler.next_video({10: 2}, 2) == 3
+    assert scheduler.next_video({10: 2, 20: 2}, 2) is None
+    assert scheduler.next_video({10: 1}, 2) == 1
+
+
+def test_weighted_prefers_recent_uploads():
+    scheduler = WeightedScheduler({"fairness_weight": 0}, now)
+    scheduler.add(1, 10, upload_date=now - timedelta(days=300))
+    scheduler.add(2, 10, upload_date=now - timedelta(days=1))
+    scheduler.add(3, 10, upload_date=None)
+    scheduler.add(4, 10, upload_date=now - timedelta(days=30))
+    assert take_all(scheduler) == [2, 4, 1, 3]
+
+
+def test_weighted_prefers_channels_with_higher_priority():
+    scheduler = WeightedScheduler({"fairness_weight": 0}, now)
+    scheduler.add(1, 10, channel_priority=1.0, upload_date=now - timedelta(days=1))
+    scheduler.add(2, 20, channel_priority=3.0, upload_date=now - timedelta(days=100))
+    assert take_all(scheduler) == [2, 1]
+
+
+def test_weighted_channels_take_turns():
+    # Without fairness all videos of the channel with the newer uploads would come first
+    scheduler = WeightedScheduler({}, now)
+    for i in range(3):
+        scheduler.add(10 + i, 10, upload_date=now - timedelta(days=i))
+        scheduler.add(20 + i, 20, upload_date=now - timedelta(days=10 + i))
+    assert take_all(scheduler) == [10, 20, 11, 21, 12, 22]
+    unfair_scheduler = WeightedScheduler({"fairness_weight": 0}, now)
+    for i in range(3):
+        unfair_scheduler.add(10 + i, 10, upload_date=now - timedelta(days=i))
+        unfair_scheduler.add(20 + i, 20, upload_date=now - timedelta(days=10 + i))
+    assert take_all(unfair_scheduler) == [10, 11, 12, 20, 21, 22]
+
+
+def test_weighted_fast_lane_comes_first():
+    scheduler = WeightedScheduler({"fast_lane_hours": 24, "channel_priority_weight": 1}, now)
+    scheduler.add(1, 10, channel_priority=100.0, upload_date=now - timedelta(hours=30), discovered=now - timedelta(hours=1))
+    scheduler.add(2, 20, channel_priority=1.0, upload_date=now - timedelta(hours=2), discovered=now - timedelta(hours=1))
+    assert scheduler.in_fast_lane(2)
+    assert not scheduler.in_fast_lane(1)
+    assert take_all(scheduler) == [2, 1]
+
+
+def test_weighted_backfill_of_new_channel_is_not_in_fast_lane():
+    # Discovered right now, but uploaded long ago
+    scheduler = WeightedScheduler({"fast_lane_hours": 24}, now)
+    scheduler.add(1, 10, upload_date=now - timedelta(days=400), discovered=now)
+    scheduler.add(2, 10, upload_date=now - timedelta(hours=1), discovered=None)
+    assert not scheduler.in_fast_lane(1)
+    assert not scheduler.in_fast_lane(2)
+
+
+def test_weighted_respects_the_parallel_download_limit():
+    scheduler = WeightedScheduler({}, now)
+    scheduler.add(1, 10, upload_date=now)
+    scheduler.add(2, 10, upload_date=now)
+    scheduler.add(3, 20, upload_date=now - timedelta(days=1000))
+    assert scheduler.next_video({10: 2}, 2) == 3
+    assert scheduler.next_video({10: 2}, 2) is None
+    assert sorted(take_all(scheduler, {10: 1}, 2)) == [1, 2]
+
+
+def test_weighted_videos_added_later_are_sorted_in():
+    scheduler = WeightedScheduler({}, now)
+    scheduler.add(1, 10, upload_date=now - timedelta(days=100))
+    scheduler.add(2, 10, upload_date=now - timedelta(days=50))
+    assert scheduler.next_video({}, 1) == 2
+    scheduler.add(3, 10, upload_date=now)
+    assert take_all(scheduler) == [3, 1]
+
+
+def test_get_scheduler():
+    assert isinstance(get_scheduler({}, now), WeightedScheduler)
+    assert isinstance(get_scheduler({"strategy": "fifo"}, now), FifoScheduler)
+    with pytest.raises(ValueError):
+        get_scheduler({"strategy": "random"}, now)
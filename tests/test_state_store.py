@@ -0,0 +1,129 @@
+# yt-backup command line utility to backup youtube channels easily
+# Copyright (C) 2020  w0d4
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import time
+
+import pytest
+
+from base import engine
+from runtime_state import RuntimeState
+from state_store import StateStore
+
+
+@pytest.fixture
+def store(database):
+    # A long debounce interval, so only flush() writes debounced values
+    store = StateStore(engine, debounce_seconds=60)
+    store.load()
+    yield store
+    store.flush()
+
+
+def read_database(session):
+    session.expire_all()
+    return {state.state_type: state.state_value for state in session.query(RuntimeState).all()}
+
+
+def test_set_writes_right_away(store, database):
+    store.set("quota_exceeded", "1")
+    assert store.get("quota_exceeded").value == "1"
+    assert store.get("unknown") is None
+    assert read_database(database) == {"quota_exceeded": "1"}
+    store.set("quota_exceeded", "0")
+    assert read_database(database) == {"quota_exceeded": "0"}
+
+
+def test_load_reads_the_database(store, database):
+    store.set("http_429_state", "1")
+    other_store = StateStore(engine)
+    other_store.load()
+    assert other_store.get("http_429_state").value == "1"
+
+
+def test_debounced_values_are_written_on_flush(store, database):
+    store.set("status", "downloading", debounce=True)
+    store.set("status", "uploading", debounce=True)
+    assert store.get("status").value == "uploading"
+    assert read_database(database) == {}
+    store.flush()
+    assert read_database(database) == {"status": "uploading"}
+
+
+def test_debounced_unchanged_values_are_not_written_again(store, database, monkeypatch):
+    store.set("status", "idle", debounce=True)
+    store.flush()
+    writes = []
+    monkeypatch.setattr(store, "write", writes.append)
+    store.set("status", "idle", debounce=True)
+    store.flush()
+    assert writes == []
+
+
+def test_debounced_values_are_written_by_the_timer(database):
+    store = StateStore(engine, debounce_seconds=0.05)
+    store.load()
+    store.set("status", "downloading", debounce=True)
+    for i in range(100):
+        if read_database(database) == {"status": "downloading"}:
+            break
+        time.sleep(0.05)
+    assert read_database(database) == {"status": "downloading"}
+    assert store.flush_timer is None
+
+
+def test_refresh_reads_changes_of_other_processes(store, database):
+    store.set("http_429_state", "0")
+    store.set("quota_exceeded", "1")
+    other_store = StateStore(engine)
+    other_store.load()
+    other_store.set("http_429_state", "1")
+    other_store.delete("quota_exceeded")
+    assert store.get("http_429_state").value == "0"
+    store.refresh(["http_429_state", "quota_exceeded"])
+    assert store.get("http_429_state").value == "1"
+    assert store.get("quota_exceeded") is None
+
+
+def test_refresh_keeps_values_which_are_not_written_yet(store, database):
+    store.set("status", "downloading", debounce=True)
+    other_store = StateStore(engine)
+    other_store.load()
+    other_store.set("status", "idle")
+    store.refresh(["status"])
+    assert store.get("status").value == "downloading"
+    store.flush()
+    assert read_database(database) == {"status": "downloading"}
+
+
+def test_refresh_skips_recently_read_states(store, database):
+    other_store = StateStore(engine)
+    other_store.load()
+    other_store.set("http_429_state", "1")
+    store.refresh(["http_429_state"], max_age_seconds=3600)
+    assert store.get("http_429_state") is None
+    store.refresh(["http_429_state"])
+    assert store.get("http_429_state").value == "1"
+
+
+def test_delete(store, database):
+    store.set("quota_exceeded", "1")
+    store.set("status", "downloading", debounce=True)
+    store.delete("quota_exceeded")
+    store.delete("status")
+    store.flush()
+    assert store.get("quota_exceeded") is None
+    assert store.get("status") is None
+    assert read_database(database) == {}
@@ -0,0 +1,101 @@
+# yt-backup command line utility to backup youtube channels easily
+# Copyright (C) 2020  w0d4
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import time
+
+import pytest
+
+from base import engine
+from operation import Operation
+from state_store import StateStore
+from statistic import Statistic
+from telemetry import TelemetryWriter
+
+
+@pytest.fixture
+def writer(database):
+    # A long flush interval, so only full batches and flush() write rows
+    writer = TelemetryWriter(engine, batch_size=3, flush_seconds=60)
+    yield writer
+    writer.flush()
+
+
+def count_rows(session):
+    session.expire_all()
+    return session.query(Operation).count(), session.query(Statistic).count()
+
+
+def test_full_batch_is_written(writer, database):
+    writer.log_operation(1, "download_video", "a")
+    writer.log_statistic("used_quota", "5")
+    assert count_rows(database) == (0, 0)
+    writer.log_operation(2, "download_video", "b")
+    assert count_rows(database) == (2, 1)
+    assert writer.pending_row_count == 0
+    assert writer.flush_timer is None
+
+
+def test_flush_writes_waiting_rows(writer, database):
+    writer.log_operation(1, "download_video", "a")
+    writer.flush()
+    assert count_rows(database) == (1, 0)
+    operation = database.query(Operation).one()
+    assert (operation.duration, operation.operation_type, operation.operation_description) == (1, "download_video", "a")
+
+
+def test_waiting_rows_are_written_by_the_timer(database):
+    writer = TelemetryWriter(engine, batch_size=100, flush_seconds=0.05)
+    writer.log_statistic("used_quota", "5")
+    for i in range(100):
+        if count_rows(database) == (0, 1):
+            break
+        time.sleep(0.05)
+    assert count_rows(database) == (0, 1)
+    assert writer.flush_timer is None
+
+
+def test_rows_are_kept_when_the_database_fails(writer, database):
+    writer.log_operation(1, "download_video", "a")
+    writer.log_statistic("used_quota", "5")
+    Operation.__table__.drop(engine)
+    writer.flush()
+    assert writer.pending_row_count == 2
+    Operation.__table__.create(engine)
+    writer.log_operation(2, "download_video", "b")
+    assert count_rows(database) == (2, 1)
+    assert [operation.operation_description for operation in database.query(Operation).order_by(Operation.id)] == ["a", "b"]
+
+
+def test_flush_while_the_lock_is_held(writer, database):
+    # The Ctrl+C handler flushes in the main thread, which may be inside add() or flush() at that moment
+    writer.log_operation(1, "download_video", "a")
+    with writer.lock:
+        assert writer.lock.acquire(timeout=1)
+        writer.lock.release()
+        writer.flush()
+    assert count_rows(database) == (1, 0)
+
+
+def test_state_store_flush_while_the_lock_is_held(database):
+    store = StateStore(engine, debounce_seconds=60)
+    store.load()
+    store.set("status", "aborted", debounce=True)
+    with store.lock:
+        assert store.lock.acquire(timeout=1)
+        store.lock.release()
+        store.flush()
+    store.load()
+    assert store.get("status").value == "aborted"
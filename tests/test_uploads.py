@@ -0,0 +1,89 @@
+# yt-backup command line utility to backup youtube channels easily
+# Copyright (C) 2020  w0d4
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import os
+import shutil
+import stat
+import sys
+
+import pytest
+
+fake_rclone = """#!{python}
+import shutil, sys
+with open({log_file!r}, "a") as f:
+    f.write(" ".join(sys.argv[1:]) + "\\n")
+if {fail}:
+    sys.exit(1)
+if "move" in sys.argv:
+    shutil.rmtree(sys.argv[sys.argv.index("move") + 1], ignore_errors=True)
+"""
+
+
+def write_video_files(directory):
+    os.makedirs(directory)
+    with open(os.path.join(directory, "video.mkv"), "wb") as f:
+        f.write(b"0" * 1000)
+
+
+@pytest.fixture
+def download_dir(yt_backup, tmp_path, monkeypatch):
+    download_dir = str(tmp_path / "download")
+    os.makedirs(download_dir)
+    monkeypatch.setitem(yt_backup.config["base"], "download_dir", download_dir)
+    monkeypatch.setitem(yt_backup.config["base"], "download_lockfile", str(tmp_path / "download.lock"))
+    monkeypatch.setitem(yt_backup.config["rclone"], "config_path", "")
+    monkeypatch.setattr(yt_backup.egress_identity, "get", lambda proxy="": {"proxy": proxy, "ip": "127.0.0.1", "country": "DE"})
+    yield download_dir
+    shutil.rmtree(download_dir, ignore_errors=True)
+
+
+def use_fake_rclone(yt_backup, tmp_path, monkeypatch, fail=False):
+    log_file = str(tmp_path / "rclone.log")
+    rclone = str(tmp_path / "rclone")
+    with open(rclone, "w") as f:
+        f.write(fake_rclone.format(python=sys.executable, log_file=log_file, fail=fail))
+    os.chmod(rclone, os.stat(rclone).st_mode | stat.S_IEXEC)
+    monkeypatch.setitem(yt_backup.config["rclone"], "binary_path", rclone)
+    return log_file
+
+
+def read_uploaded_dirs(log_file):
+    if not os.path.exists(log_file):
+        return []
+    with open(log_file, "r") as f:
+        return sorted(line.split()[1].strip("'") for line in f)
+
+
+def test_unfinished_and_failed_uploads_are_uploaded_again(yt_backup, download_dir, tmp_path, monkeypatch):
+    log_file = use_fake_rclone(yt_backup, tmp_path, monkeypatch)
+    # A run which was stopped before its queued upload, one which failed to upload and an aborted download
+    write_video_files(os.path.join(download_dir, "upload", "queued"))
+    write_video_files(os.path.join(download_dir, "failed_uploads", "failed"))
+    write_video_files(os.path.join(download_dir, "worker-0", "channel"))
+    yt_backup.download_videos()
+    assert read_uploaded_dirs(log_file) == [os.path.join(download_dir, "failed_uploads", "failed"), os.path.join(download_dir, "upload", "queued")]
+    assert not os.path.exists(os.path.join(download_dir, "worker-0"))
+    assert os.listdir(os.path.join(download_dir, "upload")) == []
+    assert os.listdir(os.path.join(download_dir, "failed_uploads")) == []
+
+
+def test_failed_upload_is_kept_for_the_next_run(yt_backup, download_dir, tmp_path, monkeypatch):
+    log_file = use_fake_rclone(yt_backup, tmp_path, monkeypatch, fail=True)
+    write_video_files(os.path.join(download_dir, "upload", "queued"))
+    yt_backup.download_videos()
+    assert read_uploaded_dirs(log_file) == [os.path.join(download_dir, "upload", "queued")]
+    assert os.listdir(os.path.join(download_dir, "failed_uploads")) == ["queued"]
+    assert os.listdir(os.path.join(download_dir, "failed_uploads", "queued")) == ["video.mkv"]
@@ -0,0 +1,114 @@
+# yt-backup command line utility to backup youtube channels easily
+# Copyright (C) 2020  w0d4
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import json
+
+import pytest
+
+video_id = "dQw4w9WgXcQ"
+
+info = {
+    "id": video_id, "format_id": "137+140", "duration": 212, "width": 1920, "height": 1080, "vcodec": "avc1.640028", "acodec": "mp4a.40.2",
+    "requested_formats": [
+        {"format_id": "137", "filesize": 900, "vcodec": "avc1.640028", "acodec": "none", "width": 1920, "height": 1080},
+        {"format_id": "140", "filesize": 100, "vcodec": "none", "acodec": "mp4a.40.2"},
+    ],
+}
+
+
+@pytest.fixture
+def ffprobe(yt_backup, monkeypatch):
+    # Counts the ffprobe runs instead of running it
+    calls = []
+
+    def get_video_duration(file):
+        calls.append("duration")
+        return 100.0
+
+    def get_video_resolution(file):
+        calls.append("resolution")
+        return "640x360"
+
+    monkeypatch.setattr(yt_backup, "get_video_duration", get_video_duration)
+    monkeypatch.setattr(yt_backup, "get_video_resolution", get_video_resolution)
+    return calls
+
+
+def write_video(tmp_path, size, info=None):
+    video_file = str(tmp_path / ("video [" + video_id + "].mkv"))
+    with open(video_file, "wb") as f:
+        f.write(b"\0" * size)
+    if info is not None:
+        with open(str(tmp_path / ("video [" + video_id + "].info.json")), "w") as f:
+            json.dump(info, f)
+    return video_file
+
+
+def test_read_info_json(yt_backup, tmp_path):
+    assert yt_backup.read_info_json(video_id, write_video(tmp_path, 1)) is None
+    assert yt_backup.read_info_json(video_id, write_video(tmp_path, 1, info)) == info
+    assert yt_backup.read_info_json(video_id, write_video(tmp_path, 1, dict(info, id="other"))) is None
+    with open(str(tmp_path / ("video [" + video_id + "].info.json")), "w") as f:
+        f.write("{broken")
+    assert yt_backup.read_info_json(video_id, str(tmp_path / ("video [" + video_id + "].mkv"))) is None
+
+
+def test_get_expected_video_size(yt_backup):
+    assert yt_backup.get_expected_video_size(info) == (1000, False)
+    approx_formats = [{"filesize": 900}, {"filesize_approx": 200}]
+    assert yt_backup.get_expected_video_size({"requested_formats": approx_formats}) == (1100, True)
+    assert yt_backup.get_expected_video_size({"requested_formats": [{"filesize": 900}, {}]}) == (None, True)
+    assert yt_backup.get_expected_video_size({"filesize": 500}) == (500, False)
+    assert yt_backup.get_expected_video_size({"filesize_approx": 500}) == (500, True)
+    assert yt_backup.get_expected_video_size({}) == (None, True)
+
+
+def test_matching_size_skips_ffprobe(yt_backup, ffprobe, tmp_path):
+    metadata = yt_backup.get_video_metadata(video_id, write_video(tmp_path, 950, info))
+    assert ffprobe == []
+    assert metadata == {"runtime": 212.0, "resolution": "1920x1080", "size": 950, "video_format": "137+140", "video_codec": "avc1.640028", "audio_codec": "mp4a.40.2"}
+
+
+def test_estimated_size_allows_more_difference(yt_backup, ffprobe, tmp_path):
+    approx_info = dict(info, requested_formats=[dict(requested_format, filesize=None, filesize_approx=requested_format["filesize"]) for requested_format in info["requested_formats"]])
+    yt_backup.get_video_metadata(video_id, write_video(tmp_path, 600, approx_info))
+    assert ffprobe == []
+
+
+def test_too_small_file_falls_back_to_ffprobe(yt_backup, ffprobe, tmp_path):
+    # A download which broke off still has the full info.json
+    metadata = yt_backup.get_video_metadata(video_id, write_video(tmp_path, 500, info))
+    assert ffprobe == ["duration", "resolution"]
+    assert (metadata["runtime"], metadata["resolution"]) == (100.0, "640x360")
+    # Format and codecs do not depend on how much was downloaded
+    assert (metadata["video_format"], metadata["video_codec"], metadata["audio_codec"]) == ("137+140", "avc1.640028", "mp4a.40.2")
+
+
+def test_without_size_the_duration_is_checked(yt_backup, ffprobe, tmp_path):
+    unknown_size_info = {key: value for key, value in info.items() if key != "requested_formats"}
+    metadata = yt_backup.get_video_metadata(video_id, write_video(tmp_path, 10, dict(unknown_size_info, duration=100.5)))
+    assert ffprobe == ["duration"]
+    assert (metadata["runtime"], metadata["resolution"]) == (100.0, "1920x1080")
+    ffprobe.clear()
+    metadata = yt_backup.get_video_metadata(video_id, write_video(tmp_path, 10, unknown_size_info))
+    assert ffprobe == ["duration", "resolution"]
+    assert (metadata["runtime"], metadata["resolution"]) == (100.0, "640x360")
+
+
+def test_without_info_json_everything_is_probed(yt_backup, ffprobe, tmp_path):
+    metadata = yt_backup.get_video_metadata(video_id, write_video(tmp_path, 10))
+    assert ffprobe == ["duration", "resolution"]
+    assert metadata == {"runtime": 100.0, "resolution": "640x360", "size": 10, "video_format": None, "video_codec": None, "audio_codec": None}
@@ -13,13 +13,18 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
-from sqlalchemy import Column, String, Integer, ForeignKey, Text, DateTime
+from sqlalchemy import Column, String, Integer, ForeignKey, Text, DateTime, Index
 
 from base import Base
 
 
 class Video(Base):
     __tablename__ = 'videos'
+    __table_args__ = (
+        Index('ix_videos_download_queue', 'download_required', 'downloaded', 'online', 'playlist'),
+        Index('ix_videos_playlist_state', 'playlist', 'online', 'downloaded'),
+        Index('ix_videos_downloaded', 'downloaded'),
+    )
     id = Column(Integer, primary_key=True)
     playlist = Column(Integer, ForeignKey('playlists.id'), nullable=False)
     video_id = Column(String(length=255), nullable=False, unique=True)
@@ -33,3 +38,7 @@ class Video(Base):
     copyright = Column(String(length=3000))
     download_required = Column(Integer)
     upload_date = Column(DateTime)
+    discovered = Column(DateTime)
+    video_format = Column(String(length=255))
+    video_codec = Column(String(length=64))
+    audio_codec = Column(String(length=64))
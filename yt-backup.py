@@ -15,33 +15,51 @@
 
 
 import argparse
+import asyncio
+import atexit
 import googleapiclient.discovery
 import googleapiclient.errors
 import json
 import logging
+import metrics
 import os
 import pickle
+import queue
 import re
-import requests
+import shlex
 import shutil
 import signal
 import sqlalchemy
 import subprocess
 import sys
+import threading
 import time
-from datetime import datetime
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime, timedelta
+from functools import partial
 from google.auth.transport.requests import Request
 from google_auth_oauthlib.flow import InstalledAppFlow
 from pathlib import Path
 from random import randint
-from sqlalchemy import func, or_
+from sqlalchemy import and_, case, func, or_
 from time import sleep
 
 from base import Session, engine, Base
 from channel import Channel
+from download_archive import DownloadArchive
+from egress_identity import EgressIdentityResolver
+from embedded_downloader import EmbeddedDownloader
+from migrations import migrate
 from operation import Operation
+from outcome_classifier import OutcomeClassifier
 from playlist import Playlist
+from rollups import RollupTracker
+from runtime_state import RuntimeState
+from scheduler import get_scheduler, schedulers
+from state_store import StateStore
 from statistic import Statistic
+from telemetry import TelemetryWriter
 from video import Video
 
 api_service_name = "youtube"
@@ -49,11 +67,17 @@ api_version = "v3"
 client_secrets_file = "client_secret.json"
 SCOPES = ["https://www.googleapis.com/auth/youtube.readonly"]
 
+# The credentials are loaded once per process. httplib2 connections are not thread safe, so every thread builds its own API client once.
+google_api_credentials = None
+google_api_credentials_lock = threading.Lock()
+youtube_api_clients = threading.local()
+
 Base.metadata.create_all(engine)
 session = Session()
+runtime_state = StateStore(engine)
 
 parser = argparse.ArgumentParser(description='yt-backup')
-parser.add_argument("mode", action="store", type=str, help="Valid options: add_channel, get_playlists, get_video_infos, download_videos, run, toggle_channel_download, generate_statistics, verify_offline_videos, verify_channels, list_playlists, modify_playlist, modify_channel, add_video")
+parser.add_argument("mode", action="store", type=str, help="Valid options: add_channel, get_playlists, get_video_infos, download_videos, run, toggle_channel_download, generate_statistics, verify_offline_videos, verify_channels, list_playlists, modify_playlist, modify_channel, add_video, rebuild_rollups")
 parser.add_argument("--channel_id", action="store", type=str, help="Defines a channel ID to work on. Required for modes: add_channel")
 parser.add_argument("--username", action="store", type=str, help="Defines a channel name to work on. Required for modes: add_channel")
 parser.add_argument("--playlist_id", action="store", type=str, help="Defines a playlist ID to work on. Optional for modes: get_video_infos, download_videos")
@@ -79,6 +103,8 @@ parser.add_argument("--duration", action="store", type=str, help="When adding a
 parser.add_argument("--video_status", action="store", type=str, help="When adding a video with add_video, this can be added as option")
 parser.add_argument("--print_quota", action="store_true", help="Print used quota information during run.")
 parser.add_argument("--force_refresh", action="store_true", help="Forces the update of video data of playlists.")
+parser.add_argument("--output_format", action="store", type=str, default="text", choices=["text", "json", "tsv"], help="Output format of list_playlists. Defaults to text.")
+parser.add_argument("--workers", action="store", type=int, default=1, help="Number of videos which are downloaded in parallel in download_videos mode. Defaults to 1.")
 parser.add_argument("--debug", action="store_true")
 parser.add_argument("-V", action="version", version="%(prog)s 0.9.5")
 args = parser.parse_args()
@@ -108,6 +134,14 @@ except json.decoder.JSONDecodeError:
 
 # save used quota for every run
 used_quota_this_run: int = 0
+used_quota_lock = threading.Lock()
+
+# how many youtube API requests may run at the same time
+api_requests_in_flight = max(1, int(config["base"].get("api_requests_in_flight", 8)))
+api_executor = None
+# Operations and statistics are written in batches instead of committing every single row
+telemetry = TelemetryWriter(engine, int(config["base"].get("telemetry_batch_size", 100)), float(config["base"].get("telemetry_flush_seconds", 10)))
+egress_identity = EgressIdentityResolver(config["base"].get("ip_lookup_url", "https://ipinfo.io"), float(config["base"].get("ip_lookup_timeout_seconds", 5)), float(config["base"].get("ip_lookup_ttl_minutes", 60)) * 60, runtime_state)
 
 # Psave the parsed arguments for easier use
 mode = args.mode
@@ -136,9 +170,35 @@ print_quota = args.print_quota
 force_refresh = args.force_refresh
 reset_quota_exceeded_state = args.reset_quota_exceeded_state
 reset_429_state = args.reset_429_state
+workers = max(1, args.workers)
+output_format = args.output_format
 
 # define video status
 video_status = {"offline": 0, "online": 1, "http_403": 2, "hate_speech": 3, "unlisted": 4}
+rollups = RollupTracker(session, video_status)
+
+# how many IDs can be requested from the youtube API at once
+google_api_id_limit = 50
+
+# how many IDs are put into one IN (...) clause of a database query
+database_id_chunk_size = 1000
+
+# results of download_video() which are not a downloaded file
+download_outcomes = ("copyright", "forbidden", "video_forbidden", "429", "503", "hate_speech", "not_downloaded", "removed_by_uploader", "offline", "exists_already")
+# maps the youtube-dl output of a run to one of the download outcomes
+outcome_classifier = OutcomeClassifier(config["youtube-dl"].get("outcome_rules", []))
+# youtube-dl is started as a new process for every video, unless the embedded yt-dlp backend is configured and installed
+youtube_dl_backend = config["youtube-dl"].get("backend", "subprocess")
+if youtube_dl_backend not in ("subprocess", "embedded"):
+    raise ValueError("Unknown youtube-dl backend " + str(youtube_dl_backend) + ". Possible values: subprocess, embedded")
+embedded_downloader = None
+if youtube_dl_backend == "embedded":
+    try:
+        embedded_downloader = EmbeddedDownloader()
+    except ImportError as e:
+        logger.error(str(e) + ". Falling back to the youtube-dl binary.")
+youtube_dl_progress_pattern = re.compile(r'\[download\]\s+(?P<percent>[\d.]+)%(?:.* at\s+(?P<speed>[\d.]+)(?P<speed_unit>[KMGT]?i?B)/s)?(?:.* ETA\s+(?P<eta>\d+(?::\d+)+))?')
+byte_unit_factors = {"B": 1, "KiB": 1024, "MiB": 1024 ** 2, "GiB": 1024 ** 3, "TiB": 1024 ** 4, "KB": 1000, "MB": 1000 ** 2, "GB": 1000 ** 3, "TB": 1000 ** 4}
 
 
 def get_current_timestamp():
@@ -148,7 +208,9 @@ def get_current_timestamp():
 
 def add_quota(quota_used: int):
     global used_quota_this_run
-    used_quota_this_run = used_quota_this_run + quota_used
+    with used_quota_lock:
+        used_quota_this_run = used_quota_this_run + quota_used
+    metrics.api_quota_used.inc(quota_used)
     if print_quota:
         logger.info("This API call costed " + str(quota_used) + " API quota. Totally used " + str(used_quota_this_run) + " this run.")
 
@@ -157,14 +219,10 @@ def persist_quota():
     global used_quota_this_run
     if used_quota_this_run == 0:
         return None
-    stat_quota = Statistic()
-    stat_quota.statistic_type = "used_quota"
-    stat_quota.statistic_date = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
-    stat_quota.statistic_value = str(used_quota_this_run)
-    session.add(stat_quota)
-    session.commit()
+    log_statistic("used_quota", str(used_quota_this_run))
     if print_quota:
         logger.info("Used " + str(used_quota_this_run) + " API Quota totally this run.")
+        telemetry.flush()
         print_quota_last_24_hours()
 
 
@@ -192,9 +250,25 @@ def print_quota_last_24_hours():
             logger.error("Problem during getting quota info from database.")
 
 
+def start_metrics_exporter():
+    metrics_config = config.get("metrics", {})
+    if metrics_config.get("listen_port", 0):
+        address = metrics_config.get("listen_address", "127.0.0.1")
+        try:
+            metrics.registry.start_http_server(address, int(metrics_config["listen_port"]))
+            logger.debug("Serving metrics on " + address + ":" + str(metrics_config["listen_port"]))
+        except OSError as e:
+            logger.error("Could not start metrics endpoint: " + str(e))
+    if metrics_config.get("textfile", "") != "":
+        metrics.registry.start_textfile_writer(metrics_config["textfile"], float(metrics_config.get("textfile_interval_seconds", 15)))
+        atexit.register(metrics.registry.write_textfile, metrics_config["textfile"])
+
+
 def signal_handler(sig, frame):
     logger.info('Catched Ctrl+C!')
     set_status("aborted")
+    runtime_state.flush()
+    telemetry.flush()
     if os.path.exists(config["base"]["download_lockfile"]):
         logger.debug("Removing download lockfile")
         os.remove(config["base"]["download_lockfile"])
@@ -214,71 +288,36 @@ def sanititze_string(name: str):
 
 
 def log_operation(duration, operation_type, operation_description):
-    operation = Operation()
-    operation.duration = duration
-    operation.operation_type = operation_type
-    operation.operation_description = operation_description
-    operation.operation_date = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
-    session.add(operation)
-    session.commit()
+    telemetry.log_operation(duration, operation_type, operation_description)
 
 
 def set_status(new_status):
-    current_status = session.query(Statistic).filter(Statistic.statistic_type == "status").scalar()
-    if current_status is None:
-        current_status = Statistic()
-        current_status.statistic_type = "status"
-    current_status.statistic_date = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
-    current_status.statistic_value = new_status
-    session.add(current_status)
-    session.commit()
+    runtime_state.set("status", new_status, debounce=True)
 
 
 def set_currently_downloading(video_name):
-    currently_downloading = session.query(Statistic).filter(Statistic.statistic_type == "currently_downloading").scalar()
-    if currently_downloading is None:
-        currently_downloading = Statistic()
-        currently_downloading.statistic_type = "currently_downloading"
-    currently_downloading.statistic_date = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
-    currently_downloading.statistic_value = video_name
-    session.add(currently_downloading)
-    session.commit()
+    runtime_state.set("currently_downloading", video_name, debounce=True)
 
 
 def set_http_429_state():
-    http_429_state = session.query(Statistic).filter(Statistic.statistic_type == "http_429_state").scalar()
-    if http_429_state is None:
-        http_429_state = Statistic()
-        http_429_state.statistic_type = "http_429_state"
-    http_429_state.statistic_date = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
-    http_429_state.statistic_value = get_current_ytdl_ip()
-    session.add(http_429_state)
-    session.commit()
+    runtime_state.set("http_429_state", get_current_ytdl_ip())
 
 
 def clear_http_429_state():
-    http_429_state = session.query(Statistic).filter(Statistic.statistic_type == "http_429_state").scalar()
-    if http_429_state is None:
-        http_429_state = Statistic()
-        http_429_state.statistic_type = "http_429_state"
-    http_429_state.statistic_date = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
-    http_429_state.statistic_value = ""
-    session.add(http_429_state)
-    session.commit()
+    runtime_state.set("http_429_state", "")
 
 
 def reset_http_429_state():
-    http_429_state = session.query(Statistic).filter(Statistic.statistic_type == "http_429_state").scalar()
-    if http_429_state is None:
+    if get_http_429_state() is None:
         return None
-    session.delete(http_429_state)
-    session.commit()
+    runtime_state.delete("http_429_state")
     logger.info("HTTP 429 state has been deleted.")
 
 
 def get_http_429_state():
-    http_429_state = session.query(Statistic).filter(Statistic.statistic_type == "http_429_state").scalar()
-    return http_429_state
+    # Another run may have set or cleared it in the meantime
+    runtime_state.refresh(["http_429_state"])
+    return runtime_state.get("http_429_state")
 
 
 def check_429_lock():
@@ -289,13 +328,11 @@ def check_429_lock():
     if http_429_state is None:
         return False
     else:
-        ytdl_ip_of_last_429 = http_429_state.statistic_value
+        ytdl_ip_of_last_429 = http_429_state.value
         logger.debug("Calculate difference since last 429")
         if ytdl_ip_of_last_429 != get_current_ytdl_ip():
             return False
-        date_of_last_429 = datetime.strptime(str(http_429_state.statistic_date), '%Y-%m-%d %H:%M:%S')
-        current_time = datetime.now()
-        delta = current_time - date_of_last_429
+        delta = datetime.utcnow() - http_429_state.date
         logger.debug("Delta seconds since last 429: " + str(delta.total_seconds()))
         if delta.total_seconds() < 48 * 60 * 60:
             return True
@@ -305,73 +342,45 @@ def check_429_lock():
 
 
 def set_quota_exceeded_state():
-    quota_exceeded_state = session.query(Statistic).filter(Statistic.statistic_type == "quota_exceeded_state").scalar()
-    if quota_exceeded_state is None:
-        quota_exceeded_state = Statistic()
-        quota_exceeded_state.statistic_type = "quota_exceeded_state"
-    quota_exceeded_state.statistic_date = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
-    quota_exceeded_state.statistic_value = "Quota exceeded"
-    session.add(quota_exceeded_state)
-    session.commit()
+    runtime_state.set("quota_exceeded_state", "Quota exceeded")
 
 
 def clear_quota_exceeded_state():
-    quota_exceeded_state = session.query(Statistic).filter(Statistic.statistic_type == "quota_exceeded_state").scalar()
-    if quota_exceeded_state is None:
+    runtime_state.refresh(["quota_exceeded_state"])
+    if get_quota_exceeded_state() is None:
         return None
-    session.delete(quota_exceeded_state)
-    session.commit()
+    runtime_state.delete("quota_exceeded_state")
 
 
 def get_quota_exceeded_state():
-    quota_exceeded_state = session.query(Statistic).filter(Statistic.statistic_type == "quota_exceeded_state").scalar()
-    return quota_exceeded_state
+    return runtime_state.get("quota_exceeded_state")
 
 
 def check_quota_exceeded_state():
+    # Runs before every API request, so the state set by other runs is read from the database at most once a minute
+    runtime_state.refresh(["quota_exceeded_state"], 60)
     quota_exceeded_state = get_quota_exceeded_state()
     if quota_exceeded_state is None:
         return False
     else:
-        logger.debug("Calculate difference since last quota_exceeded error")
-        date_of_last_quota_exceeded_state = datetime.strptime(str(quota_exceeded_state.statistic_date), '%Y-%m-%d %H:%M:%S')
-        current_time = datetime.now()
-        delta = current_time - date_of_last_quota_exceeded_state
-        logger.debug("Delta seconds since last quota_exceeded_state: " + str(delta.total_seconds()))
+        delta = datetime.utcnow() - quota_exceeded_state.date
         if delta.total_seconds() < 48 * 60 * 60:
             return True
         else:
+            logger.debug("Last quota_exceeded_state is " + str(delta.total_seconds()) + " seconds old. Clearing it.")
             clear_quota_exceeded_state()
             return False
 
 
 def get_current_ytdl_ip():
-    for i in range(0, 100):
-        try:
-            if config["youtube-dl"]["proxy"] != "":
-                proxies = {"http": config["youtube-dl"]["proxy"], "https": config["youtube-dl"]["proxy"]}
-                r = requests.get("https://ipinfo.io", proxies=proxies)
-            else:
-                r = requests.get("https://ipinfo.io")
-            answer = json.loads(str(r.text))
-            current_ytdl_ip = answer["ip"]
-        except ConnectionError:
-            current_ytdl_ip = "0.0.0.0"
-            sleep(10)
-            continue
-        finally:
-            remove_download_lockfile()
-        break
-    return current_ytdl_ip
+    identity = egress_identity.get(config["youtube-dl"]["proxy"])
+    if identity is None:
+        return "0.0.0.0"
+    return identity["ip"]
 
 
 def log_statistic(statistic_type, statistic_value):
-    statistic = Statistic()
-    statistic.statistic_type = statistic_type
-    statistic.statistic_value = statistic_value
-    statistic.statistic_date = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
-    session.add(statistic)
-    session.commit()
+    telemetry.log_statistic(statistic_type, statistic_value)
 
 
 def get_playlist_ids_from_google(local_channel_id):
@@ -379,11 +388,11 @@ def get_playlist_ids_from_google(local_channel_id):
     if check_quota_exceeded_state():
         logger.error("Cannot proceed with getting data from youtube API. Quota exceeded.")
         return None
-    youtube = googleapiclient.discovery.build(api_service_name, api_version, credentials=get_google_api_credentials())
+    youtube = get_youtube_api_client()
     logger.debug("Excuting youtube API call for getting playlists")
     request = youtube.channels().list(part="contentDetails", id=local_channel_id)
     try:
-        response = request.execute()
+        response = execute_api_request(request)
         add_quota(3)
     except googleapiclient.errors.HttpError as error:
         if "The request cannot be completed because you have exceeded your" in str(error):
@@ -397,11 +406,11 @@ def get_playlist_name_from_google(local_playlist_id):
     if check_quota_exceeded_state():
         logger.error("Cannot proceed with getting data from youtube API. Quota exceeded.")
         return None
-    youtube = googleapiclient.discovery.build(api_service_name, api_version, credentials=get_google_api_credentials())
+    youtube = get_youtube_api_client()
     logger.debug("Excuting youtube API call for getting playlists")
     request = youtube.playlists().list(part="snippet", id=local_playlist_id)
     try:
-        response = request.execute()
+        response = execute_api_request(request)
         add_quota(3)
     except googleapiclient.errors.HttpError as error:
         if "The request cannot be completed because you have exceeded your" in str(error):
@@ -419,30 +428,53 @@ def is_headless_machine():
             return False
 
 
+def google_api_credentials_expire_soon(creds):
+    if creds.expiry is None:
+        return False
+    return creds.expiry - datetime.utcnow() < timedelta(minutes=5)
+
+
 def get_google_api_credentials():
-    creds = None
-    # The file token.pickle stores the user's access and refresh tokens, and is
-    # created automatically when the authorization flow completes for the first
-    # time.
-    if os.path.exists('token.pickle'):
-        with open('token.pickle', 'rb') as token:
-            creds = pickle.load(token)
-    # If there are no (valid) credentials available, let the user log in.
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
-        else:
-            flow = InstalledAppFlow.from_client_secrets_file(client_secrets_file, SCOPES)
-            if is_headless_machine():
-                creds = flow.run_console(authorization_prompt_message='Please visit this URL to authorize this application: {url}', authorization_code_message='Enter the authorization code: ')
+    global google_api_credentials
+    with google_api_credentials_lock:
+        creds = google_api_credentials
+        # The file token.pickle stores the user's access and refresh tokens, and is
+        # created automatically when the authorization flow completes for the first
+        # time.
+        if creds is None and os.path.exists('token.pickle'):
+            with open('token.pickle', 'rb') as token:
+                creds = pickle.load(token)
+        # If there are no (valid) credentials available, let the user log in.
+        # Credentials which are about to expire are refreshed before they are used by any API client.
+        if not creds or not creds.valid or (creds.refresh_token and google_api_credentials_expire_soon(creds)):
+            if creds and creds.refresh_token:
+                logger.debug("Refreshing google API credentials")
+                creds.refresh(Request())
             else:
-                creds = flow.run_local_server(port=0)
-        # Save the credentials for the next run
-        with open('token.pickle', 'wb') as token:
-            pickle.dump(creds, token)
+                flow = InstalledAppFlow.from_client_secrets_file(client_secrets_file, SCOPES)
+                if is_headless_machine():
+                    creds = flow.run_console(authorization_prompt_message='Please visit this URL to authorize this application: {url}', authorization_code_message='Enter the authorization code: ')
+                else:
+                    creds = flow.run_local_server(port=0)
+            # Save the credentials for the next run
+            with open('token.pickle', 'wb') as token:
+                pickle.dump(creds, token)
+        google_api_credentials = creds
     return creds
 
 
+def get_youtube_api_client():
+    # Refreshes the shared credentials if needed. All clients use the same credentials object, so they see the new token.
+    creds = get_google_api_credentials()
+    youtube = getattr(youtube_api_clients, "youtube", None)
+    if youtube is None:
+        start_time = get_current_timestamp()
+        youtube = googleapiclient.discovery.build(api_service_name, api_version, credentials=creds)
+        youtube_api_clients.youtube = youtube
+        logger.debug("Built youtube API client in " + str(round(get_current_timestamp() - start_time, 3)) + " seconds.")
+    return youtube
+
+
 def get_channel_playlists(local_channel_id, monitored=1):
     global playlist_id
     logger.debug("Getting playlist IDs")
@@ -475,11 +507,11 @@ def get_channel_name_and_country_from_google(local_channel_id):
     if check_quota_exceeded_state():
         logger.error("Cannot proceed with getting data from youtube API. Quota exceeded.")
         return None
-    youtube = googleapiclient.discovery.build(api_service_name, api_version, credentials=get_google_api_credentials())
+    youtube = get_youtube_api_client()
     logger.debug("Excuting youtube API call for getting channel name and country")
     request = youtube.channels().list(part="brandingSettings", id=local_channel_id)
     try:
-        response = request.execute()
+        response = execute_api_request(request)
         add_quota(3)
     except googleapiclient.errors.HttpError as error:
         if "The request cannot be completed because you have exceeded your" in str(error):
@@ -504,11 +536,11 @@ def get_channel_id_from_google(local_username):
         logger.error("Cannot proceed with getting data from youtube API. Quota exceeded.")
         return None
     global channel_id
-    youtube = googleapiclient.discovery.build(api_service_name, api_version, credentials=get_google_api_credentials())
+    youtube = get_youtube_api_client()
     logger.debug("Excuting youtube API call for getting channel id by username")
     request = youtube.channels().list(part="id", forUsername=local_username)
     try:
-        response = request.execute()
+        response = execute_api_request(request)
         add_quota(1)
     except googleapiclient.errors.HttpError as error:
         if "The request cannot be completed because you have exceeded your" in str(error):
@@ -600,11 +632,11 @@ def get_video_infos_for_one_video(video_id):
     if check_quota_exceeded_state():
         logger.error("Cannot proceed with getting data from youtube API. Quota exceeded.")
         return None
-    youtube = googleapiclient.discovery.build(api_service_name, api_version, credentials=get_google_api_credentials())
+    youtube = get_youtube_api_client()
     logger.debug("Excuting youtube API call for getting channel id by video_id")
     request = youtube.videos().list(part="snippet", id=video_id)
     try:
-        response = request.execute()
+        response = execute_api_request(request)
         add_quota(3)
     except googleapiclient.errors.HttpError as error:
         if "The request cannot be completed because you have exceeded your" in str(error):
@@ -618,11 +650,11 @@ def get_geoblock_list_for_one_video(video_id):
     if check_quota_exceeded_state():
         logger.error("Cannot proceed with getting data from youtube API. Quota exceeded.")
         return None
-    youtube = googleapiclient.discovery.build(api_service_name, api_version, credentials=get_google_api_credentials())
+    youtube = get_youtube_api_client()
     logger.debug("Excuting youtube API call for getting channel id by video_id")
     request = youtube.videos().list(part="contentDetails", id=video_id)
     try:
-        response = request.execute()
+        response = execute_api_request(request)
         add_quota(3)
     except googleapiclient.errors.HttpError as error:
         if "The request cannot be completed because you have exceeded your" in str(error):
@@ -691,8 +723,12 @@ def add_video(video_id, downloaded="", resolution="", size="", duration="", loca
         video.online = video_status[local_video_status]
     video.download_required = 1
     video.upload_date = upload_date
+    video.discovered = datetime.utcnow().replace(microsecond=0)
     session.add(video)
     session.commit()
+    rollups.mark_videos([video.video_id])
+    if isinstance(video.downloaded, datetime):
+        rollups.mark_dates([video.downloaded.date()])
     logger.info(f'Added video {video.video_id} - {video.title} to database.')
 
 
@@ -718,81 +754,244 @@ def get_playlists():
         get_video_infos()
 
 
-def get_videos_from_playlist_from_google(local_playlist_id, next_page_token):
-    # Check for exceeded google quota
-    if check_quota_exceeded_state():
-        logger.error("Cannot proceed with getting data from youtube API. Quota exceeded.")
-        return None
-    youtube = googleapiclient.discovery.build(api_service_name, api_version, credentials=get_google_api_credentials())
-    logger.debug("Excuting youtube API call for getting videos")
-    if next_page_token is None:
-        request = youtube.playlistItems().list(part="snippet,contentDetails", maxResults=50, playlistId=local_playlist_id)
-    else:
-        request = youtube.playlistItems().list(part="snippet,contentDetails", maxResults=50, playlistId=local_playlist_id, pageToken=next_page_token)
-    response = ""
+def get_api_executor():
+    global api_executor
+    if api_executor is None:
+        api_executor = ThreadPoolExecutor(max_workers=api_requests_in_flight)
+    return api_executor
+
+
+def execute_api_request(request):
+    start_time = get_current_timestamp()
     try:
         response = request.execute()
-        add_quota(5)
     except googleapiclient.errors.HttpError as error:
-        if "The request cannot be completed because you have exceeded your" in str(error):
-            set_quota_exceeded_state()
-        return None
+        metrics.api_requests.inc(result="quota_exceeded" if "The request cannot be completed because you have exceeded your" in str(error) else "error")
+        raise
+    finally:
+        metrics.api_request_duration.observe(get_current_timestamp() - start_time)
+    metrics.api_requests.inc(result="ok")
     return response
 
 
-def get_changed_playlists(playlists):
-    i = 0
-    j = 0
-    google_api_id_limit = 50
-    playlist_ids_to_check = ""
-    changed_playlists = []
-    while i < len(playlists):
-        if j != 0:
-            playlist_ids_to_check = playlist_ids_to_check + ","
-        playlist_ids_to_check = str(playlist_ids_to_check + playlists[i].playlist_id)
-        logger.debug("Found playlist ID " + str(playlists[i].playlist_id) + " in playlists.")
-        i += 1
-        j += 1
-        if j == google_api_id_limit or i == len(playlists):
-            j = 0
-            youtube = googleapiclient.discovery.build(api_service_name, api_version, credentials=get_google_api_credentials())
-            request = youtube.playlists().list(part="contentDetails", id=playlist_ids_to_check)
+def execute_youtube_api_request(build_request):
+    # Runs in an API thread. The request is built with the client of that thread.
+    return execute_api_request(build_request(get_youtube_api_client()))
+
+
+def run_async(coroutine):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+def build_playlist_items_request(local_playlist_id, next_page_token, youtube):
+    if next_page_token is None:
+        return youtube.playlistItems().list(part="snippet,contentDetails", maxResults=50, playlistId=local_playlist_id)
+    return youtube.playlistItems().list(part="snippet,contentDetails", maxResults=50, playlistId=local_playlist_id, pageToken=next_page_token)
+
+
+async def get_videos_from_playlist_from_google(playlist, semaphore):
+    # Pages of one playlist are fetched one after another, but many playlists are paged at the same time.
+    # Only the API request itself runs in a thread, quota and database handling stay in the event loop thread.
+    loop = asyncio.get_event_loop()
+    start_time = get_current_timestamp()
+    results = []
+    next_page_token = None
+    while True:
+        # Check for exceeded google quota
+        if check_quota_exceeded_state():
+            logger.error("Cannot proceed with getting data from youtube API. Quota exceeded.")
+            return playlist, None, start_time
+        logger.debug("Excuting youtube API call for getting videos of playlist " + str(playlist.playlist_id))
+        async with semaphore:
+            response = await loop.run_in_executor(get_api_executor(), execute_youtube_api_request, partial(build_playlist_items_request, playlist.playlist_id, next_page_token))
+        add_quota(5)
+        results.append(response)
+        if "nextPageToken" not in response:
+            return playlist, results, start_time
+        next_page_token = str(response["nextPageToken"])
+        logger.debug("Next page token: " + next_page_token)
+
+
+async def get_videos_from_playlists_from_google(playlists):
+    semaphore = asyncio.Semaphore(api_requests_in_flight)
+    channel_names = dict(session.query(Channel.id, Channel.channel_name))
+    tasks = [asyncio.ensure_future(get_videos_from_playlist_from_google(playlist, semaphore)) for playlist in playlists]
+    try:
+        for task in asyncio.as_completed(tasks):
             try:
-                response = request.execute()
-                add_quota(3)
+                playlist, results, start_time = await task
             except googleapiclient.errors.HttpError as error:
                 if "The request cannot be completed because you have exceeded your" in str(error):
                     set_quota_exceeded_state()
+                    logger.error("Got no answer from google. I will skip this.")
+                    return None
+                logger.error("A playlist is not available: " + str(error))
+                continue
+            if results is None:
+                logger.error("Got no answer from google. I will skip this.")
                 return None
-            logger.debug("Calling youtube API for playlist etags")
-            logger.debug("Got " + str(len(response["items"])) + " entries back")
-            logger.debug(str(response))
-            for entry in response["items"]:
-                plid = entry["id"]
-                etag = entry["etag"]
-                logger.debug("etag from google for playlist " + str(plid) + " is: " + str(etag))
-
-                playlist = session.query(Playlist).filter(Playlist.playlist_id == plid).scalar()
-                channel_name = session.query(Channel.channel_name).filter(Channel.id == playlist.channel_id).scalar()
-                if force_refresh:
-                    logger.info("--force_refresh is set. Deleting etag on playlist " + str(playlist.playlist_name) + " of channel " + str(channel_name))
-                    playlist.etag = None
-                else:
-                    logger.debug("etag in database for playlist " + str(plid) + " is: " + str(etag))
-                if playlist.etag != etag:
-                    playlist.etag = etag
-                    logger.debug("Updated etag of playlist " + str(playlist.playlist_id) + " to " + str(etag))
-                    changed_playlists.append(playlist)
-                    session.add(playlist)
-                else:
-                    logger.info("playlist " + str(playlist.playlist_name) + " of channel " + str(channel_name) + " has not changed since last check.")
-            playlist_ids_to_check = ""
+            channel_name = str(channel_names.get(playlist.channel_id))
+            logger.info("Got all video metadata for playlist " + playlist.playlist_name + " for channel " + channel_name)
+            logger.debug("Videos in Playlist: " + str(results[0]["pageInfo"]["totalResults"]))
+            store_videos_from_playlist(playlist, results)
+            end_time = get_current_timestamp()
+            log_operation(end_time - start_time, "get_video_infos", "Got video infos for playlist " + playlist.playlist_name + " of channel " + channel_name)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def execute_in_id_batches_async(ids, build_request, quota_cost, apply_response):
+    semaphore = asyncio.Semaphore(api_requests_in_flight)
+    loop = asyncio.get_event_loop()
+
+    async def fetch_batch(batch):
+        # Check for exceeded google quota
+        if check_quota_exceeded_state():
+            return batch, None
+        async with semaphore:
+            response = await loop.run_in_executor(get_api_executor(), execute_youtube_api_request, partial(build_request, ",".join(batch)))
+        add_quota(quota_cost)
+        return batch, response
+
+    tasks = [asyncio.ensure_future(fetch_batch(ids[i:i + google_api_id_limit])) for i in range(0, len(ids), google_api_id_limit)]
+    try:
+        for task in asyncio.as_completed(tasks):
+            try:
+                batch, response = await task
+            except googleapiclient.errors.HttpError as error:
+                if "The request cannot be completed because you have exceeded your" in str(error):
+                    set_quota_exceeded_state()
+                    logger.error("Cannot proceed with getting data from youtube API. Quota exceeded.")
+                    return False
+                logger.error("Youtube API request failed: " + str(error))
+                continue
+            if response is None:
+                logger.error("Cannot proceed with getting data from youtube API. Quota exceeded.")
+                return False
+            apply_response(batch, response)
+        return True
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def execute_in_id_batches(ids, build_request, quota_cost, apply_response):
+    # Splits the IDs into batches of 50, which is the most the youtube API accepts in one request.
+    # The requests run concurrently, every answer is applied in this thread with apply_response(batch, response).
+    ids = list(ids)
+    if len(ids) == 0:
+        return True
+    if check_quota_exceeded_state():
+        logger.error("Cannot proceed with getting data from youtube API. Quota exceeded.")
+        return False
+    get_google_api_credentials()
+    return run_async(execute_in_id_batches_async(ids, build_request, quota_cost, apply_response))
+
+
+def get_changed_playlists(playlists):
+    changed_playlists = []
+    playlists_by_id = {playlist.playlist_id: playlist for playlist in playlists}
+    channel_names = dict(session.query(Channel.id, Channel.channel_name))
+
+    def apply_playlist_etags(batch, response):
+        logger.debug("Calling youtube API for playlist etags")
+        logger.debug("Got " + str(len(response["items"])) + " entries back")
+        logger.debug(str(response))
+        for entry in response["items"]:
+            plid = entry["id"]
+            etag = entry["etag"]
+            logger.debug("etag from google for playlist " + str(plid) + " is: " + str(etag))
+            playlist = playlists_by_id[plid]
+            channel_name = channel_names.get(playlist.channel_id)
+            if force_refresh:
+                logger.info("--force_refresh is set. Deleting etag on playlist " + str(playlist.playlist_name) + " of channel " + str(channel_name))
+                playlist.etag = None
+            else:
+                logger.debug("etag in database for playlist " + str(plid) + " is: " + str(playlist.etag))
+            if playlist.etag != etag:
+                playlist.etag = etag
+                logger.debug("Updated etag of playlist " + str(playlist.playlist_id) + " to " + str(etag))
+                changed_playlists.append(playlist)
+                session.add(playlist)
+            else:
+                logger.info("playlist " + str(playlist.playlist_name) + " of channel " + str(channel_name) + " has not changed since last check.")
+
+    if not execute_in_id_batches(playlists_by_id, lambda ids, youtube: youtube.playlists().list(part="contentDetails", id=ids), 3, apply_playlist_etags):
+        session.rollback()
+        return None
     session.commit()
     num_changed_playlists = len(changed_playlists)
     logger.info(f'{num_changed_playlists} playlists changed.')
     return changed_playlists
 
 
+def get_used_quota_last_24_hours():
+    since = datetime.utcnow() - timedelta(days=1)
+    used_quota = session.query(Statistic.statistic_value).filter(Statistic.statistic_type == "used_quota").filter(Statistic.statistic_date > since)
+    return sum(int(value) for (value,) in used_quota) + used_quota_this_run
+
+
+def plan_playlist_sync(playlists):
+    # Decide which playlists are refreshed in this run, based on the quota left and how often a playlist gets new uploads.
+    # Playlists with many uploads are due more often. Dormant playlists are due once in max_sync_interval_hours
+    # and only cost an etag check, as long as they did not change.
+    daily_quota_budget = int(config["base"].get("daily_quota_budget", 10000))
+    runs_per_day = max(1, int(config["base"].get("runs_per_day", 24)))
+    min_sync_interval_hours = float(config["base"].get("min_sync_interval_hours", 1))
+    max_sync_interval_hours = float(config["base"].get("max_sync_interval_hours", 24))
+    if daily_quota_budget <= 0 or len(playlists) == 0:
+        return playlists
+    remaining_quota = daily_quota_budget - get_used_quota_last_24_hours()
+    run_quota_budget = min(remaining_quota, daily_quota_budget / runs_per_day)
+    now = datetime.utcnow()
+    upload_history_days = 30
+    uploads_since = now - timedelta(days=upload_history_days)
+    recent_uploads = dict(session.query(Video.playlist, func.count(Video.id)).filter(Video.upload_date > uploads_since).group_by(Video.playlist))
+    videos_in_playlist = dict(session.query(Video.playlist, func.count(Video.id)).group_by(Video.playlist))
+    due_playlists = []
+    for playlist in playlists:
+        uploads_per_day = recent_uploads.get(playlist.id, 0) / upload_history_days
+        sync_interval_hours = max_sync_interval_hours
+        if uploads_per_day > 0:
+            sync_interval_hours = min(max(24 / uploads_per_day, min_sync_interval_hours), max_sync_interval_hours)
+        if playlist.last_synced is None:
+            hours_since_sync = None
+            overdue = float("inf")
+        else:
+            hours_since_sync = (now - playlist.last_synced).total_seconds() / 3600
+            overdue = hours_since_sync / sync_interval_hours
+        if overdue < 1:
+            continue
+        # An etag check costs 3 quota for 50 playlists. Paging is only needed, if the playlist changed.
+        # A playlist which was never synced has to be paged. If it got an etag before last_synced existed, the etag check tells whether it changed.
+        pages = max(1, -(-videos_in_playlist.get(playlist.id, 0) // 50))
+        if hours_since_sync is None:
+            change_probability = 1 if playlist.etag is None else 0
+        else:
+            change_probability = min(1, uploads_per_day * hours_since_sync / 24)
+        estimated_quota = 3 / 50 + change_probability * pages * 5
+        due_playlists.append((overdue, uploads_per_day, estimated_quota, playlist))
+    due_playlists.sort(key=lambda due_playlist: (due_playlist[0], due_playlist[1]), reverse=True)
+    planned_playlists = []
+    planned_quota = 0
+    for overdue, uploads_per_day, estimated_quota, playlist in due_playlists:
+        # The most overdue playlist is always synced, even if it alone needs more than a run's share of the quota.
+        # Otherwise a big playlist would be deferred forever.
+        if planned_quota + estimated_quota > run_quota_budget and not (len(planned_playlists) == 0 and remaining_quota > 0):
+            continue
+        planned_quota += estimated_quota
+        planned_playlists.append(playlist)
+    logger.info("Planned " + str(len(planned_playlists)) + " of " + str(len(playlists)) + " playlists for this run with an estimated quota of " + str(round(planned_quota)) + " of " + str(round(run_quota_budget)) + ". " + str(len(due_playlists) - len(planned_playlists)) + " due playlists are deferred.")
+    return planned_playlists
+
+
 def get_video_infos():
     playlists = session.query(Playlist).filter(Playlist.monitored == 1)
     if channel_id is not None:
@@ -800,127 +999,283 @@ def get_video_infos():
         playlists = playlists.filter(Playlist.channel_id == internal_channel_id)
     if playlist_id is not None:
         playlists = playlists.filter(Playlist.playlist_id == playlist_id)
-    changed_playlists = get_changed_playlists(playlists.all())
-
-    for playlist in changed_playlists:
-        parsed_from_api = 0
-        start_time = get_current_timestamp()
-        videos = []
-        videos_to_check_against = []
-        channel_name = session.query(Channel.channel_name).filter(Channel.id == playlist.channel_id).scalar()
-        logger.info("Getting all video metadata for playlist " + playlist.playlist_name + " for channel " + str(channel_name))
-        results = []
-        try:
-            result = get_videos_from_playlist_from_google(playlist.playlist_id, None)
-            if result is None:
-                logger.error("Got no answer from google. I will skip this.")
-                return None
-        except googleapiclient.errors.HttpError:
-            logger.error("Playlist " + playlist.playlist_name + " in Channel " + channel_name + " is not available")
+    playlists = playlists.all()
+    # The planner is skipped, if the user explicitly asks for playlists
+    if not force_refresh and playlist_id is None:
+        playlists = plan_playlist_sync(playlists)
+    changed_playlists = get_changed_playlists(playlists)
+    if changed_playlists is None:
+        return None
+    # Unchanged playlists are synced with the etag check. Changed playlists only after their videos were fetched.
+    changed_playlist_ids = set(playlist.id for playlist in changed_playlists)
+    unchanged_playlist_ids = [playlist.id for playlist in playlists if playlist.id not in changed_playlist_ids]
+    for i in range(0, len(unchanged_playlist_ids), database_id_chunk_size):
+        session.query(Playlist).filter(Playlist.id.in_(unchanged_playlist_ids[i:i + database_id_chunk_size])).update({Playlist.last_synced: datetime.utcnow()}, synchronize_session=False)
+    commit_with_retry()
+    get_google_api_credentials()
+    run_async(get_videos_from_playlists_from_google(changed_playlists))
+
+
+def store_videos_from_playlist(playlist, results):
+    # A video can be listed more than once in a playlist, so collect them by video ID
+    parsed_from_api = 0
+    api_videos = OrderedDict()
+    for entry in results:
+        for video_raw in entry["items"]:
+            parsed_from_api = parsed_from_api + 1
+            api_videos[video_raw["contentDetails"]["videoId"]] = video_raw
+    logger.debug("Parsed " + str(parsed_from_api) + " videos from API.")
+    # Committed together with the videos
+    playlist.last_synced = datetime.utcnow()
+    session.add(playlist)
+    new_videos, changed_videos = sync_playlist_videos(playlist, api_videos)
+    logger.debug("Inserted " + str(new_videos) + " and updated " + str(changed_videos) + " videos.")
+    check_videos_online_state(list(api_videos), playlist.id)
+
+
+def get_existing_video_states(video_ids):
+    existing_videos = {}
+    for i in range(0, len(video_ids), database_id_chunk_size):
+        rows = session.query(Video.id, Video.video_id, Video.online, Video.upload_date).filter(Video.video_id.in_(video_ids[i:i + database_id_chunk_size]))
+        for row in rows:
+            existing_videos[row.video_id] = row
+    return existing_videos
+
+
+def sync_playlist_videos(playlist, api_videos):
+    # Load all already known videos of the API answer at once and write the differences with bulk statements in one transaction
+    existing_videos = get_existing_video_states(list(api_videos))
+    discovered = datetime.utcnow().replace(microsecond=0)
+    new_videos = []
+    changed_videos = []
+    for api_video_id, video_raw in api_videos.items():
+        upload_date = datetime.strptime(str(video_raw["snippet"]["publishedAt"])[0:19], '%Y-%m-%dT%H:%M:%S')
+        existing_video = existing_videos.get(api_video_id)
+        if existing_video is None:
+            new_videos.append({"video_id": api_video_id, "title": video_raw["snippet"]["title"], "description": video_raw["snippet"]["description"], "upload_date": upload_date,
+                               "playlist": playlist.id, "online": video_status["online"], "download_required": 1, "discovered": discovered})
+            logger.info("Added new video " + api_video_id + " to DB.")
             continue
-        results.append(result)
-        videos_in_playlist = result["pageInfo"]["totalResults"]
-        logger.debug("Videos in Playlist: " + str(videos_in_playlist))
-        next_page_token = None
-        try:
-            next_page_token = str(result["nextPageToken"])
-            logger.debug("Next page token: " + next_page_token)
-        except KeyError:
-            logger.debug("Playlist " + playlist.playlist_name + " in Channel " + channel_name + " has only one page.")
-        while next_page_token is not None:
-            result = get_videos_from_playlist_from_google(playlist.playlist_id, next_page_token)
-            if result is None:
-                logger.error("Got no answer from google. I will skip this.")
-                return None
-            results.append(result)
-            try:
-                next_page_token = str(result["nextPageToken"])
-            except:
-                break
-            logger.debug("Next page token: " + next_page_token)
-        for entry in results:
-            for video_raw in entry["items"]:
-                # logger.debug(video_raw["contentDetails"]["videoId"] + " " + " - " + video_raw["snippet"]["title"])
-                # logger.debug("Description: " + video_raw["snippet"]["description"])
-                parsed_from_api = parsed_from_api + 1
-                video = Video()
-                video.video_id = video_raw["contentDetails"]["videoId"]
-                video.title = video_raw["snippet"]["title"]
-                video.description = video_raw["snippet"]["description"]
-                video.upload_date = video_raw["snippet"]["publishedAt"]
-                video.upload_date = datetime.strptime(str(video.upload_date)[0:19], '%Y-%m-%dT%H:%M:%S')
-                video.playlist = playlist.id
-                video.online = video_status["online"]
-                video.download_required = 1
-                if session.query(Video).filter(Video.video_id == video.video_id).scalar() is None:
-                    videos.append(video)
-                    videos_to_check_against.append(video)
-                    logger.info("Added new video " + video.video_id + " to DB.")
-                else:
-                    videos_to_check_against.append(video)
-                    # If we get a video ID back from youtube, which is already in database,
-                    # we will check if it was set to offline in DB.
-                    # If it's offline in DB, we will it set online again
-                    # It happens, that some video IDs are missing in youtube channels details, so we have false flag offline videos in DB
-                    video = session.query(Video).filter(Video.video_id == video.video_id).scalar()
-                    if video.online == video_status["offline"]:
-                        logger.info("Marking video " + str(video.video_id) + " as online again.")
-                        video.online = video_status["online"]
-                        videos.append(video)
-                    if video.upload_date is None:
-                        logger.info("Adding upload date to video")
-                        video.upload_date = datetime.strptime(str(video_raw["snippet"]["publishedAt"])[0:19], '%Y-%m-%dT%H:%M:%S')
-                        videos.append(video)
-        logger.debug("Parsed " + str(parsed_from_api) + " videos from API.")
-        logger.debug(str(len(videos)))
-        session.add_all(videos)
-        session.commit()
-        end_time = get_current_timestamp()
-        log_operation(end_time - start_time, "get_video_infos", "Got video infos for playlist " + playlist.playlist_name + " of channel " + channel_name)
-        check_videos_online_state(videos_to_check_against, playlist.id)
+        changed_video = {}
+        # If we get a video ID back from youtube, which is already in database,
+        # we will check if it was set to offline in DB.
+        # If it's offline in DB, we will it set online again
+        # It happens, that some video IDs are missing in youtube channels details, so we have false flag offline videos in DB
+        if existing_video.online == video_status["offline"]:
+            logger.info("Marking video " + str(api_video_id) + " as online again.")
+            changed_video["online"] = video_status["online"]
+        if existing_video.upload_date is None:
+            logger.info("Adding upload date to video")
+            changed_video["upload_date"] = upload_date
+        if len(changed_video) > 0:
+            changed_video["id"] = existing_video.id
+            changed_videos.append(changed_video)
+    if len(new_videos) > 0:
+        session.bulk_insert_mappings(Video, new_videos)
+    if len(changed_videos) > 0:
+        session.bulk_update_mappings(Video, changed_videos)
+    commit_with_retry()
+    if len(new_videos) + len(changed_videos) > 0:
+        rollups.mark_channels([playlist.channel_id])
+    return len(new_videos), len(changed_videos)
 
 
 def check_videos_online_state(videos_to_check_against, local_playlist_id):
     start_time = get_current_timestamp()
     logger.debug("Getting all videos for playlist_id " + str(local_playlist_id) + " from database for video offline checking.")
-    playlist_videos_in_db = session.query(Video).filter(Video.playlist == local_playlist_id).filter(Video.online == video_status["online"]).filter(Video.downloaded != None).all()
+    playlist_videos_in_db = session.query(Video.id, Video.video_id).filter(Video.playlist == local_playlist_id).filter(Video.online == video_status["online"]).filter(Video.downloaded != None).all()
     logger.debug(str(len(playlist_videos_in_db)) + " videos are in DB for playlist")
-    videos_to_check_against_ids = []
-    for video in videos_to_check_against:
-        videos_to_check_against_ids.append(video.video_id)
-        logger.debug("Added " + str(video.video_id) + "to check_Against list.")
+    videos_to_check_against_ids = set(videos_to_check_against)
     logger.debug("Will be checked against " + str(len(videos_to_check_against_ids)))
     logger.debug("Calculating the offline video ids")
-    offline_video_ids = []
-    for video in playlist_videos_in_db:
-        if str(video.video_id) not in videos_to_check_against_ids and video.online != video_status["unlisted"]:
-            offline_video_ids.append(str(video.video_id))
-            logger.debug("Adding " + str(video.video_id) + " to offline video list.")
+    offline_videos = [video for video in playlist_videos_in_db if video.video_id not in videos_to_check_against_ids]
+    logger.debug(str(len(offline_videos)) + " Videos are offline now.")
+    offline_video_internal_ids = []
+    for video in offline_videos:
+        logger.info("Video " + str(video.video_id) + " is not on youtube anymore. Setting offline now.")
+        offline_video_internal_ids.append(video.id)
     logger.debug("Updating all video in offline video list to offline state")
-    if len(offline_video_ids) == 0:
-        return None
-    logger.debug(str(len(offline_video_ids)) + " Videos are offline now.")
-    for offline_video_id in offline_video_ids:
-        logger.info("Video " + str(offline_video_id) + " is not on youtube anymore. Setting offline now.")
-        video = session.query(Video).filter(Video.video_id == str(offline_video_id)).scalar()
-        video.online = video_status["offline"]
-        session.add(video)
+    videos_set_offline = 0
+    for i in range(0, len(offline_video_internal_ids), database_id_chunk_size):
+        videos_set_offline += session.query(Video).filter(Video.id.in_(offline_video_internal_ids[i:i + database_id_chunk_size])).filter(Video.online == video_status["online"]).update({Video.online: video_status["offline"]}, synchronize_session=False)
+    commit_with_retry()
+    if videos_set_offline > 0:
+        rollups.mark_playlists([local_playlist_id])
     end_time = get_current_timestamp()
-    log_operation(end_time - start_time, "check_online_state", "Checked online state for all videos of playlist_id " + str(local_playlist_id))
-    session.commit()
+    log_operation(end_time - start_time, "check_online_state", "Checked online state for all videos of playlist_id " + str(local_playlist_id) + ". Set " + str(videos_set_offline) + " videos offline.")
 
 
-def remove_youtube_video_from_archive_file(local_video_id: str):
-    logger.debug("Trying to remove " + local_video_id + " from " + str(config["youtube-dl"]["download-archive"]))
-    with open(config["youtube-dl"]["download-archive"], "r") as f:
-        lines = f.readlines()
-        logger.debug("Read the file " + str(config["youtube-dl"]["download-archive"]))
-    with open(config["youtube-dl"]["download-archive"], "w") as f:
-        for line in lines:
-            if line.strip("\n") != "youtube " + str(local_video_id):
-                f.write(line)
-            else:
-                logger.info("Removed video id " + local_video_id + " from " + str(config["youtube-dl"]["download-archive"]))
+def get_videos_not_downloaded():
+    if playlist_id is None:
+        logger.debug("Playlist ID for downloading is None. Getting all videos.")
+        if retry_403:
+            videos_not_downloaded = session.query(Video).filter(Video.downloaded == None).filter(or_(Video.online == video_status["online"], Video.online == video_status["http_403"], Video.online == video_status["unlisted"])).filter(Video.download_required == 1)
+        else:
+            videos_not_downloaded = session.query(Video).filter(Video.downloaded == None).filter(or_(Video.online == video_status["online"], Video.online == video_status["unlisted"])).filter(Video.download_required == 1)
+    else:
+        logger.debug("Playlist ID for downloading is " + str(playlist_id))
+        playlist_internal_id = session.query(Playlist.id).filter(Playlist.playlist_id == playlist_id).scalar()
+        logger.debug("Got playlist internal ID " + str(playlist_internal_id))
+        if retry_403:
+            videos_not_downloaded = session.query(Video).filter(Video.downloaded == None).filter(Video.playlist == str(playlist_internal_id)).filter(or_(Video.online == video_status["online"], Video.online == video_status["http_403"], Video.online == video_status["hate_speech"], Video.online == video_status["unlisted"])).filter(Video.download_required == 1)
+        else:
+            videos_not_downloaded = session.query(Video).filter(Video.downloaded == None).filter(Video.playlist == playlist_internal_id).filter(or_(Video.online == video_status["online"], Video.online == video_status["hate_speech"], Video.online == video_status["unlisted"])).filter(Video.download_required == 1)
+    return videos_not_downloaded
+
+
+def check_video_download_required(video, playlist, current_country, download_archive):
+    if video.copyright is not None:
+        if current_country + "," in video.copyright:
+            logger.info("This video is geoblocked in the following countries: " + video.copyright + ". Current Country: " + current_country)
+            return False
+    if video.video_id in download_archive:
+        logger.debug("Video " + video.video_id + " found in youtube-dl archive file. Setting impossible download date to import to database.")
+        video.downloaded = datetime(1972, 1, 1, 23, 23, 23)
+        session.add(video)
+        commit_with_retry()
+        rollups.mark_channels([playlist.channel_id])
+        rollups.mark_dates([datetime(1972, 1, 1).date()])
+        return False
+    # If uploaded date is older than playlist download date, skip download and set download required to 0
+    if playlist.download_from_date is not None:
+        playlist_download_date = datetime.strptime(str(playlist.download_from_date), '%Y-%m-%d %H:%M:%S')
+        video_upload_date = datetime.strptime(str(video.upload_date), '%Y-%m-%d %H:%M:%S')
+        if playlist_download_date > video_upload_date:
+            video.download_required = 0
+            session.add(video)
+            commit_with_retry()
+            rollups.mark_channels([playlist.channel_id])
+            return False
+    return True
+
+
+def get_channel_priority(channel, channel_priorities):
+    # Priorities can be configured by channel name or by youtube channel ID
+    return float(channel_priorities.get(channel.channel_name, channel_priorities.get(channel.channel_id, 1.0)))
+
+
+def get_download_queue(playlists, channels, attempted_video_ids):
+    # Snapshot the download queue as internal video IDs. The videos itself are loaded one by one when their download starts.
+    scheduler_settings = config.get("scheduler", {})
+    download_queue = get_scheduler(scheduler_settings)
+    channel_priorities = {local_channel_id: get_channel_priority(channel, scheduler_settings.get("channel_priorities", {})) for local_channel_id, channel in channels.items()}
+    for internal_video_id, local_playlist_id, upload_date, discovered in get_videos_not_downloaded().with_entities(Video.id, Video.playlist, Video.upload_date, Video.discovered).order_by(Video.id):
+        if internal_video_id in attempted_video_ids or local_playlist_id not in playlists:
+            continue
+        local_channel_id = playlists[local_playlist_id].channel_id
+        download_queue.add(internal_video_id, local_channel_id, channel_priorities.get(local_channel_id, 1.0), upload_date, discovered)
+    return download_queue
+
+
+def get_directory_size(path):
+    size = 0
+    for root, dirs, files in os.walk(path):
+        for file in files:
+            try:
+                size += os.path.getsize(os.path.join(root, file))
+            except OSError:
+                logger.error("Could not find size of " + os.path.join(root, file))
+    return size
+
+
+def add_to_tracked_archive_size(uploaded_bytes):
+    tracked_archive_size = runtime_state.get("archive_size")
+    # Until the first rclone size run the archive size is unknown, so there is nothing to add to
+    if tracked_archive_size is None:
+        return
+    runtime_state.set("archive_size", str(int(tracked_archive_size.value) + uploaded_bytes))
+
+
+def get_uploads_dir():
+    return os.path.join(config["base"]["download_dir"], "upload")
+
+
+def get_failed_uploads_dir():
+    return os.path.join(config["base"]["download_dir"], "failed_uploads")
+
+
+def get_pending_uploads():
+    # Videos are marked as downloaded before their upload. Uploads which were still queued when an earlier run was stopped, and uploads which failed, are done again.
+    pending_uploads = []
+    for uploads_dir in [get_uploads_dir(), get_failed_uploads_dir()]:
+        if not os.path.isdir(uploads_dir):
+            continue
+        pending_uploads += [(video_id, os.path.join(uploads_dir, video_id)) for video_id in sorted(os.listdir(uploads_dir)) if os.path.isdir(os.path.join(uploads_dir, video_id))]
+    return pending_uploads
+
+
+def upload_worker(upload_queue, upload_results):
+    # Runs in an upload thread. Every queued directory contains the files of exactly one video.
+    while True:
+        upload = upload_queue.get()
+        if upload is None:
+            upload_queue.task_done()
+            return
+        upload_video_id, upload_dir, upload_date = upload
+        # Measured before the upload, since rclone move removes the files. This includes all sidecar files of the video.
+        uploaded_bytes = get_directory_size(upload_dir)
+        upload_duration, upload_succeeded = rclone_upload(upload_dir)
+        if upload_succeeded and config["rclone"]["move_or_copy"] != "copy":
+            shutil.rmtree(upload_dir, ignore_errors=True)
+        if not upload_succeeded:
+            # The video is already marked as downloaded, so its files are uploaded again at the start of the next download run
+            failed_upload_dir = os.path.join(get_failed_uploads_dir(), upload_video_id)
+            if upload_dir != failed_upload_dir:
+                os.makedirs(get_failed_uploads_dir(), exist_ok=True)
+                shutil.rmtree(failed_upload_dir, ignore_errors=True)
+                os.replace(upload_dir, failed_upload_dir)
+        upload_results.put({"video_id": upload_video_id, "upload_duration": upload_duration, "upload_succeeded": upload_succeeded, "uploaded_bytes": uploaded_bytes, "upload_date": upload_date, "uploaded": datetime.utcnow()})
+        upload_queue.task_done()
+
+
+def log_upload_results(upload_results):
+    while True:
+        try:
+            upload_result = upload_results.get_nowait()
+        except queue.Empty:
+            return
+        if upload_result["upload_succeeded"]:
+            logger.info("Video " + str(upload_result["video_id"]) + " is uploaded.")
+            add_to_tracked_archive_size(upload_result["uploaded_bytes"])
+            if upload_result["upload_date"] is not None:
+                # Time from the upload on youtube until the video is in the archive
+                log_statistic("time_to_archive", str(int((upload_result["uploaded"] - upload_result["upload_date"]).total_seconds())))
+        else:
+            logger.error("rclone upload of video " + str(upload_result["video_id"]) + " failed. The files are kept in " + get_failed_uploads_dir() + " and uploaded again in the next download run.")
+        log_operation(upload_result["upload_duration"], "rclone_upload", "Uploaded files of video with ID " + str(upload_result["video_id"]) + " to rclone remote")
+
+
+def download_video_worker(video_id, channel_name, worker_download_dir, upload_queue, sleep_after_download, upload_date=None):
+    # Runs in a worker thread. It must not touch the database session, all results are written by download_videos().
+    result = {"video_file": None, "file_found": False, "runtime": None, "resolution": None, "size": None, "video_format": None, "video_codec": None, "audio_codec": None, "download_duration": 0}
+    start_time = get_current_timestamp()
+    # Files of an earlier aborted or incomplete download in this slot must not end up in the upload of this video
+    shutil.rmtree(worker_download_dir, ignore_errors=True)
+    video_file = download_video(video_id, channel_name, worker_download_dir)
+    result["video_file"] = video_file
+    if video_file in download_outcomes or not os.path.isfile(video_file):
+        result["download_duration"] = get_current_timestamp() - start_time
+        return result
+    result["file_found"] = True
+    result.update(get_video_metadata(video_id, video_file))
+    logger.debug("Video runtime was set to " + str(result["runtime"]) + " seconds")
+    logger.debug("Video resolution was set to " + str(result["resolution"]))
+    logger.debug("Video size was set to " + str(result["size"]) + " bytes")
+    if result["size"] is not None:
+        metrics.downloaded_bytes.inc(result["size"])
+    result["download_duration"] = get_current_timestamp() - start_time
+    if result["runtime"] is None and result["resolution"] is None:
+        return result
+    # Hand the finished files over to the upload threads, so this worker can start the next download right away
+    upload_dir = os.path.join(get_uploads_dir(), video_id)
+    shutil.rmtree(upload_dir, ignore_errors=True)
+    os.makedirs(os.path.dirname(upload_dir), exist_ok=True)
+    os.rename(worker_download_dir, upload_dir)
+    # upload_date is only set for fast lane videos, which get their time_to_archive logged after the upload
+    upload_queue.put((video_id, upload_dir, upload_date))
+    if sleep_after_download:
+        sleep(randint(int(config["youtube-dl"]["min_sleep_interval"]), int(config["youtube-dl"]["max_sleep_interval"])))
+    return result
 
 
 def download_videos():
@@ -931,165 +1286,228 @@ def download_videos():
     if check_429_lock():
         logger.error("The current used IP is still HTTP 429 blocked. Cannot continue.")
         return None
+    if config.get("scheduler", {}).get("strategy", "weighted") not in schedulers:
+        logger.error("Unknown scheduler strategy " + str(config["scheduler"]["strategy"]) + " in config. Possible values: " + ", ".join(schedulers))
+        return None
     Path(config["base"]["download_lockfile"]).touch()
     if os.path.exists(config["base"]["download_dir"]):
         try:
-            shutil.rmtree(config["base"]["download_dir"])
+            # Everything except the files of unfinished and failed uploads, which are uploaded again in this run
+            for entry in os.listdir(config["base"]["download_dir"]):
+                path = os.path.join(config["base"]["download_dir"], entry)
+                if path in [get_uploads_dir(), get_failed_uploads_dir()]:
+                    continue
+                if os.path.isdir(path):
+                    shutil.rmtree(path)
+                else:
+                    os.remove(path)
         except OSError:
             logger.error('Could not delete download directory. Please make sure it is not in use at the moment.')
             remove_download_lockfile()
     current_country = get_current_country()
     video_file = None
     http_429_counter = 0
-    if playlist_id is None:
-        logger.debug("Playlist ID for downloading is None. Getting all videos.")
-        if retry_403:
-            videos_not_downloaded = session.query(Video).filter(Video.downloaded == None).filter(or_(Video.online == video_status["online"], Video.online == video_status["http_403"], Video.online == video_status["unlisted"])).filter(Video.download_required == 1)
-        else:
-            videos_not_downloaded = session.query(Video).filter(Video.downloaded == None).filter(or_(Video.online == video_status["online"], Video.online == video_status["unlisted"])).filter(Video.download_required == 1)
-    else:
-        logger.debug("Playlist ID for downloading is " + str(playlist_id))
-        playlist_internal_id = session.query(Playlist.id).filter(Playlist.playlist_id == playlist_id).scalar()
-        logger.debug("Got playlist internal ID " + str(playlist_internal_id))
-        if retry_403:
-            videos_not_downloaded = session.query(Video).filter(Video.downloaded == None).filter(Video.playlist == str(playlist_internal_id)).filter(or_(Video.online == video_status["online"], Video.online == video_status["http_403"], Video.online == video_status["hate_speech"], Video.online == video_status["unlisted"])).filter(Video.download_required == 1)
-        else:
-            videos_not_downloaded = session.query(Video).filter(Video.downloaded == None).filter(Video.playlist == playlist_internal_id).filter(or_(Video.online == video_status["online"], Video.online == video_status["hate_speech"], Video.online == video_status["unlisted"])).filter(Video.download_required == 1)
-    logger.info("I have " + str(len(videos_not_downloaded.all())) + " in download queue. Start downloading now.")
-    for video in videos_not_downloaded:
-        set_status("downloading")
-        if video.copyright is None:
-            pass
-        else:
-            if current_country + "," in video.copyright:
-                logger.info("This video is geoblocked in the following countries: " + video.copyright + ". Current Country: " + current_country)
-                continue
-        start_time = get_current_timestamp()
-        if os.path.exists(config["youtube-dl"]["download-archive"]):
-            with open(config["youtube-dl"]["download-archive"]) as download_archive_file:
-                if video.video_id in download_archive_file.read():
-                    logger.debug("Video " + video.video_id + " found in youtube-dl archive file. Setting impossible download date to import to database.")
-                    video.downloaded = "1972-01-01 23:23:23"
+    run_start_time = get_current_timestamp()
+    videos_downloaded_this_run = 0
+    download_archive = DownloadArchive(config["youtube-dl"]["download-archive"])
+    logger.debug("Loaded " + str(len(download_archive)) + " entries from youtube-dl archive file.")
+    # Load playlists and channel names once instead of querying them for every single video
+    playlists = {playlist.id: playlist for playlist in session.query(Playlist)}
+    channels = {channel.id: channel for channel in session.query(Channel)}
+    attempted_video_ids = set()
+    download_queue = get_download_queue(playlists, channels, attempted_video_ids)
+    videos_left = len(download_queue)
+    metrics.download_queue_depth.set(videos_left)
+    log_statistic("download_queue_depth", str(videos_left))
+    logger.info("I have " + str(videos_left) + " in download queue. Start downloading now.")
+    # The queue is only queried again after the snapshot is used up, to pick up videos added during this run
+    refresh_download_queue = videos_left > 0
+    max_workers_per_channel = int(config["youtube-dl"].get("max_workers_per_channel", 2))
+    if workers > 1:
+        logger.info("Downloading with " + str(workers) + " workers and at most " + str(max_workers_per_channel) + " parallel downloads per channel.")
+    # All database writes happen in this thread. Workers only run youtube-dl, ffprobe and rclone.
+    running_downloads = {}
+    running_downloads_per_channel = {}
+    free_worker_slots = list(range(workers))
+    stop_downloading = False
+    restart_proxy_when_idle = False
+    # After a geoblocked video or HTTP 503 no new downloads are started for a minute, while finished ones are still handled
+    dispatch_paused_until = 0
+    upload_queue = queue.Queue()
+    upload_results = queue.Queue()
+    upload_threads = []
+    for i in range(max(1, int(config["rclone"].get("upload_workers", 1)))):
+        upload_thread = threading.Thread(target=upload_worker, args=(upload_queue, upload_results), daemon=True)
+        upload_thread.start()
+        upload_threads.append(upload_thread)
+    for pending_upload in get_pending_uploads():
+        logger.info("Uploading the files of video " + pending_upload[0] + " again, since their upload did not finish in an earlier run.")
+        upload_queue.put(pending_upload + (None,))
+    last_rollup_refresh = get_current_timestamp()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while True:
+            if get_current_timestamp() - last_rollup_refresh > 60:
+                # Keep the dashboards current during long download runs
+                rollups.refresh()
+                last_rollup_refresh = get_current_timestamp()
+            while free_worker_slots and not stop_downloading and not restart_proxy_when_idle and get_current_timestamp() >= dispatch_paused_until:
+                if len(download_queue) == 0 and refresh_download_queue:
+                    playlists = {playlist.id: playlist for playlist in session.query(Playlist)}
+                    channels = {channel.id: channel for channel in session.query(Channel)}
+                    download_queue = get_download_queue(playlists, channels, attempted_video_ids)
+                    videos_left = len(download_queue)
+                    refresh_download_queue = videos_left > 0
+                    if refresh_download_queue:
+                        logger.info("Found " + str(videos_left) + " more videos in download queue.")
+                internal_video_id = download_queue.next_video(running_downloads_per_channel, max_workers_per_channel)
+                if internal_video_id is None:
+                    break
+                videos_left -= 1
+                metrics.download_queue_depth.set(videos_left)
+                attempted_video_ids.add(internal_video_id)
+                video = session.query(Video).get(internal_video_id)
+                if video is None or video.downloaded is not None or video.download_required != 1:
+                    continue
+                set_status("downloading")
+                playlist = playlists[video.playlist]
+                if not check_video_download_required(video, playlist, current_country, download_archive):
+                    continue
+                logger.info("Video " + str(video.video_id) + " - " + video.title + " is not yet downloaded. Downloading now.")
+                channel_name = channels[playlist.channel_id].channel_name
+                logger.debug("Video belongs to channel " + str(channel_name))
+                set_currently_downloading(str(channel_name) + " - " + video.video_id + " - " + video.title)
+                worker_slot = free_worker_slots.pop(0)
+                worker_download_dir = os.path.join(config["base"]["download_dir"], "worker-" + str(worker_slot))
+                fast_lane_upload_date = video.upload_date if download_queue.in_fast_lane(internal_video_id) else None
+                future = executor.submit(download_video_worker, video.video_id, channel_name, worker_download_dir, upload_queue, videos_left > 0, fast_lane_upload_date)
+                running_downloads[future] = (video, playlist.channel_id, worker_slot)
+                running_downloads_per_channel[playlist.channel_id] = running_downloads_per_channel.get(playlist.channel_id, 0) + 1
+            if len(running_downloads) == 0:
+                if restart_proxy_when_idle and not stop_downloading:
+                    # Only restart the proxy after all running downloads are finished, since they are using it too
+                    restart_proxy()
+                    sleep(20)
+                    current_country = get_current_country()
+                    restart_proxy_when_idle = False
+                    continue
+                if get_current_timestamp() < dispatch_paused_until and not stop_downloading:
+                    sleep(max(0, dispatch_paused_until - get_current_timestamp()))
+                    continue
+                break
+            dispatch_timeout = None
+            if get_current_timestamp() < dispatch_paused_until:
+                # Wake up when the pause is over to start downloads on the free worker slots again
+                dispatch_timeout = max(0, dispatch_paused_until - get_current_timestamp())
+            finished_downloads, _ = wait(running_downloads, timeout=dispatch_timeout, return_when=FIRST_COMPLETED)
+            log_upload_results(upload_results)
+            for future in finished_downloads:
+                video, local_channel_id, worker_slot = running_downloads.pop(future)
+                free_worker_slots.append(worker_slot)
+                running_downloads_per_channel[local_channel_id] -= 1
+                rollups.mark_channels([local_channel_id])
+                try:
+                    result = future.result()
+                except Exception as e:
+                    logger.error("Download worker for video " + str(video.video_id) + " failed: " + str(e))
+                    continue
+                video_file = result["video_file"]
+                if video_file == "copyright":
+                    logger.info("This video is geoblocked on current country " + current_country + ". Will get complete geoblock list.")
+                    video_geoblock_list = get_geoblock_list_for_one_video(video.video_id)
+                    geoblock_list = ""
+                    if video_geoblock_list is not None:
+                        for entry in video_geoblock_list:
+                            geoblock_list = geoblock_list + (str(entry) + ",")
+                        logger.debug("Geoblock list for video " + str(video.video_id) + " is " + str(geoblock_list))
+                        video.copyright = geoblock_list
+                        session.add(video)
+                        commit_with_retry()
+                        dispatch_paused_until = get_current_timestamp() + 60
+                    continue
+                if video_file == "forbidden":
+                    continue
+                if video_file == "503":
+                    download_archive.remove(str(video.video_id))
+                    logger.info("Removed video id " + str(video.video_id) + " from " + str(config["youtube-dl"]["download-archive"]))
+                    dispatch_paused_until = get_current_timestamp() + 60
+                    continue
+                if video_file == "429":
+                    set_status("429 paused")
+                    set_http_429_state()
+                    logger.error("Got HTTP 429 from youtube. Try restarting the proxy.")
+                    http_429_counter += 1
+                    if http_429_counter == 10:
+                        remove_download_lockfile()
+                        stop_downloading = True
+                        continue
+                    if config["youtube-dl"]["proxy"] != "":
+                        restart_proxy_when_idle = True
+                    continue
+                if video_file == "video_forbidden":
+                    video.online = video_status["http_403"]
+                    logger.info("Setting video status to forbidden. I you want to retry the download, add --retry-403")
                     session.add(video)
                     commit_with_retry()
                     continue
-        # Get the playlist object of a video. If uploaded date is older than playlist download date, skip download and set download required to 0
-        playlist = session.query(Playlist).filter(Playlist.id == video.playlist).scalar()
-        if playlist.download_from_date is not None:
-            playlist_download_date = datetime.strptime(str(playlist.download_from_date), '%Y-%m-%d %H:%M:%S')
-            video_upload_date = datetime.strptime(str(video.upload_date), '%Y-%m-%d %H:%M:%S')
-            if playlist_download_date > video_upload_date:
-                video.download_required = 0
-                session.add(video)
-                commit_with_retry()
-                continue
-        logger.info("Video " + str(video.video_id) + " - " + video.title + " is not yet downloaded. Downloading now.")
-        local_channel_id = session.query(Playlist.channel_id).filter(Playlist.id == video.playlist).scalar()
-        logger.debug("Video belongs to playlist " + str(local_channel_id))
-        channel_name = session.query(Channel.channel_name).filter(Channel.id == local_channel_id).scalar()
-        logger.debug("Video belongs to channel " + str(channel_name))
-        # Download video and get Dwonload path of mkv file as return variable
-        set_currently_downloading(str(channel_name) + " - " + video.video_id + " - " + video.title)
-        video_file = download_video(video.video_id, channel_name)
-        if video_file == "copyright":
-            logger.info("This video is geoblocked on current country " + current_country + ". Will get complete geoblock list.")
-            video_geoblock_list = get_geoblock_list_for_one_video(video.video_id)
-            geoblock_list = ""
-            if video_geoblock_list is not None:
-                for entry in video_geoblock_list:
-                    geoblock_list = geoblock_list + (str(entry) + ",")
-                logger.debug("Geoblock list for video " + str(video.video_id) + " is " + str(geoblock_list))
-                video.copyright = geoblock_list
+                if video_file == "hate_speech":
+                    video.online = video_status["hate_speech"]
+                    session.add(video)
+                    commit_with_retry()
+                    continue
+                if video_file == "not_downloaded":
+                    video.downloaded = None
+                    session.add(video)
+                    commit_with_retry()
+                    continue
+                if video_file in ["removed_by_uploader", "offline"]:
+                    video.downloaded = None
+                    video.online = video_status["offline"]
+                    session.add(video)
+                    commit_with_retry()
+                    continue
+                # check if video is really there
+                if not result["file_found"]:
+                    logger.error("Could not find the downloaded video file. Maybe there was a problem during download. Will retry in next run.")
+                    continue
+                if result["runtime"] is None and result["resolution"] is None:
+                    logger.warning("The video file is incomplete. Will skip uploading and let the video on not downloaded state.")
+                    continue
+                video.downloaded = datetime.utcnow().replace(microsecond=0)
+                video.runtime = result["runtime"]
+                video.resolution = result["resolution"]
+                video.size = result["size"]
+                video.video_format = result["video_format"]
+                video.video_codec = result["video_codec"]
+                video.audio_codec = result["audio_codec"]
+                # if it was possible to download video, we can safely assume the video is online.
+                # We have to set this here, in case we successfully downloaded a video which was flagged as online=2 (HTTP 403 error on first try)
+                video.online = video_status["online"]
                 session.add(video)
                 commit_with_retry()
-                sleep(60)
-            continue
-        if video_file == "forbidden":
-            continue
-        if video_file == "503":
-            remove_youtube_video_from_archive_file(str(video.video_id))
-            sleep(60)
-            continue
-        if video_file == "429":
-            set_status("429 paused")
-            set_http_429_state()
-            logger.error("Got HTTP 429 from youtube. Try restarting the proxy.")
-            http_429_counter += 1
-            if http_429_counter == 10:
-                if os.path.exists(config["base"]["download_lockfile"]):
-                    os.remove(config["base"]["download_lockfile"])
-                break
-            if config["youtube-dl"]["proxy"] != "":
-                restart_proxy()
-                sleep(20)
-                current_country = get_current_country()
-            continue
-        if video_file == "video_forbidden":
-            video.online = video_status["http_403"]
-            logger.info("Setting video status to forbidden. I you want to retry the download, add --retry-403")
-            session.add(video)
-            commit_with_retry()
-            continue
-        if video_file == "hate_speech":
-            video.online = video_status["hate_speech"]
-            session.add(video)
-            commit_with_retry()
-            continue
-        if video_file == "not_downloaded":
-            video.downloaded = None
-            session.add(video)
-            commit_with_retry()
-            continue
-        if video_file == "removed_by_uploader":
-            video.downloaded = None
-            video.online = video_status["offline"]
-            session.add(video)
-            commit_with_retry()
-            continue
-        if video_file == "offline":
-            video.downloaded = None
-            video.online = video_status["offline"]
-            session.add(video)
-            commit_with_retry()
-            continue
-        # get all the needed video infos
-        # check if video is really there
-        if not os.path.isfile(video_file):
-            logger.error(
-                "Could not find the downloaded video file. Maybe there was a problem during download. Will retry in next run.")
-            continue
-        video.downloaded = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
-        video.runtime = get_video_duration(video_file)
-        logger.debug("Video runtime was set to " + str(video.runtime) + " seconds")
-        video.resolution = get_video_resolution(video_file)
-        logger.debug("Video resolution was set to " + str(video.resolution))
-        if video.runtime is None and video.resolution is None:
-            logger.warning(
-                "The video file is incomplete. Will skip uploading and let the video on not downloaded state.")
-            continue
-        try:
-            video.size = os.path.getsize(video_file)
-        except:
-            logger.error("Could not find size for video " + str(video.video_id))
-            video.size = None
-        logger.debug("Video size was set to " + str(video.size) + " bytes")
-        # if it was possible to download video, we can safely assume the video is online.
-        # We have to set this here, in case we successfully downloaded a video which was flagged as online=2 (HTTP 403 error on first try)
-        video.online = video_status["online"]
-        session.add(video)
-        commit_with_retry()
-        http_429_counter = 0
-        logger.info("Video " + str(video.video_id) + " is downloaded.")
-        end_time = get_current_timestamp()
-        log_operation(end_time - start_time, "download_videos", "Downloaded video with ID " + video.video_id)
-        if video_file not in ["exists_already", "copyright"]:
-            rclone_upload()
-        if len(videos_not_downloaded.all()) > 1:
-            sleep(randint(int(config["youtube-dl"]["min_sleep_interval"]), int(config["youtube-dl"]["max_sleep_interval"])))
+                http_429_counter = 0
+                videos_downloaded_this_run += 1
+                # youtube-dl has already written the video to the archive file itself
+                download_archive.add(video.video_id, write=False)
+                rollups.mark_dates([datetime.utcnow().date()])
+                logger.info("Video " + str(video.video_id) + " is downloaded.")
+                log_operation(result["download_duration"], "download_videos", "Downloaded video with ID " + video.video_id)
+    if not upload_queue.empty():
+        set_status("uploading")
+        logger.info("Waiting for " + str(upload_queue.qsize()) + " queued uploads to finish.")
+    for upload_thread in upload_threads:
+        upload_queue.put(None)
+    for upload_thread in upload_threads:
+        upload_thread.join()
+    log_upload_results(upload_results)
+    download_archive.compact()
+    rollups.refresh()
     remove_download_lockfile()
+    log_statistic("download_queue_depth", str(get_videos_not_downloaded().count()))
     if video_file != "429":
         set_status("done")
     set_currently_downloading("Nothing")
+    if videos_downloaded_this_run > 0:
+        log_operation(get_current_timestamp() - run_start_time, "download_run", "Downloaded " + str(videos_downloaded_this_run) + " videos with " + str(workers) + " workers")
     return http_429_counter
 
 
@@ -1100,21 +1518,35 @@ def remove_download_lockfile():
 
 
 def get_current_country():
-    if config["youtube-dl"]["proxy"] != "":
-        proxies = {"http": config["youtube-dl"]["proxy"], "https": config["youtube-dl"]["proxy"]}
-        try:
-            r = requests.get("https://ipinfo.io", proxies=proxies)
-        except requests.exceptions.ConnectionError:
-            logger.error("Cannot get connection to ipinfo.io")
-            r = None
-    else:
-        r = requests.get("https://ipinfo.io")
-    if r is not None:
-        answer = json.loads(str(r.text))
-        current_country = answer["country"]
-    else:
-        current_country = ""
-    return current_country
+    identity = egress_identity.get(config["youtube-dl"]["proxy"])
+    if identity is None:
+        return ""
+    return identity["country"]
+
+
+def get_rclone_archive_size():
+    rclone_size_command = config["rclone"]["binary_path"] + " size " + repr(config["rclone"]["upload_target"] + ":" + config["rclone"]["upload_base_path"]) + " --json" + \
+                          (" --config " + repr(config["rclone"]["config_path"]) if config["rclone"]["config_path"] != "" else "")
+
+    logger.debug("rclone size command is: " + rclone_size_command)
+    logger.info("Getting rclone size of complete archive dir")
+    output = subprocess.run(rclone_size_command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    stdout = str(output.stdout.decode('utf-8'))
+    try:
+        size_json = json.loads(stdout)
+    except ValueError:
+        logger.error("Could not get archive size from rclone: " + str(output.stderr.decode('utf-8')))
+        return None
+    return size_json["bytes"]
+
+
+def archive_size_reconciliation_due():
+    # The complete remote is only listed with rclone size on a schedule. In between, the size is tracked from the uploads.
+    size_reconcile_interval_hours = float(config["rclone"].get("size_reconcile_interval_hours", 168))
+    last_reconciliation = runtime_state.get("archive_size_reconciled")
+    if size_reconcile_interval_hours <= 0 or last_reconciliation is None or runtime_state.get("archive_size") is None:
+        return True
+    return datetime.utcnow() - last_reconciliation.date >= timedelta(hours=size_reconcile_interval_hours)
 
 
 def generate_statistics(all_stats=False):
@@ -1123,19 +1555,25 @@ def generate_statistics(all_stats=False):
     if all_stats:
         statistics = "archive_size,videos_monitored,videos_downloaded"
     if "archive_size" in statistics:
-        start_time = get_current_timestamp()
-        rclone_size_command = config["rclone"]["binary_path"] + " size " + repr(config["rclone"]["upload_target"] + ":" + config["rclone"]["upload_base_path"]) + " --json" + \
-                              (" --config " + repr(config["rclone"]["config_path"]) if config["rclone"]["config_path"] != "" else "")
-
-        logger.debug("rclone size command is: " + rclone_size_command)
-        logger.info("Getting rclone size of complete archive dir")
-        output = subprocess.run(rclone_size_command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        stdout = str(output.stdout.decode('utf-8'))
-        size_json = json.loads(stdout)
-        size = size_json["bytes"]
-        log_statistic("archive_size", str(size))
-        end_time = get_current_timestamp()
-        log_operation(end_time - start_time, "statistics_archive_size", "Getting archive size via rclone")
+        tracked_archive_size = runtime_state.get("archive_size")
+        if archive_size_reconciliation_due():
+            start_time = get_current_timestamp()
+            size = get_rclone_archive_size()
+            end_time = get_current_timestamp()
+            log_operation(end_time - start_time, "statistics_archive_size", "Getting archive size via rclone")
+            if size is not None:
+                if tracked_archive_size is not None:
+                    # Difference between the size tracked from uploads and the real size of the remote
+                    drift = size - int(tracked_archive_size.value)
+                    logger.info("Tracked archive size was off by " + str(drift) + " bytes.")
+                    log_statistic("archive_size_drift", str(drift))
+                runtime_state.set("archive_size", str(size))
+                runtime_state.set("archive_size_reconciled", str(size))
+        else:
+            size = int(tracked_archive_size.value)
+            logger.debug("Using tracked archive size of " + str(size) + " bytes.")
+        if size is not None:
+            log_statistic("archive_size", str(size))
     if "videos_monitored" in statistics:
         start_time = get_current_timestamp()
         number_of_videos = session.query(func.count(Video.id)).scalar()
@@ -1150,13 +1588,33 @@ def generate_statistics(all_stats=False):
         log_operation(end_time - start_time, "statistics_videos_downloaded", "Getting archive size via rclone")
 
 
+def read_youtube_dl_output(process, stream, stream_name, lines, worker_name):
+    for line in stream:
+        line = line.rstrip("\n")
+        progress = youtube_dl_progress_pattern.match(line)
+        if progress is not None:
+            # Progress lines are only turned into metrics and not kept
+            metrics.download_progress.set(float(progress.group("percent")) / 100, worker=worker_name)
+            if progress.group("speed") is not None:
+                metrics.download_speed.set(float(progress.group("speed")) * byte_unit_factors.get(progress.group("speed_unit"), 1), worker=worker_name)
+            if progress.group("eta") is not None:
+                metrics.download_eta.set(sum(int(part) * 60 ** i for i, part in enumerate(reversed(progress.group("eta").split(":")))), worker=worker_name)
+            continue
+        lines.append(line)
+        abort_rule = outcome_classifier.abort_rule(stream_name, line)
+        if abort_rule is not None and process.poll() is None:
+            logger.info("youtube-dl reported \"" + abort_rule.pattern + "\". Stopping it instead of waiting for its retries.")
+            metrics.youtube_dl_aborts.inc(pattern=abort_rule.pattern)
+            try:
+                os.killpg(process.pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+
 def get_downloaded_video_name(youtube_dl_stdout):
     downloaded_file = None
-    youtube_dl_stdout = youtube_dl_stdout.decode('utf-8')
-    logger.debug("youtube-dl stdout: " + youtube_dl_stdout)
     youtube_dl_stdout = youtube_dl_stdout.splitlines()
     for line in youtube_dl_stdout:
-        logger.debug("Current line: " + str(line))
         line_found = re.findall(r'Merging formats into', line)
         if line_found:
             logger.debug("Found name in line: " + line)
@@ -1165,7 +1623,6 @@ def get_downloaded_video_name(youtube_dl_stdout):
             return downloaded_file
     # If no merged video found, get the MP4 destination
     for line in youtube_dl_stdout:
-        logger.debug("Current line: " + str(line))
         line_found = re.findall(r'\[download\] Destination:', line)
         if line_found:
             logger.debug("Found name in line: " + line)
@@ -1175,88 +1632,178 @@ def get_downloaded_video_name(youtube_dl_stdout):
     return "not_downloaded"
 
 
-def download_video(video_id, channel_name):
-    logger.debug('Escaped Channel name is ' + sanititze_string(channel_name))
-    youtube_dl_command = config["youtube-dl"]["binary_path"] + " --continue " + " -4 --download-archive " + config["youtube-dl"]["download-archive"] + " --output " + config["base"]["download_dir"] + "/\"" + channel_name + "\"/\"" + config["youtube-dl"]["naming-format"] + "\"" + " --ignore-config" + " --ignore-errors --merge-output-format mkv " + " --no-overwrites" + " --format \"" + config["youtube-dl"]["video-format"] + "\" --user-agent \"Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/81.0.4044.122 Safari/537.36\" " + config["youtube-dl"]["additional-options"]
-    if config["youtube-dl"]["proxy"] != "":
-        youtube_dl_command = youtube_dl_command + " --proxy " + config["youtube-dl"]["proxy"]
-    youtube_dl_command = youtube_dl_command + " https://youtu.be/" + video_id
-    logger.debug("youtube-dl command is: " + str(youtube_dl_command))
-    output = subprocess.run(youtube_dl_command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    logger.debug(str(output.stdout))
-    logger.debug(str(output.stderr))
-    if output.returncode != 0:
-        # Check if video was blocked due to general copyright issues
-        if "who has blocked it on copyright" in str(output.stderr):
-            logger.error("This video is blocked due to copyright reasons.")
-            downloaded_video_file = "copyright"
-            return downloaded_video_file
-        # Check if video was blocked due to copyright issues in own country
-        if "who has blocked it in your country on copyright grounds" in str(output.stderr):
-            logger.error("This video is blocked in your country due to copyright reasons.")
-            downloaded_video_file = "copyright"
-            return downloaded_video_file
-        if "unable to download video data: HTTP Error 403: Forbidden" in str(output.stderr):
-            logger.error("This video could not be downloaded")
-            return "video_forbidden"
-        if "HTTP Error 403: Forbidden" in str(output.stderr) or "Got server HTTP error: Downloaded" in str(output.stdout):
-            logger.error("Something could not be downloaded for video " + video_id)
-            downloaded_video_file = "video_forbidden"
-            return downloaded_video_file
-        if "HTTP Error 429" in str(output.stderr):
-            logger.error("Got HTTP 429 error. Stopping here for today.")
-            downloaded_video_file = "429"
-            return downloaded_video_file
-        if "HTTP Error 503" in str(output.stderr):
-            logger.error("Got HTTP 503 error. Will sleep for a while and continue with next video. This video will be downloaded again next run.")
-            downloaded_video_file = "503"
-            return downloaded_video_file
-        if "This video has been removed for violating YouTube's policy on hate speech" in str(output.stderr):
-            logger.error("This video is blocked in your current country. Try again from different country.")
-            downloaded_video_file = "hate_speech"
-            return downloaded_video_file
-        if "This video has been removed for violating YouTube's Community Guidelines" in str(output.stderr):
-            logger.error("This video is blocked in your current country. Try again from different country.")
-            downloaded_video_file = "hate_speech"
-            return downloaded_video_file
-        if "This video has been removed by the uploader" in str(output.stderr):
-            logger.error("This video has been removed by uploader")
-            downloaded_video_file = "removed_by_uploader"
-            return downloaded_video_file
-        if "This video is not available" in str(output.stderr):
-            logger.error("This video is not available anymore")
-            downloaded_video_file = "offline"
-            return downloaded_video_file
-        if "Video unavailable" in str(output.stderr):
-            logger.error("This video is not available anymore")
-            downloaded_video_file = "offline"
-            return downloaded_video_file
-        if "This video has been removed" in str(output.stderr):
-            logger.error("This video has been removed")
-            downloaded_video_file = "offline"
-            return downloaded_video_file
-        if "WARNING: video doesn't have subtitles" in str(output.stderr):
-            downloaded_video_file = get_downloaded_video_name(output.stdout)
-            logger.debug("Video name is " + downloaded_video_file)
-            return downloaded_video_file
-        if "Unable to extract video data" in str(output.stderr):
-            logger.error("This video has been removed")
-            downloaded_video_file = "offline"
-            return downloaded_video_file
-        if "Playback on other websites has been disabled by the video owner" in str(output.stderr):
-            logger.error("Playback on other websites has been disabled by the video owner")
-            downloaded_video_file = "video_forbidden"
-            return downloaded_video_file
-
-
-    if "has already been recorded in archive" in str(output.stdout):
-        logger.info("The video is already in youtube-dl archive file. We assume video is already downloaded. If not, remove from archive file.")
-        downloaded_video_file = "exists_already"
+def download_video(video_id, channel_name, download_dir=None):
+    start_time = get_current_timestamp()
+    downloaded_video_file = run_youtube_dl(video_id, channel_name, download_dir)
+    metrics.download_duration.observe(get_current_timestamp() - start_time)
+    if downloaded_video_file in download_outcomes:
+        metrics.downloads.inc(outcome=downloaded_video_file)
     else:
-        downloaded_video_file = get_downloaded_video_name(output.stdout)
+        metrics.downloads.inc(outcome="failed" if downloaded_video_file is None else "downloaded")
+    return downloaded_video_file
+
+
+def get_youtube_dl_arguments(video_id, channel_name, download_dir):
+    youtube_dl_arguments = ["--continue", "-4", "--download-archive", config["youtube-dl"]["download-archive"], "--output", download_dir + "/" + channel_name + "/" + config["youtube-dl"]["naming-format"],
+                            "--ignore-config", "--ignore-errors", "--merge-output-format", "mkv", "--no-overwrites", "--format", config["youtube-dl"]["video-format"],
+                            "--user-agent", "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/81.0.4044.122 Safari/537.36"]
+    # additional-options is written like on the command line
+    youtube_dl_arguments += shlex.split(config["youtube-dl"]["additional-options"])
+    if config["youtube-dl"]["proxy"] != "":
+        youtube_dl_arguments += ["--proxy", config["youtube-dl"]["proxy"]]
+    youtube_dl_arguments += ["--newline", "https://youtu.be/" + video_id]
+    return youtube_dl_arguments
+
+
+def run_youtube_dl(video_id, channel_name, download_dir=None):
+    if download_dir is None:
+        download_dir = config["base"]["download_dir"]
+    logger.debug('Escaped Channel name is ' + sanititze_string(channel_name))
+    youtube_dl_arguments = get_youtube_dl_arguments(video_id, channel_name, download_dir)
+    worker_name = os.path.basename(download_dir)
+    result = None
+    if embedded_downloader is not None:
+        try:
+            result = run_embedded_downloader(youtube_dl_arguments, worker_name)
+        except Exception as e:
+            logger.error("Embedded downloader failed for video " + video_id + ": " + str(e) + ". Retrying with the youtube-dl binary.")
+    if result is None:
+        # binary_path may contain more than one word, e.g. python3 -m youtube_dl
+        youtube_dl_command = config["youtube-dl"]["binary_path"] + " " + " ".join(shlex.quote(argument) for argument in youtube_dl_arguments)
+        logger.debug("youtube-dl command is: " + str(youtube_dl_command))
+        result = run_youtube_dl_process(youtube_dl_command, worker_name)
+    metrics.download_speed.set(0, worker=worker_name)
+    metrics.download_eta.set(0, worker=worker_name)
+    logger.debug(str(result["stdout"]))
+    logger.debug(str(result["stderr"]))
+    if result.get("outcome") is not None:
+        logger.error("youtube-dl failed for video " + video_id + " with " + str(result["error_class"]) + ": " + result["outcome"])
+        return result["outcome"]
+    # The text rules are only needed, if the error class did not tell the outcome already
+    rule = outcome_classifier.classify(result["stdout"], result["stderr"], result["failed"])
+    if rule is None or rule.outcome == "downloaded":
+        downloaded_video_file = result["video_file"] or get_downloaded_video_name(result["stdout"])
         logger.debug("Video name is " + downloaded_video_file)
         return downloaded_video_file
-    return downloaded_video_file
+    if rule.message is not None:
+        logger.log(logging.INFO if rule.outcome == "exists_already" else logging.ERROR, rule.message.format(video_id=video_id))
+    return rule.outcome
+
+
+def run_youtube_dl_process(youtube_dl_command, worker_name):
+    # youtube-dl runs in its own process group, so it can be stopped together with the shell around it
+    process = subprocess.Popen(youtube_dl_command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True, errors="replace", start_new_session=True)
+    stderr_lines = []
+    stderr_reader = threading.Thread(target=read_youtube_dl_output, args=(process, process.stderr, "stderr", stderr_lines, worker_name), daemon=True)
+    stderr_reader.start()
+    stdout_lines = []
+    read_youtube_dl_output(process, process.stdout, "stdout", stdout_lines, worker_name)
+    stderr_reader.join()
+    process.wait()
+    return {"video_file": None, "failed": process.returncode != 0, "stdout": "\n".join(stdout_lines), "stderr": "\n".join(stderr_lines)}
+
+
+def run_embedded_downloader(arguments, worker_name):
+    def report_progress(progress):
+        if progress.get("status") != "downloading":
+            return
+        total_bytes = progress.get("total_bytes") or progress.get("total_bytes_estimate")
+        if total_bytes:
+            metrics.download_progress.set(progress.get("downloaded_bytes", 0) / total_bytes, worker=worker_name)
+        if progress.get("speed") is not None:
+            metrics.download_speed.set(progress["speed"], worker=worker_name)
+        if progress.get("eta") is not None:
+            metrics.download_eta.set(progress["eta"], worker=worker_name)
+
+    return embedded_downloader.download(arguments, report_progress)
+
+
+def read_info_json(video_id, video_file):
+    # youtube-dl writes the info.json next to the video with the same name, when --write-info-json is set
+    info_json_file = os.path.splitext(video_file)[0] + ".info.json"
+    if not os.path.isfile(info_json_file):
+        logger.debug("Found no info.json for video " + str(video_id))
+        return None
+    try:
+        with open(info_json_file, "r") as f:
+            info = json.load(f)
+    except (OSError, ValueError) as e:
+        logger.warning("Could not read " + info_json_file + ": " + str(e))
+        return None
+    if info.get("id") != video_id:
+        logger.warning("info.json of video " + str(video_id) + " belongs to video " + str(info.get("id")) + ". Ignoring it.")
+        return None
+    return info
+
+
+def get_expected_video_size(info):
+    # Returns the size youtube-dl announced for the download and whether it is only an estimate
+    requested_formats = info.get("requested_formats") or []
+    if len(requested_formats) > 0:
+        sizes = [requested_format.get("filesize") or requested_format.get("filesize_approx") for requested_format in requested_formats]
+        if all(sizes):
+            return sum(sizes), not all(requested_format.get("filesize") for requested_format in requested_formats)
+        return None, True
+    if info.get("filesize"):
+        return info["filesize"], False
+    return info.get("filesize_approx"), True
+
+
+def info_json_matches_video_file(video_id, info, video_file, size):
+    # A download which broke off still gets its info.json, so the file itself is checked cheaply before the info.json values are trusted.
+    # Returns whether the file looks complete and the runtime, if it had to be probed for that.
+    expected_size, estimated = get_expected_video_size(info)
+    if expected_size and size is not None:
+        # Merging into mkv changes the size a bit, estimates can be far off
+        if size >= expected_size * (0.5 if estimated else 0.9):
+            return True, None
+        logger.warning("Video file of " + str(video_id) + " has " + str(size) + " bytes, but youtube-dl announced " + str(expected_size) + " bytes.")
+        return False, None
+    runtime = get_video_duration(video_file)
+    if runtime is None:
+        return False, None
+    if isinstance(info.get("duration"), (int, float)) and abs(runtime - info["duration"]) > max(2.0, info["duration"] * 0.02):
+        logger.warning("Video file of " + str(video_id) + " runs " + str(runtime) + " seconds, but info.json says " + str(info["duration"]) + " seconds.")
+        return False, runtime
+    return True, runtime
+
+
+def get_video_metadata(video_id, video_file):
+    # Takes everything from the info.json and only runs ffprobe for values which are missing there,
+    # or for runtime and resolution, if the video file does not match the info.json.
+    metadata = {"runtime": None, "resolution": None, "size": None, "video_format": None, "video_codec": None, "audio_codec": None}
+    try:
+        metadata["size"] = os.path.getsize(video_file)
+    except OSError:
+        logger.error("Could not find size for video " + str(video_id))
+    info = read_info_json(video_id, video_file) or {}
+    probed_runtime = None
+    use_info_json = len(info) > 0
+    if use_info_json:
+        use_info_json, probed_runtime = info_json_matches_video_file(video_id, info, video_file, metadata["size"])
+        if not use_info_json:
+            logger.warning("info.json and video file of " + str(video_id) + " do not match. Getting runtime and resolution from the file.")
+    requested_formats = info.get("requested_formats") or []
+    video_formats = [video_format for video_format in requested_formats if video_format.get("vcodec", "none") != "none"]
+    audio_formats = [audio_format for audio_format in requested_formats if audio_format.get("acodec", "none") != "none"]
+    if probed_runtime is not None:
+        metadata["runtime"] = probed_runtime
+    elif use_info_json and isinstance(info.get("duration"), (int, float)) and info["duration"] > 0:
+        metadata["runtime"] = float(info["duration"])
+    else:
+        metadata["runtime"] = get_video_duration(video_file)
+    width = info.get("width") or (video_formats[0].get("width") if video_formats else None)
+    height = info.get("height") or (video_formats[0].get("height") if video_formats else None)
+    if use_info_json and width and height:
+        metadata["resolution"] = str(width) + "x" + str(height)
+    else:
+        metadata["resolution"] = get_video_resolution(video_file)
+    metadata["video_format"] = info.get("format_id")
+    video_codec = info.get("vcodec") or (video_formats[0].get("vcodec") if video_formats else None)
+    audio_codec = info.get("acodec") or (audio_formats[0].get("acodec") if audio_formats else None)
+    metadata["video_codec"] = video_codec if video_codec != "none" else None
+    metadata["audio_codec"] = audio_codec if audio_codec != "none" else None
+    return metadata
 
 
 def get_video_duration(file):
@@ -1279,29 +1826,33 @@ def get_video_resolution(file):
     return str(resolution).strip()
 
 
-def rclone_upload():
+def rclone_upload(source_dir=None):
+    if source_dir is None:
+        source_dir = config["base"]["download_dir"]
     start_time = get_current_timestamp()
-    set_status("uploading")
     rclone_upload_command = config["rclone"]["binary_path"] + \
                             (" --config " + repr(config["rclone"]["config_path"]) if config["rclone"]["config_path"] != "" else "") + \
                             (" " + config["rclone"]["move_or_copy"] + " " if config["rclone"]["move_or_copy"] in ("move", "copy") else " move ") + \
-                            repr(config["base"]["download_dir"]) + " " + repr(config["rclone"]["upload_target"] + ":" + config["rclone"]["upload_base_path"]) + \
+                            repr(source_dir) + " " + repr(config["rclone"]["upload_target"] + ":" + config["rclone"]["upload_base_path"]) + \
                             (" --delete-empty-src-dirs " if config["rclone"]["move_or_copy"] in ("move", "") else "")
 
     logger.debug("rclone upload command is: " + rclone_upload_command)
     logger.info("Uploading files to rclone remote")
-    os.system(rclone_upload_command)
+    exit_status = os.system(rclone_upload_command)
     end_time = get_current_timestamp()
-    log_operation(end_time - start_time, "rclone_upload", "Uploaded files to rclone remote")
+    metrics.upload_duration.observe(end_time - start_time)
+    metrics.uploads.inc(result="succeeded" if exit_status == 0 else "failed")
+    return end_time - start_time, exit_status == 0
 
 
 def toggle_download_requirement():
     # check if one or both arguments for enabled and disabled set
-    video = Video()
     if enabled and disabled:
         logger.error("You can only use --disabled OR --enabled. Not both!")
+        return None
     if not enabled and not disabled:
         logger.error("You have to set either --disabled OR --enabled.")
+        return None
     # check if username variable is set
     if username is None:
         if channel_id is None:
@@ -1309,237 +1860,167 @@ def toggle_download_requirement():
         return None
     if channel_id is None:
         # Get the channel internal id based on channel name from DB if no channel_id is given
-        channel_internal_id = str(session.query(Channel.id).filter(Channel.channel_name == username).scalar())
-    else:
-        channel_internal_id = str(session.query(Channel.id).filter(Channel.channel_id == channel_id).scalar())
-    if channel_internal_id is not None:
-        logger.debug("Got channel id " + channel_internal_id + " for Username " + username)
-        # Get all playlists which are connected to channel internal ID
-        playlist_ids = session.query(Playlist.id).filter(Playlist.channel_id == channel_internal_id).all()
-        logger.debug("Found " + str(len(playlist_ids)) + " for channel " + username)
-        videos = []
-        if playlist_ids is not None:
-            for local_playlist_id in playlist_ids:
-                result = session.query(Video).filter(Video.playlist == local_playlist_id).all()
-                for entry in result:
-                    videos.append(entry)
-            if len(videos) > 0:
-                logger.debug("Found " + str(len(videos)) + " videos for channel " + username)
-                video: Video
-                for video in videos:
-                    if enabled:
-                        video.download_required = 1
-                    if disabled:
-                        video.download_required = 0
-                    session.add(video)
-                session.commit()
-                logger.info("Changed " + str(len(videos)) + " videos of channel " + username + " to download required " + str(video.download_required))
-            else:
-                logger.error("No videos for channel " + username + " found")
-        else:
-            logger.error("No playlists for channel " + username + " found")
+        channel_internal_id = session.query(Channel.id).filter(Channel.channel_name == username).scalar()
     else:
+        channel_internal_id = session.query(Channel.id).filter(Channel.channel_id == channel_id).scalar()
+    if channel_internal_id is None:
         logger.error("No channel with name" + username + " found")
+        return None
+    logger.debug("Got channel id " + str(channel_internal_id) + " for Username " + username)
+    download_required = 1 if enabled else 0
+    # Change all videos of all playlists which are connected to channel internal ID at once
+    channel_playlist_ids = session.query(Playlist.id).filter(Playlist.channel_id == channel_internal_id)
+    changed_videos = session.query(Video).filter(Video.playlist.in_(channel_playlist_ids)).update({Video.download_required: download_required}, synchronize_session=False)
+    commit_with_retry()
+    rollups.mark_channels([channel_internal_id])
+    if changed_videos > 0:
+        logger.info("Changed " + str(changed_videos) + " videos of channel " + username + " to download required " + str(download_required))
+    else:
+        logger.error("No videos for channel " + username + " found")
 
 
 def restart_proxy():
     os.system(config["base"]["proxy_restart_command"])
+    # The proxy has a new IP now
+    egress_identity.invalidate(config["youtube-dl"]["proxy"])
 
 
-def check_video_ids_for_offline_state(video_ids_to_check):
-    # Check for exceeded google quota
-    if check_quota_exceeded_state():
-        logger.error("Cannot proceed with getting data from youtube API. Quota exceeded.")
-        return None
-    youtube = googleapiclient.discovery.build(api_service_name, api_version, credentials=get_google_api_credentials())
-    request = youtube.videos().list(part="status", id=video_ids_to_check)
-    try:
-        response = request.execute()
-        add_quota(3)
-    except googleapiclient.errors.HttpError as error:
-        if "The request cannot be completed because you have exceeded your" in str(error):
-            set_quota_exceeded_state()
-        return None
+def check_video_ids_for_offline_state(video_ids_to_check, response):
+    unlisted_video_ids = []
+    online_video_ids = []
     for entry in response['items']:
         video_id = entry['id']
-        video = session.query(Video).filter(Video.video_id == video_id).scalar()
-        if video is not None:
-            google_video_status = entry['status']['privacyStatus']
-            if google_video_status == "unlisted":
-                video.online = video_status["unlisted"]
-                logger.info("Setting online state of video " + str(video_id) + " to unlisted, since video is still on youtube, but not in playlist anymore.")
-            else:
-                video.online = video_status["online"]
-                logger.info("Setting online state of video " + str(video_id) + " back to online, since video is still on youtube, but not in playlist anymore.")
-                video.online = video_status["online"]
-            session.add(video)
-        session.commit()
+        google_video_status = entry['status']['privacyStatus']
+        if google_video_status == "unlisted":
+            unlisted_video_ids.append(video_id)
+            logger.info("Setting online state of video " + str(video_id) + " to unlisted, since video is still on youtube, but not in playlist anymore.")
+        else:
+            online_video_ids.append(video_id)
+            logger.info("Setting online state of video " + str(video_id) + " back to online, since video is still on youtube, but not in playlist anymore.")
+    if len(unlisted_video_ids) + len(online_video_ids) == 0:
+        return None
+    session.query(Video).filter(Video.video_id.in_(unlisted_video_ids + online_video_ids)).update({Video.online: case([(Video.video_id.in_(unlisted_video_ids), video_status["unlisted"])], else_=video_status["online"])}, synchronize_session=False)
+    commit_with_retry()
+    rollups.mark_videos(unlisted_video_ids + online_video_ids)
 
 
 def verify_offline_videos():
     logger.info("Verifying offline video IDs against youtube API")
     # Get all videos with offline status 1 and 3 from database
-    videos_to_verify_offline_status = session.query(Video).filter(or_(Video.online == video_status["offline"], Video.online == video_status["hate_speech"], Video.online == video_status["unlisted"])).filter(Video.download_required == 1).all()
-    # if no offline videos are in database, stop here. nothing more to do.
-    if videos_to_verify_offline_status is None:
-        return None
-    logger.debug("Found " + str(len(videos_to_verify_offline_status)) + " offline videos")
-    i = 0
-    j = 0
-    google_api_id_limit = 50
-    video_ids_to_check = ""
-    while i < len(videos_to_verify_offline_status):
-        if j != 0:
-            video_ids_to_check = video_ids_to_check + ","
-        video_ids_to_check = str(video_ids_to_check + videos_to_verify_offline_status[i].video_id)
-        logger.debug("Found video ID " + str(videos_to_verify_offline_status[i].video_id) + " in offline videos.")
-        i += 1
-        j += 1
-        if j == google_api_id_limit or i == len(videos_to_verify_offline_status):
-            j = 0
-            check_video_ids_for_offline_state(video_ids_to_check)
-            video_ids_to_check = ""
-
-
-def check_channel_ids_for_offline_state(channel_ids_to_check):
-    # Check for exceeded google quota
-    if check_quota_exceeded_state():
-        logger.error("Cannot proceed with getting data from youtube API. Quota exceeded.")
-        return None
-    youtube = googleapiclient.discovery.build(api_service_name, api_version, credentials=get_google_api_credentials())
-    request = youtube.channels().list(part="status", id=channel_ids_to_check)
-    try:
-        response = request.execute()
-        add_quota(3)
-    except googleapiclient.errors.HttpError as error:
-        if "The request cannot be completed because you have exceeded your" in str(error):
-            set_quota_exceeded_state()
-        return None
-    online_ids = []
-    # Put all channel ID's received from youtube into a list
+    video_ids_to_verify_offline_status = [video_id for (video_id,) in session.query(Video.video_id).filter(or_(Video.online == video_status["offline"], Video.online == video_status["hate_speech"], Video.online == video_status["unlisted"])).filter(Video.download_required == 1)]
+    logger.debug("Found " + str(len(video_ids_to_verify_offline_status)) + " offline videos")
+    execute_in_id_batches(video_ids_to_verify_offline_status, lambda ids, youtube: youtube.videos().list(part="status", id=ids), 3, check_video_ids_for_offline_state)
+
+
+def set_channels_online_state(channel_internal_ids, online):
+    # Cascades the state of the channels to all their playlists and videos with one UPDATE per table
+    if len(channel_internal_ids) == 0:
+        return 0
+    channel_playlist_ids = session.query(Playlist.id).filter(Playlist.channel_id.in_(channel_internal_ids))
+    rollups.mark_channels(channel_internal_ids)
+    session.query(Channel).filter(Channel.id.in_(channel_internal_ids)).update({Channel.offline: None if online else 1}, synchronize_session=False)
+    session.query(Playlist).filter(Playlist.channel_id.in_(channel_internal_ids)).update({Playlist.monitored: 1 if online else 0}, synchronize_session=False)
+    return session.query(Video).filter(Video.playlist.in_(channel_playlist_ids)).update({Video.online: video_status["online"] if online else video_status["offline"]}, synchronize_session=False)
+
+
+def check_channel_ids_for_offline_state(channel_ids_to_check, response):
+    online_ids = set()
+    # Put all channel ID's received from youtube into a set
     for entry in response['items']:
-        online_ids.append(entry['id'])
+        online_ids.add(entry['id'])
         logger.debug("Found channel " + str(entry['id']) + " in online video list.")
-    channel_ids_to_check_list = channel_ids_to_check.split(",")
     logger.info("Updating online status of all channels.")
-    for local_channel_id in channel_ids_to_check_list:
-        channel = session.query(Channel).filter(Channel.channel_id == local_channel_id).scalar()
-        if channel is not None:
-            logger.debug("Updating online status of channel " + str(channel.channel_name))
-            if channel.channel_id not in online_ids and channel.offline is None:
-                logger.info("Channel " + str(channel.channel_name) + " is not online anymore. Setting status to offline.")
-                channel.offline = 1
-                session.add(channel)
-                channel_playlists = session.query(Playlist).filter(Playlist.channel_id == channel.id).all()
-                if channel_playlists is not None:
-                    logger.info("Getting all playlists for channel " + str(channel.channel_name) + " from database for setting them all unmonitored.")
-                    for playlist in channel_playlists:
-                        logger.debug("Setting playlist " + str(playlist.playlist_id) + " to unmonitored, since channel is not existing anymore.")
-                        playlist.monitored = 0
-                        session.add(playlist)
-                        playlists_videos = session.query(Video).filter(Video.playlist == playlist.id).all()
-                        if playlists_videos is not None:
-                            logger.info("Getting all videos for playlist " + str(playlist.playlist_name) + " of channel " + str(channel.channel_name) + " for setting them offline.")
-                            for video in playlists_videos:
-                                logger.debug("Setting video " + str(video.video_id) + " to state offline, since channel is not exsisting anymore.")
-                                video.online = 0
-                                session.add(video)
-
-            if channel.channel_id in online_ids and channel.offline is not None:
-                logger.info("Channel " + str(channel.channel_name) + " is online. Setting status to online.")
-                channel.offline = None
-                session.add(channel)
-                channel_playlists = session.query(Playlist).filter(Playlist.channel_id == channel.id).all()
-                if channel_playlists is not None:
-                    logger.info("Getting all playlists for channel " + str(channel.channel_name) + " from database for setting them all monitored.")
-                    for playlist in channel_playlists:
-                        logger.debug("Setting playlist " + str(playlist.playlist_id) + " to monitored, since channel is existing again.")
-                        playlist.monitored = 1
-                        session.add(playlist)
-                        playlists_videos = session.query(Video).filter(Video.playlist == playlist.id).all()
-                        if playlists_videos is not None:
-                            logger.info("Getting all videos for playlist " + str(playlist.playlist_name) + " of channel " + str(channel.channel_name) + " for setting them online again.")
-                            for video in playlists_videos:
-                                logger.debug("Setting video " + str(video.video_id) + " to state online, since channel is exsisting again.")
-                                video.online = 1
-                                session.add(video)
-        session.commit()
+    channels_gone_offline = []
+    channels_back_online = []
+    for channel in session.query(Channel.id, Channel.channel_id, Channel.channel_name, Channel.offline).filter(Channel.channel_id.in_(channel_ids_to_check)):
+        logger.debug("Updating online status of channel " + str(channel.channel_name))
+        if channel.channel_id not in online_ids and channel.offline is None:
+            logger.info("Channel " + str(channel.channel_name) + " is not online anymore. Setting status to offline and all its playlists to unmonitored and videos to offline.")
+            channels_gone_offline.append(channel.id)
+        if channel.channel_id in online_ids and channel.offline is not None:
+            logger.info("Channel " + str(channel.channel_name) + " is online. Setting status to online and all its playlists to monitored and videos to online.")
+            channels_back_online.append(channel.id)
+    videos_set_offline = set_channels_online_state(channels_gone_offline, False)
+    videos_set_online = set_channels_online_state(channels_back_online, True)
+    commit_with_retry()
+    if videos_set_offline + videos_set_online > 0:
+        logger.info("Set " + str(videos_set_offline) + " videos offline and " + str(videos_set_online) + " videos online.")
 
 
 def verify_channels():
     logger.info("Verifying channel status against youtube API for all channels")
     # Channels with without offline flag from database
-    channels_to_verify_online_status = session.query(Channel).filter(Channel.offline == None).all()
-    # if no offline videos are in database, stop here. nothing more to do.
-    if channels_to_verify_online_status is None:
-        return None
-    logger.debug("Found " + str(len(channels_to_verify_online_status)) + " channels which where online until now")
-    i = 0
-    j = 0
-    google_api_id_limit = 50
-    channel_ids_to_check = ""
-    while i < len(channels_to_verify_online_status):
-        if j != 0:
-            channel_ids_to_check = channel_ids_to_check + ","
-        channel_ids_to_check = str(channel_ids_to_check + channels_to_verify_online_status[i].channel_id)
-        logger.debug("Found channel ID " + str(channels_to_verify_online_status[i].channel_id) + " in online channels.")
-        i += 1
-        j += 1
-        if j == google_api_id_limit or i == len(channels_to_verify_online_status):
-            j = 0
-            check_channel_ids_for_offline_state(channel_ids_to_check)
-            channel_ids_to_check = ""
+    channel_ids_to_verify_online_status = [local_channel_id for (local_channel_id,) in session.query(Channel.channel_id).filter(Channel.offline == None)]
+    logger.debug("Found " + str(len(channel_ids_to_verify_online_status)) + " channels which where online until now")
+    execute_in_id_batches(channel_ids_to_verify_online_status, lambda ids, youtube: youtube.channels().list(part="status", id=ids), 3, check_channel_ids_for_offline_state)
+
+
+def escape_tsv_value(value):
+    # Names and titles may contain tabs and line breaks, which would break the rows. Missing values are empty fields.
+    if value is None:
+        return ""
+    return str(value).replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
 
 
 def list_playlists():
-    channels = session.query(Channel)
+    # Get channels, playlists and their video counts with one aggregated query
+    in_download_queue = and_(Video.downloaded == None, Video.download_required == 1, Video.online.in_([video_status["online"], video_status["unlisted"]]))
+    playlist_columns = [Channel.id, Channel.channel_name, Channel.channel_id, Playlist.id, Playlist.playlist_name, Playlist.playlist_id, Playlist.download_from_date, Playlist.monitored, Playlist.etag]
+    rows = session.query(*playlist_columns, func.count(Video.id), func.count(Video.downloaded), func.sum(case([(in_download_queue, 1)], else_=0)))
+    rows = rows.outerjoin(Playlist, Playlist.channel_id == Channel.id).outerjoin(Video, Video.playlist == Playlist.id)
     if username is not None:
-        channels = channels.filter(Channel.channel_name == username)
+        rows = rows.filter(Channel.channel_name == username)
     if channel_id is not None:
-        channels = channels.filter(Channel.channel_id == channel_id)
-    for channel in channels:
-        playlists = session.query(Playlist).filter(Playlist.channel_id == channel.id)
-        print(f'ID: {channel.id} Channel Name: {channel.channel_name} Youtube Channel-ID: {channel.channel_id}')
-        for playlist in playlists:
-            if playlist.download_from_date is None:
-                download_from_date = "All"
-            else:
-                download_from_date = str(playlist.download_from_date)
-            video_count = len(session.query(Video.id).filter(Video.playlist == playlist.id).all())
-            print(f'ID: {playlist.id} Playlist Name: {playlist.playlist_name} Youtube Playlist-ID: {playlist.playlist_id} Download From: {download_from_date} Monitored: {playlist.monitored} etag: {playlist.etag} Videos: {video_count}')
+        rows = rows.filter(Channel.channel_id == channel_id)
+    rows = rows.group_by(*playlist_columns).order_by(Channel.id, Playlist.id)
+    channels = OrderedDict()
+    for row in rows:
+        channel = channels.setdefault(row[0], {"id": row[0], "channel_name": row[1], "channel_id": row[2], "playlists": []})
+        if row[3] is None:
+            continue
+        channel["playlists"].append({"id": row[3], "playlist_name": row[4], "playlist_id": row[5], "download_from": None if row[6] is None else str(row[6]), "monitored": row[7], "etag": row[8],
+                                     "videos": row[9], "downloaded": row[10], "download_queue": int(row[11] or 0)})
+    if output_format == "json":
+        print(json.dumps(list(channels.values()), indent=2))
+        return None
+    if output_format == "tsv":
+        playlist_fields = ["id", "playlist_name", "playlist_id", "download_from", "monitored", "etag", "videos", "downloaded", "download_queue"]
+        print("\t".join(["channel_internal_id", "channel_name", "channel_id"] + playlist_fields))
+        for channel in channels.values():
+            for playlist in channel["playlists"]:
+                print("\t".join(escape_tsv_value(value) for value in [channel["id"], channel["channel_name"], channel["channel_id"]] + [playlist[field] for field in playlist_fields]))
+        return None
+    for channel in channels.values():
+        print(f'ID: {channel["id"]} Channel Name: {channel["channel_name"]} Youtube Channel-ID: {channel["channel_id"]}')
+        for playlist in channel["playlists"]:
+            download_from_date = "All" if playlist["download_from"] is None else playlist["download_from"]
+            print(f'ID: {playlist["id"]} Playlist Name: {playlist["playlist_name"]} Youtube Playlist-ID: {playlist["playlist_id"]} Download From: {download_from_date} Monitored: {playlist["monitored"]} etag: {playlist["etag"]} Videos: {playlist["videos"]} Downloaded: {playlist["downloaded"]} Download queue: {playlist["download_queue"]}')
         print('\n')
 
 
-def check_video_ids_for_upload_date(video_ids_to_check, download_date_limit=None):
-    # Check for exceeded google quota
-    if check_quota_exceeded_state():
-        logger.error("Cannot proceed with getting data from youtube API. Quota exceeded.")
-        return None
-    logger.debug("Getting upload date from google for the following video ids: " + str(video_ids_to_check))
-    youtube = googleapiclient.discovery.build(api_service_name, api_version, credentials=get_google_api_credentials())
-    request = youtube.videos().list(part="snippet", id=video_ids_to_check)
-    try:
-        response = request.execute()
-        add_quota(3)
-    except googleapiclient.errors.HttpError as error:
-        if "The request cannot be completed because you have exceeded your" in str(error):
-            set_quota_exceeded_state()
-        return None
+def check_video_ids_for_upload_date(video_ids_to_check, response, download_date_limit=None):
+    logger.debug("Got upload date from google for the following video ids: " + str(video_ids_to_check))
+    upload_dates = {}
+    download_required = {}
     for entry in response['items']:
         video_id = entry['id']
-        video = session.query(Video).filter(Video.video_id == video_id).scalar()
         google_published_at = entry["snippet"]["publishedAt"]
-        video.upload_date = datetime.strptime(str(google_published_at)[0:19], '%Y-%m-%dT%H:%M:%S')
-        logger.debug("Set upload date of video " + str(video.video_id) + " to " + str(video.upload_date))
+        upload_dates[video_id] = datetime.strptime(str(google_published_at)[0:19], '%Y-%m-%dT%H:%M:%S')
+        logger.debug("Set upload date of video " + str(video_id) + " to " + str(upload_dates[video_id]))
         if download_date_limit is not None:
-            if video.upload_date >= download_date_limit:
-                logger.debug("Video " + str(video.video_id) + " uploaded date " + str(video.upload_date) + " is newer then given limit date " + str(download_date_limit) + ". Setting download required for video to 1")
-                video.download_required = 1
+            if upload_dates[video_id] >= download_date_limit:
+                logger.debug("Video " + str(video_id) + " uploaded date " + str(upload_dates[video_id]) + " is newer then given limit date " + str(download_date_limit) + ". Setting download required for video to 1")
+                download_required[video_id] = 1
             else:
-                video.download_required = 0
-                logger.debug("Video " + str(video.video_id) + " uploaded date " + str(video.upload_date) + " is older then given limit date " + str(download_date_limit) + ". Setting download required for video to 0")
-            session.add(video)
-    session.commit()
+                download_required[video_id] = 0
+                logger.debug("Video " + str(video_id) + " uploaded date " + str(upload_dates[video_id]) + " is older then given limit date " + str(download_date_limit) + ". Setting download required for video to 0")
+    if len(upload_dates) == 0:
+        return None
+    values = {Video.upload_date: case(upload_dates, value=Video.video_id)}
+    if download_date_limit is not None:
+        values[Video.download_required] = case(download_required, value=Video.video_id)
+    session.query(Video).filter(Video.video_id.in_(list(upload_dates))).update(values, synchronize_session=False)
+    commit_with_retry()
 
 
 def modify_playlist():
@@ -1555,163 +2036,46 @@ def modify_playlist():
         download_from = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
     if download_from == "all":
         playlist.download_from_date = None
-        videos = session.query(Video).filter(Video.playlist == playlist.id)
-        for video in videos:
-            video.download_required = 1
-            session.add(video)
-        session.commit()
+        changed_videos = session.query(Video).filter(Video.playlist == playlist.id).update({Video.download_required: 1}, synchronize_session=False)
+        logger.debug("Set download required for " + str(changed_videos) + " videos to 1")
+        session.add(playlist)
+        commit_with_retry()
     if download_from is not None and download_from != "all":
         playlist.download_from_date = datetime.strptime(str(download_from), '%Y-%m-%d %H:%M:%S')
-        videos = session.query(Video).filter(Video.playlist == playlist.id)
-        videos_without_upload_date = []
-        for video in videos:
-            if video.upload_date is None:
-                logger.debug("Video " + str(video.video_id) + " does not have an upload date. Have to check later.")
-                videos_without_upload_date.append(video)
-                continue
-            else:
-                if video.upload_date >= playlist.download_from_date:
-                    logger.debug("Video " + str(video.video_id) + " uploaded date " + str(video.upload_date) + " is newer then playlist download from date " + str(playlist.download_from_date) + ". Setting download required for video to 1")
-                    video.download_required = 1
-                else:
-                    logger.debug("Video " + str(video.video_id) + " uploaded date " + str(video.upload_date) + " is older then playlist download from date " + str(playlist.download_from_date) + ". Setting download required for video to 0")
-                    video.download_required = 0
-                session.add(video)
-                session.commit()
-        logger.debug("Found " + str(len(videos_without_upload_date)) + " videos without upload date.")
-        i = 0
-        j = 0
-        google_api_id_limit = 50
-        video_ids_to_check = ""
-        while i < len(videos_without_upload_date):
-            if j != 0:
-                video_ids_to_check = video_ids_to_check + ","
-            video_ids_to_check = str(video_ids_to_check + videos_without_upload_date[i].video_id)
-            logger.debug("Found video ID " + str(videos_without_upload_date[i].video_id) + " in videos without upload date.")
-            i += 1
-            j += 1
-            if j == google_api_id_limit or i == len(videos_without_upload_date):
-                j = 0
-                check_video_ids_for_upload_date(video_ids_to_check, playlist.download_from_date)
-                video_ids_to_check = ""
+        # Videos which are newer than the playlist download from date are required, older ones not
+        changed_videos = session.query(Video).filter(Video.playlist == playlist.id).filter(Video.upload_date != None).update({Video.download_required: case([(Video.upload_date >= playlist.download_from_date, 1)], else_=0)}, synchronize_session=False)
+        logger.debug("Updated download required for " + str(changed_videos) + " videos based on playlist download from date " + str(playlist.download_from_date))
+        session.add(playlist)
+        commit_with_retry()
+        # Only videos without upload date have to be checked against the youtube API
+        video_ids_without_upload_date = [local_video_id for (local_video_id,) in session.query(Video.video_id).filter(Video.playlist == playlist.id).filter(Video.upload_date == None)]
+        logger.debug("Found " + str(len(video_ids_without_upload_date)) + " videos without upload date.")
+        execute_in_id_batches(video_ids_without_upload_date, lambda ids, youtube: youtube.videos().list(part="snippet", id=ids), 3, partial(check_video_ids_for_upload_date, download_date_limit=playlist.download_from_date))
     if monitored == 1 or monitored == 0:
         playlist.monitored = monitored
         logger.info('Set monitored flag of the playlist to ' + str(playlist.monitored))
     session.add(playlist)
     session.commit()
+    rollups.mark_channels([playlist.channel_id])
 
 
 def verify_and_update_data_model():
-    current_data_model_version_stat: Statistic = session.query(Statistic).filter(Statistic.statistic_type == "data_model_version").scalar()
-    logger.debug("Current data model: " + str(current_data_model_version_stat))
-    if current_data_model_version_stat is None:
-        logger.debug("Current data model is None. Updating to v1.")
-        current_data_model_version_stat = Statistic()
-        current_data_model_version = 1
-        current_data_model_version_stat.statistic_value = str(current_data_model_version)
-        current_data_model_version_stat.statistic_type = "data_model_version"
-        current_data_model_version_stat.statistic_date = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
-        with engine.connect() as con:
-            try:
-                rs = con.execute('ALTER TABLE playlists ADD download_from_date DATETIME NULL DEFAULT NULL AFTER channel_id;')
-                rs = con.execute('ALTER TABLE videos ADD upload_date DATETIME NULL DEFAULT NULL AFTER download_required;')
-                logger.info("Data model has been updated to " + str(current_data_model_version))
-            except sqlalchemy.exc.OperationalError:
-                logger.info("Table columns are already existing.")
-        session.add(current_data_model_version_stat)
-        session.commit()
-
-    current_data_model_version_stat: Statistic = session.query(Statistic).filter(Statistic.statistic_type == "data_model_version").scalar()
-    logger.debug("Current data model: " + str(current_data_model_version_stat))
-    if current_data_model_version_stat.statistic_value == "1":
-        logger.debug("Current data model is None. Updating to v2.")
-        current_data_model_version = 2
-        current_data_model_version_stat.statistic_value = str(current_data_model_version)
-        current_data_model_version_stat.statistic_type = "data_model_version"
-        current_data_model_version_stat.statistic_date = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
-        with engine.connect() as con:
-            try:
-                rs = con.execute('ALTER TABLE channels ADD offline INT NULL AFTER channel_name;')
-                logger.info("Data model has been updated to " + str(current_data_model_version))
-            except sqlalchemy.exc.OperationalError:
-                logger.info("Table columns are already existing.")
-        session.add(current_data_model_version_stat)
-        session.commit()
-
-    current_data_model_version_stat: Statistic = session.query(Statistic).filter(Statistic.statistic_type == "data_model_version").scalar()
-    logger.debug("Current data model: " + str(current_data_model_version_stat))
-    if current_data_model_version_stat.statistic_value == "2":
-        logger.debug("Current data model is None. Updating to v3.")
-        current_data_model_version = 3
-        current_data_model_version_stat.statistic_value = str(current_data_model_version)
-        current_data_model_version_stat.statistic_type = "data_model_version"
-        current_data_model_version_stat.statistic_date = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
-        with engine.connect() as con:
-            try:
-                rs = con.execute('ALTER TABLE playlists ADD etag VARCHAR(255) NULL AFTER download_from_date;')
-                logger.info("Data model has been updated to " + str(current_data_model_version))
-            except sqlalchemy.exc.OperationalError:
-                logger.info("Table columns are already existing.")
-        session.add(current_data_model_version_stat)
-        session.commit()
-
-    current_data_model_version_stat: Statistic = session.query(Statistic).filter(
-        Statistic.statistic_type == "data_model_version").scalar()
-    logger.debug("Current data model: " + str(current_data_model_version_stat))
-    if current_data_model_version_stat.statistic_value == "3":
-        logger.debug("Current data model is None. Updating to v4.")
-        current_data_model_version = 4
-        current_data_model_version_stat.statistic_value = str(current_data_model_version)
-        current_data_model_version_stat.statistic_type = "data_model_version"
-        current_data_model_version_stat.statistic_date = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
-        with engine.connect() as con:
-            try:
-                rs = con.execute(
-                    'ALTER TABLE channels ADD channel_country VARCHAR(255) NULL DEFAULT NULL AFTER offline; ')
-                logger.info("Data model has been updated to " + str(current_data_model_version))
-                session.add(current_data_model_version_stat)
-                session.commit()
-            except sqlalchemy.exc.OperationalError:
-                logger.info("Table columns are already existing.")
+    applied_versions = migrate(engine, session)
+    if 4 in applied_versions:
         add_missing_channel_countries()
+    if 9 in applied_versions:
+        logger.info("Building rollup tables for the dashboards.")
+        rollups.rebuild()
 
 
 def add_missing_channel_countries():
-    channels_without_country = session.query(Channel).filter(Channel.channel_country == None).all()
-    if channels_without_country is None:
-        pass
-    else:
-        logger.debug(
-            "Found " + str(len(channels_without_country)) + " channels which do not have a country attribute yet")
-        i = 0
-        j = 0
-        google_api_id_limit = 50
-        channel_ids_to_check = ""
-        while i < len(channels_without_country):
-            if j != 0:
-                channel_ids_to_check = channel_ids_to_check + ","
-            channel_ids_to_check = str(channel_ids_to_check + channels_without_country[i].channel_id)
-            logger.debug(
-                "Found channel ID " + str(channels_without_country[i].channel_id) + " in channels without country.")
-            i += 1
-            j += 1
-            if j == google_api_id_limit or i == len(channels_without_country):
-                j = 0
-                check_channel_countries(channel_ids_to_check)
-                channel_ids_to_check = ""
-
-
-def check_channel_countries(channel_ids):
-    youtube = googleapiclient.discovery.build(api_service_name, api_version, credentials=get_google_api_credentials())
-    logger.debug("Excuting youtube API call for getting channel name and country")
-    request = youtube.channels().list(part="brandingSettings", id=channel_ids)
-    try:
-        response = request.execute()
-        add_quota(3)
-    except googleapiclient.errors.HttpError as error:
-        if "The request cannot be completed because you have exceeded your" in str(error):
-            set_quota_exceeded_state()
-        return None
+    channel_ids_without_country = [local_channel_id for (local_channel_id,) in session.query(Channel.channel_id).filter(Channel.channel_country == None)]
+    logger.debug("Found " + str(len(channel_ids_without_country)) + " channels which do not have a country attribute yet")
+    execute_in_id_batches(channel_ids_without_country, lambda ids, youtube: youtube.channels().list(part="brandingSettings", id=ids), 3, check_channel_countries)
+
+
+def check_channel_countries(channel_ids, response):
+    channel_countries = {}
     for item in response["items"]:
         local_channel_id = item["id"]
         youtube_channel_name = item["brandingSettings"]["channel"]["title"]
@@ -1723,13 +2087,12 @@ def check_channel_countries(channel_ids):
         except KeyError:
             logger.warning(f"Could not get a country from youtube API for channel {youtube_channel_name}")
             continue
-        channel = session.query(Channel).filter(Channel.channel_id == local_channel_id).scalar()
-        if channel is None:
-            continue
-        channel.channel_country = channel_country
-        logger.debug(f"Found {channel_country} for channel {channel.channel_name}.")
-        session.add(channel)
-    session.commit()
+        channel_countries[local_channel_id] = channel_country
+        logger.debug(f"Found {channel_country} for channel {youtube_channel_name}.")
+    if len(channel_countries) == 0:
+        return None
+    session.query(Channel).filter(Channel.channel_id.in_(list(channel_countries))).update({Channel.channel_country: case(channel_countries, value=Channel.channel_id)}, synchronize_session=False)
+    commit_with_retry()
 
 
 def modify_channel():
@@ -1796,6 +2159,11 @@ def add_playlist():
 signal.signal(signal.SIGINT, signal_handler)
 
 verify_and_update_data_model()
+runtime_state.load()
+egress_identity.load()
+atexit.register(runtime_state.flush)
+atexit.register(telemetry.flush)
+start_metrics_exporter()
 if reset_quota_exceeded_state:
     clear_quota_exceeded_state()
 
@@ -1852,4 +2220,10 @@ if mode == "add_playlist":
 if mode == "verify_channels":
     verify_channels()
 
+if mode == "rebuild_rollups":
+    rollups.rebuild()
+    logger.info("Rebuilt channel and daily rollup tables.")
+
+rollups.refresh()
+
 persist_quota()